@@ -0,0 +1,291 @@
+# 批量评测：从JSONL读取问题，用有界的线程/进程池运行baseline和method1，结果逐条追加写入JSONL，
+# 中断后重新运行会跳过已完成的(问题, 方法)，结束时输出吞吐量和各阶段耗时分位数
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from method1.tools import setup_logger
+
+DEFAULT_METHODS = ("baseline", "method1")
+DEFAULT_WORKERS = 4
+DEFAULT_SCENE_TAG = "wlyh"
+DEFAULT_OUTPUT = "outputs/batch_results.jsonl"
+PERCENTILES = (50, 95, 99)
+
+logger = setup_logger("BatchRunner", logging.INFO)
+
+
+def _run_baseline(complex_query, scene_tag, k):
+    from test_function import baseline_test
+    subquestions, subquestions_docs, _, final_answer, final_prompt, time_stats = \
+        baseline_test(complex_query, scene_tag, k)
+    return {"final_answer": final_answer, "final_prompt": final_prompt,
+            "subquestions": subquestions, "subquestions_docs": subquestions_docs,
+            "timestatus": time_stats}
+
+
+def _method1_record(result):
+    subquestions, _, _, checked_subquestions_docs_subanswer, _, final_answer, final_prompt, \
+        time_stats = result
+    return {"final_answer": final_answer, "final_prompt": final_prompt,
+            "subquestions": subquestions,
+            "checked_subquestions_docs_subanswer": checked_subquestions_docs_subanswer,
+            "timestatus": time_stats}
+
+
+def _run_method1(complex_query, scene_tag, k):
+    from test_function import method1_test
+    return _method1_record(method1_test(complex_query, scene_tag, k))
+
+
+def _run_method1_async(complex_query, scene_tag, k):
+    from test_function import method1_async_test
+    return _method1_record(method1_async_test(complex_query, scene_tag, k))
+
+
+def _warmup_worker():
+    from method1.main import warmup
+    warmup()
+
+
+# 方法名 -> 运行函数，返回与outputs/*.json相同字段的记录
+METHODS = {
+    "baseline": _run_baseline,
+    "method1": _run_method1,
+    "method1_async": _run_method1_async,
+}
+
+
+def query_id(item):
+    """
+    问题编号：输入中有id字段时使用该字段，否则为问题和场景标签的hash
+    """
+    if item.get("id") is not None:
+        return str(item["id"])
+    key = json.dumps([item["complex_query"], item.get("scene_tag")], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def load_queries(path, default_scene_tag=DEFAULT_SCENE_TAG):
+    """
+    读取JSONL，每行包含complex_query，可选reference_answer、scene_tag、id
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("complex_query"):
+                raise ValueError(f"{path}第{line_no}行缺少complex_query")
+            item.setdefault("scene_tag", default_scene_tag)
+            item["id"] = query_id(item)
+            items.append(item)
+    return items
+
+
+def _summary_fields(record):
+    # 汇总只需要这些字段，断点中的记录不保留prompt和文档
+    return {key: record[key] for key in ("id", "method", "elapsed", "timestatus", "error")
+            if key in record}
+
+
+def load_checkpoint(path):
+    """
+    读取已有的结果文件作为断点：返回成功完成的(问题编号, 方法)集合和已有记录（只含汇总所需字段）。
+    进程崩溃时最后一行可能只写了一半，这部分会被截掉，之后从完整的行末尾继续追加
+    """
+    done, records = set(), []
+    if not os.path.exists(path):
+        return done, records
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_end += len(line)
+            records.append(_summary_fields(record))
+            if "error" not in record:
+                done.add((record["id"], record["method"]))
+    if valid_end < os.path.getsize(path):
+        logger.warning(f"截掉结果文件末尾不完整的{os.path.getsize(path) - valid_end}字节")
+        with open(path, "rb+") as f:
+            f.truncate(valid_end)
+    return done, records
+
+
+def run_task(item, method, k):
+    """
+    运行单个(问题, 方法)，异常被记录在error字段中而不是抛出。进程池中也在子进程里调用
+    """
+    record = {"id": item["id"], "method": method, "complex_query": item["complex_query"],
+              "reference_answer": item.get("reference_answer"), "scene_tag": item["scene_tag"]}
+    start_time = time.time()
+    try:
+        record.update(METHODS[method](item["complex_query"], item["scene_tag"], k))
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = time.time() - start_time
+    record["finished_at"] = time.time()
+    return record
+
+
+def _percentiles(values):
+    import numpy as np
+    if not values:
+        return {"count": 0}
+    stats = {"count": len(values), "mean": float(np.mean(values))}
+    for p in PERCENTILES:
+        stats[f"p{p}"] = float(np.percentile(values, p))
+    return stats
+
+
+def summarize(records, wall_seconds=None, completed=None):
+    """
+    汇总结果：每个方法的成功/失败数、单个问题总耗时和各阶段耗时的分位数（秒）。
+    同一(问题, 方法)有多条记录（失败后重跑）时只取最后一条。
+    wall_seconds和completed为本次运行的墙钟时间和完成数，用于计算吞吐量（问题/分钟）
+    """
+    latest = {}
+    for record in records:
+        latest[(record["id"], record["method"])] = record
+
+    methods = {}
+    for (_, method), record in latest.items():
+        entry = methods.setdefault(method, {"queries": 0, "failed": 0, "elapsed": [], "stages": {}})
+        entry["queries"] += 1
+        if "error" in record:
+            entry["failed"] += 1
+            continue
+        entry["elapsed"].append(record["elapsed"])
+        for stage, seconds in record.get("timestatus") or []:
+            entry["stages"].setdefault(stage, []).append(seconds)
+
+    summary = {"methods": {}}
+    for method, entry in sorted(methods.items()):
+        summary["methods"][method] = {
+            "queries": entry["queries"],
+            "failed": entry["failed"],
+            "elapsed": _percentiles(entry["elapsed"]),
+            "stages": {stage: _percentiles(values) for stage, values in entry["stages"].items()},
+        }
+    if wall_seconds is not None:
+        summary["run"] = {
+            "completed": completed,
+            "wall_seconds": wall_seconds,
+            "queries_per_minute": completed / wall_seconds * 60 if wall_seconds else 0.0,
+        }
+    return summary
+
+
+def run_batch(items, methods=DEFAULT_METHODS, output=DEFAULT_OUTPUT, workers=DEFAULT_WORKERS,
+              executor="thread", k=5, resume=True, store=None):
+    """
+    批量运行并逐条追加写入output。
+
+    Args:
+        items (list): load_queries的结果
+        methods (tuple): 要运行的方法，见METHODS
+        workers (int): 同时运行的(问题, 方法)数
+        executor (str): "thread"（LLM和检索请求以IO为主，默认）或"process"（绕开GIL，
+            各进程有独立的连接池和缓存）
+        resume (bool): 跳过output中已成功完成的(问题, 方法)；False时清空output重新运行
+        store (str): 结果存储目录（见method1.result_store），本次完成的记录同时追加写入
+
+    Returns:
+        dict: summarize的结果，run字段只统计本次运行
+    """
+    unknown = [method for method in methods if method not in METHODS]
+    if unknown:
+        raise ValueError(f"未知的方法: {unknown}，可选: {sorted(METHODS)}")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    if resume:
+        done, records = load_checkpoint(output)
+    else:
+        done, records = set(), []
+        open(output, "w").close()
+
+    tasks = [(item, method) for item in items for method in methods
+             if (item["id"], method) not in done]
+    total = len(items) * len(methods)
+    logger.info(f"共{total}个任务，已完成{total - len(tasks)}个，本次运行{len(tasks)}个")
+
+    if executor == "process":
+        # 各worker进程启动时并行完成导入和客户端创建，不计入第一个任务的耗时
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_warmup_worker)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    result_store = None
+    if store:
+        from method1.result_store import ResultStore
+        result_store = ResultStore(store)
+    # Parquet格式的存储缓冲未写出的行，出错退出时也要close
+    start_time = time.time()
+    completed = 0
+    with pool, open(output, "a", encoding="utf-8") as f, result_store or contextlib.nullcontext():
+        # 在途任务数不超过2倍worker数，避免一次性提交全部任务
+        pending, queue = set(), iter(tasks)
+        while True:
+            while len(pending) < 2 * workers:
+                task = next(queue, None)
+                if task is None:
+                    break
+                pending.add(pool.submit(run_task, *task, k))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                if result_store is not None:
+                    result_store.append(record, source=os.path.basename(output))
+                records.append(_summary_fields(record))
+                completed += 1
+                status = f"失败 {record['error']}" if "error" in record else "完成"
+                logger.info(f"[{completed}/{len(tasks)}] {record['method']} {record['id']} "
+                            f"{status} {record['elapsed']:.1f}秒")
+    wall_seconds = time.time() - start_time
+    return summarize(records, wall_seconds, completed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量运行baseline/method1并输出JSONL结果")
+    parser.add_argument("input", help="问题JSONL，每行包含complex_query，可选reference_answer、scene_tag、id")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="结果JSONL，同时作为断点文件")
+    parser.add_argument("-m", "--methods", default=",".join(DEFAULT_METHODS),
+                        help=f"逗号分隔的方法，可选: {','.join(METHODS)}")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread")
+    parser.add_argument("-k", type=int, default=5, help="每个子问题检索的文档数")
+    parser.add_argument("--scene-tag", default=DEFAULT_SCENE_TAG, help="输入中没有scene_tag时使用")
+    parser.add_argument("--no-resume", action="store_true", help="清空已有结果重新运行")
+    parser.add_argument("--summary", help="汇总结果另存为JSON文件")
+    parser.add_argument("--store", help="结果存储目录，完成的记录同时追加写入（见method1.result_store）")
+    args = parser.parse_args(argv)
+
+    items = load_queries(args.input, args.scene_tag)
+    summary = run_batch(items, tuple(m.strip() for m in args.methods.split(",") if m.strip()),
+                        args.output, args.workers, args.executor, args.k, not args.no_resume,
+                        args.store)
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    print(text)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
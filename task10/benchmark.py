@@ -0,0 +1,269 @@
+# 可复现的性能基准：启动回放outputs/*.json的本地LLM和检索mock，在不同并发下运行baseline和method1，
+# 输出各阶段耗时分位数、每个问题的调用次数和prompt字节数、吞吐量，报告为JSON便于回归对比
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_runner
+import mock_servers
+from method1 import scheduler, tools, tracing
+from method1.semantic_cache import configure_semantic_cache
+
+DEFAULT_METHODS = ("baseline", "method1")
+DEFAULT_CONCURRENCY = (1, 4)
+DEFAULT_REPEATS = 2
+DEFAULT_REPORT = "outputs/benchmark_report.json"
+# 回归判定：越小越好的指标增加超过该比例、越大越好的指标下降超过该比例视为回归
+REGRESSION_TOLERANCE = 0.1
+# 对比时检查的指标：(指标路径, 越大越好)
+COMPARED_METRICS = (
+    (("elapsed", "p50"), False),
+    (("elapsed", "p95"), False),
+    (("elapsed", "p99"), False),
+    (("queries_per_minute",), True),
+    (("llm_calls_per_query",), False),
+    (("retrievals_per_query",), False),
+    (("prompt_bytes_per_query",), False),
+)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def configure_clients(llm_server, rag_server, pool_size=tools.LLM_POOL_SIZE, use_cache=False,
+                      max_retries=0):
+    """
+    让共享的LLM客户端池和检索客户端指向mock服务；默认关闭各级缓存，保证每次运行都实际发出请求
+    """
+    tools.configure_llm_pool(api_key="mock", base_url=f"{llm_server.address}/v1", model="mock",
+                             pool_size=pool_size, max_retries=max_retries)
+    tools.configure_retrieval_client(url=f"{rag_server.address}{mock_servers.RAG_PATH}",
+                                     proxies=None, pool_size=pool_size)
+    tools.configure_llm_cache(enabled=use_cache)
+    tools.configure_retrieval_cache(enabled=use_cache)
+    configure_semantic_cache(enabled=use_cache)
+
+
+def run_case(items, method, concurrency, k, llm_server, rag_server):
+    """
+    以给定并发运行一组问题，返回该(方法, 并发)的报告
+    """
+    llm_server.stats.reset()
+    rag_server.stats.reset()
+    tracing.reset_tracing()
+    scheduler.reset_scheduler_stats()
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        records = list(pool.map(lambda item: batch_runner.run_task(item, method, k), items))
+    wall_seconds = time.time() - start_time
+
+    summary = batch_runner.summarize(records, wall_seconds, len(records))
+    method_summary = summary["methods"][method]
+    llm, rag = llm_server.stats.snapshot(), rag_server.stats.snapshot()
+    n = len(records)
+    result = {
+        "method": method,
+        "concurrency": concurrency,
+        "queries": n,
+        "failed": method_summary["failed"],
+        "errors": sorted({record["error"] for record in records if "error" in record})[:5],
+        "wall_seconds": wall_seconds,
+        "queries_per_minute": summary["run"]["queries_per_minute"],
+        "llm_calls_per_query": llm["requests"] / n,
+        "rate_limited_per_query": llm["rate_limited"] / n,
+        "llm_calls_by_type": {kind: count / n for kind, count in sorted(llm["by_type"].items())},
+        "retrievals_per_query": rag["requests"] / n,
+        "prompt_bytes_per_query": llm["prompt_bytes"] / n,
+        "prompt_tokens_per_query": llm["prompt_tokens"] / n,
+        "completion_tokens_per_query": llm["completion_tokens"] / n,
+        "elapsed": method_summary["elapsed"],
+        "stages": method_summary["stages"],
+    }
+    if scheduler.get_scheduler() is not None:
+        result["scheduler"] = scheduler.scheduler_stats()
+    if tracing.tracing_enabled():
+        result["tracing"] = tracing.tracing_summary()
+    return result
+
+
+def run_benchmark(methods=DEFAULT_METHODS, concurrency=DEFAULT_CONCURRENCY, repeats=DEFAULT_REPEATS,
+                  outputs="../outputs/*.json", k=5, scene_tag="wlyh", latency=None,
+                  retrieval_latency=mock_servers.DEFAULT_RETRIEVAL_LATENCY, use_cache=False,
+                  rpm_limit=None, max_retries=0):
+    """
+    运行完整基准。
+
+    Args:
+        methods (tuple): 方法名，见batch_runner.METHODS
+        concurrency (tuple): 依次测试的并发数
+        repeats (int): 每个记录的问题重复运行的次数
+        outputs (str): 回放记录的glob
+        latency (mock_servers.LatencyModel): LLM mock的延迟模型
+        retrieval_latency (float): 检索mock的固定延迟（秒）
+        use_cache (bool): 是否启用LLM/检索/语义缓存，默认关闭
+        rpm_limit (int): LLM mock模拟的服务端RPM限流，None表示不限流
+        max_retries (int): LLM客户端的重试次数（包括429），默认0
+
+    Returns:
+        dict: {"meta": 运行环境与配置, "results": [每个(方法, 并发)的报告]}
+    """
+    latency = latency or mock_servers.LatencyModel()
+    recordings = mock_servers.Recordings.from_outputs(outputs)
+    llm_server = mock_servers.start_llm_server(recordings, latency, rpm_limit=rpm_limit)
+    rag_server = mock_servers.start_retrieval_server(recordings, retrieval_latency)
+    try:
+        configure_clients(llm_server, rag_server, max(max(concurrency) * 4, tools.LLM_POOL_SIZE),
+                          use_cache, max_retries)
+        items = [{"id": f"{i}-{r}", "complex_query": query["complex_query"],
+                  "reference_answer": query["reference_answer"], "scene_tag": scene_tag}
+                 for r in range(repeats) for i, query in enumerate(recordings.queries)]
+        results = []
+        for method in methods:
+            for level in concurrency:
+                result = run_case(items, method, level, k, llm_server, rag_server)
+                logging.getLogger("Benchmark").info(
+                    f"{method} 并发{level}: p50 {result['elapsed'].get('p50', 0):.2f}秒, "
+                    f"{result['queries_per_minute']:.1f}问题/分钟")
+                results.append(result)
+    finally:
+        llm_server.stop()
+        rag_server.stop()
+
+    llm_scheduler = scheduler.get_scheduler()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "recorded_queries": len(recordings.queries),
+            "repeats": repeats,
+            "k": k,
+            "use_cache": use_cache,
+            "llm_latency": {"ttft": latency.ttft, "tokens_per_second": latency.tokens_per_second,
+                            "prefill_tokens_per_second": latency.prefill_tokens_per_second},
+            "retrieval_latency": retrieval_latency,
+            "rpm_limit": rpm_limit,
+            "max_retries": max_retries,
+            "scheduler": {"rpm": llm_scheduler.rpm, "tpm": llm_scheduler.tpm}
+            if llm_scheduler is not None else None,
+        },
+        "results": results,
+    }
+
+
+def _metric(result, path):
+    value = result
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare_reports(old, new, tolerance=REGRESSION_TOLERANCE):
+    """
+    按(方法, 并发)对比两份报告，返回每个指标的变化，regression为True表示超出容忍度的变差
+    """
+    old_results = {(r["method"], r["concurrency"]): r for r in old["results"]}
+    comparisons = []
+    for result in new["results"]:
+        previous = old_results.get((result["method"], result["concurrency"]))
+        if previous is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            before, after = _metric(previous, path), _metric(result, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            comparisons.append({
+                "method": result["method"],
+                "concurrency": result["concurrency"],
+                "metric": ".".join(path),
+                "old": before,
+                "new": after,
+                "change": change,
+                "regression": change < -tolerance if higher_is_better else change > tolerance,
+            })
+    return comparisons
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用本地mock服务回放outputs/*.json，测试baseline和method1的性能")
+    parser.add_argument("-m", "--methods", default=",".join(DEFAULT_METHODS),
+                        help=f"逗号分隔的方法，可选: {','.join(batch_runner.METHODS)}")
+    parser.add_argument("-c", "--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                        help="逗号分隔的并发数")
+    parser.add_argument("-r", "--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--outputs", default="../outputs/*.json", help="回放记录的glob")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=mock_servers.DEFAULT_TTFT)
+    parser.add_argument("--tokens-per-second", type=float,
+                        default=mock_servers.DEFAULT_TOKENS_PER_SECOND)
+    parser.add_argument("--prefill-tokens-per-second", type=float,
+                        default=mock_servers.DEFAULT_PREFILL_TOKENS_PER_SECOND)
+    parser.add_argument("--retrieval-latency", type=float,
+                        default=mock_servers.DEFAULT_RETRIEVAL_LATENCY)
+    parser.add_argument("--cache", action="store_true", help="启用LLM/检索/语义缓存")
+    parser.add_argument("--rpm-limit", type=int, help="LLM mock模拟服务端RPM限流，超出时返回429")
+    parser.add_argument("--max-retries", type=int, default=0, help="LLM客户端的重试次数（包括429）")
+    parser.add_argument("--rpm", type=int, help="启用LLM调度器，每分钟请求数上限")
+    parser.add_argument("--tpm", type=int, help="启用LLM调度器，每分钟token数上限")
+    parser.add_argument("-o", "--output", default=DEFAULT_REPORT, help="报告JSON路径")
+    parser.add_argument("--compare", help="与之前的报告对比，有回归时返回码为1")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出链路日志")
+    parser.add_argument("--trace", help="启用链路追踪，span写入<TRACE>.jsonl和<TRACE>.otlp.jsonl，"
+                                        "报告中每组结果附带tracing汇总")
+    args = parser.parse_args(argv)
+
+    tools.setup_logger("Benchmark", logging.INFO)
+    # 链路日志（MyLogger）每个问题输出完整答案，基准测试默认关闭
+    logging.getLogger("MyLogger").disabled = not args.verbose
+    if args.rpm or args.tpm:
+        scheduler.configure_scheduler(rpm=args.rpm, tpm=args.tpm)
+    if args.trace:
+        tracing.configure_tracing(jsonl_path=f"{args.trace}.jsonl",
+                                  otlp_path=f"{args.trace}.otlp.jsonl")
+
+    report = run_benchmark(
+        methods=tuple(m.strip() for m in args.methods.split(",") if m.strip()),
+        concurrency=tuple(int(c) for c in args.concurrency.split(",") if c.strip()),
+        repeats=args.repeats, outputs=args.outputs, k=args.k,
+        latency=mock_servers.LatencyModel(args.ttft, args.tokens_per_second,
+                                          args.prefill_tokens_per_second),
+        retrieval_latency=args.retrieval_latency, use_cache=args.cache,
+        rpm_limit=args.rpm_limit, max_retries=args.max_retries)
+    if args.trace:
+        tracing.configure_tracing(enabled=False)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare_reports(json.load(f), report, args.tolerance)
+        regressions = [c for c in report["comparison"] if c["regression"]]
+        for c in regressions:
+            print(f"回归: {c['method']} 并发{c['concurrency']} {c['metric']} "
+                  f"{c['old']:.4g} -> {c['new']:.4g} ({c['change']:+.1%})", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for result in report["results"]:
+        print(json.dumps({key: result[key] for key in (
+            "method", "concurrency", "queries", "failed", "queries_per_minute",
+            "llm_calls_per_query", "rate_limited_per_query", "retrievals_per_query",
+            "prompt_bytes_per_query")},
+            ensure_ascii=False))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
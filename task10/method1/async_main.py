@@ -0,0 +1,543 @@
+# RAG复杂问题处理链路异步版本
+# 子问题级别并发执行检索、回答和检查，整体耗时取决于最慢的子问题而不是所有子问题之和
+import asyncio
+import time
+
+from . import main, tracing
+from .main import (
+    build_structured_evidence, build_structured_evidence_baseline, logger, FALLBACK_SCENE_TAGS, FALLBACK_POLICIES,
+    _response_content, _select_context, _dedupe, _lookup_decomposition, _store_decomposition,
+    _decompose_prompt_and_parser, _parse_subquestions,
+    _subquestion_answer_prompt_and_parser, _format_subquestion_answer, _parse_subanswer,
+    _check_prompt_and_parser, _format_check, _parse_check,
+    _batch_check_prompt_and_parser, _chunk_batch_check, _parse_batch_check, _batch_check_item,
+    BATCH_CHECK_TOKEN_BUDGET, _merge_prechecked,
+    _final_answer_prompt_and_parser, _format_final_answer, _parse_final_answer, FinalAnswerStream,
+    _json_status, _parses, _reask_prompt, _finish_reask, _record_parse,
+)
+from .docstore import DocumentStore, record_request
+from .precheck import split_prechecked
+from .routing import (
+    MAX_SUBQUESTIONS, classify_query, refine_subquestions, route_breakdown, record_route
+)
+from .semantic_cache import get_answer_cache
+from .speculative import SpeculativeRetrieval, record_speculative
+from .tools import achat_completions4, aquery_faults, rag_context
+
+# 默认的最大并发数（同时在途的检索/LLM请求数）
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+async def _bounded(semaphore, coro):
+    """
+    在信号量限制下执行协程，semaphore为None时不限制并发
+    """
+    if semaphore is None:
+        return await coro
+    start_time = time.perf_counter()
+    async with semaphore:
+        # 在信号量上的等待计入其后第一次LLM/检索调用span的queue_wait；检索在线程中使用
+        # 复制的上下文，结束后清掉本上下文中未被取走的等待时间，避免重复计入
+        tracing.add_queue_wait(time.perf_counter() - start_time)
+        try:
+            return await coro
+        finally:
+            tracing.consume_queue_wait()
+
+
+async def _acomplete_json(prompt, prompt_type):
+    """
+    main._complete_json的异步版本
+    """
+    with tracing.span(f"llm.{prompt_type}", prompt_type=prompt_type):
+        content = _response_content(await achat_completions4(
+            prompt, prompt_type=prompt_type, validate=_parses(prompt_type)))
+        status = _json_status(content, prompt_type)
+        if status is None and main.REASK_ON_PARSE_FAILURE:
+            reask_content = _response_content(
+                await achat_completions4(_reask_prompt(content, prompt_type),
+                                         prompt_type=prompt_type, validate=_parses(prompt_type)))
+            return _finish_reask(prompt_type, content, reask_content)
+        _record_parse(prompt_type, status or "failed")
+        return content
+
+
+@tracing.traced()
+async def agenerate_subquestions(complex_query, scene_tag, province_tag="hq"):
+    """
+    generate_subquestions的异步版本。
+    """
+    cached = _lookup_decomposition(complex_query)
+    if cached is not None:
+        return cached
+
+    prompt, parser = _decompose_prompt_and_parser()
+    content = await _acomplete_json(prompt.format(complex_query=complex_query), "decompose")
+    subquestions = _parse_subquestions(parser, content)
+    _store_decomposition(complex_query, subquestions)
+    return subquestions
+
+
+@tracing.traced()
+async def aretrieve_docs_for_subquestion(query_text, scene_tag, province_tag="hq", k=5,
+                                         fallback_policy=None, doc_store=None, speculative=None,
+                                         semaphore=None):
+    """
+    检索单个子问题的文档，回退策略同retrieve_docs_for_subquestions。
+    传入speculative（speculative.SpeculativeRetrieval）时，子问题与推测检索词足够相近则直接复用
+    推测检索结果，否则检索后补充推测检索到的相关文档。
+    检索本身在semaphore限制下执行；等待推测检索时不占用semaphore，
+    否则子问题数不少于并发数时，等待者占满信号量，推测检索永远无法开始
+    """
+    policy = fallback_policy or main.FALLBACK_POLICY
+    if policy not in FALLBACK_POLICIES:
+        raise ValueError(f"未知的回退检索策略：{policy}")
+
+    if speculative is not None:
+        await speculative.wait()
+        reused = speculative.lookup(query_text)
+        if reused is not None:
+            return query_text, _dedupe(doc_store, reused)
+
+    docs = await _bounded(semaphore, _aretrieve_with_policy(query_text, scene_tag, policy))
+    if speculative is not None:
+        docs = speculative.merge(query_text, docs)
+    return query_text, _dedupe(doc_store, docs)
+
+
+async def _aretrieve_with_policy(query_text, scene_tag, policy):
+    if policy in ("speculative", "broad_merge"):
+        # 场景内与全部场景两路检索同时发出
+        scoped_result, broad_result = await asyncio.gather(
+            aquery_faults(query_text, scene_tag, province_tag="hq",
+                          top_k=5, score_threshold=0.5),
+            aquery_faults(query_text, FALLBACK_SCENE_TAGS, province_tag="hq",
+                          top_k=5, score_threshold=0.5))
+        scoped, broad = rag_context(scoped_result), rag_context(broad_result)
+    else:
+        scoped = rag_context(await aquery_faults(query_text, scene_tag, province_tag="hq",
+                                                 top_k=5, score_threshold=0.5))
+        broad = None
+        if policy == "serial" and len(scoped) == 0:
+            broad = rag_context(await aquery_faults(query_text, FALLBACK_SCENE_TAGS,
+                                                    province_tag="hq", top_k=5,
+                                                    score_threshold=0.5))
+    return _select_context(policy, scoped, broad)
+
+
+async def aretrieve_docs_for_subquestions(subquestions, scene_tag, province_tag="hq", k=5,
+                                          semaphore=None, fallback_policy=None, doc_store=None,
+                                          speculative=None):
+    """
+    retrieve_docs_for_subquestions的异步版本，所有子问题并发检索，返回顺序与输入一致。
+    """
+    return list(await asyncio.gather(*[
+        aretrieve_docs_for_subquestion(query_text, scene_tag, province_tag, k, fallback_policy,
+                                       doc_store, speculative, semaphore)
+        for query_text in subquestions
+    ]))
+
+
+@tracing.traced()
+async def aanswer_subquestion(subq, docs, prompt, parser, token_budget=None):
+    response = await _acomplete_json(_format_subquestion_answer(
+        prompt, subq, docs, token_budget), "subanswer")
+    return subq, docs, _parse_subanswer(parser, response)
+
+
+async def aanswer_subquestions_with_llm(subquestions_with_docs, semaphore=None, token_budget=None):
+    """
+    answer_subquestions_with_llm的异步版本，所有子问题并发回答，返回顺序与输入一致。
+    """
+    prompt, parser = _subquestion_answer_prompt_and_parser()
+    token_budget = token_budget if token_budget is not None else main.ANSWER_TOKEN_BUDGET
+    return list(await asyncio.gather(*[
+        _bounded(semaphore, aanswer_subquestion(subq, docs, prompt, parser, token_budget))
+        for subq, docs in subquestions_with_docs
+    ]))
+
+
+@tracing.traced()
+async def acheck_subanswer(subq, docs, subanswer, prompt, parser):
+    response = await _acomplete_json(_format_check(prompt, subq, docs, subanswer), "check")
+    return _parse_check(parser, response, subq, docs, subanswer)
+
+
+async def acheck_faithfulness_and_relevance(answers_with_docs, semaphore=None, precheck=False):
+    """
+    check_faithfulness_and_relevance的异步版本，所有子问题并发检查，返回顺序与输入一致。
+    """
+    if precheck:
+        answers_with_docs = list(answers_with_docs)
+        settled, pending = split_prechecked(answers_with_docs)
+        return _merge_prechecked(settled, pending, await acheck_faithfulness_and_relevance(
+            [answers_with_docs[i] for i in pending], semaphore=semaphore))
+
+    prompt, parser = _check_prompt_and_parser()
+    return list(await asyncio.gather(*[
+        _bounded(semaphore, acheck_subanswer(subq, docs, subanswer, prompt, parser))
+        for subq, docs, subanswer in answers_with_docs
+    ]))
+
+
+@tracing.traced()
+async def acheck_faithfulness_and_relevance_batch(answers_with_docs, semaphore=None,
+                                                 max_prompt_tokens=BATCH_CHECK_TOKEN_BUDGET,
+                                                 precheck=False):
+    """
+    check_faithfulness_and_relevance_batch的异步版本，各批并发请求。
+    """
+    answers_with_docs = list(answers_with_docs)
+    if precheck:
+        settled, pending = split_prechecked(answers_with_docs)
+        return _merge_prechecked(settled, pending, await acheck_faithfulness_and_relevance_batch(
+            [answers_with_docs[i] for i in pending], semaphore, max_prompt_tokens))
+    if not answers_with_docs:
+        return []
+    prompt, parser = _batch_check_prompt_and_parser()
+    chunks = _chunk_batch_check(answers_with_docs, prompt, max_prompt_tokens)
+    responses = await asyncio.gather(*[
+        _bounded(semaphore, _acomplete_json(formatted_prompt, "batch_check"))
+        for _, formatted_prompt in chunks
+    ])
+
+    checks = {}
+    for (indexes, _), response in zip(chunks, responses):
+        checks.update(_parse_batch_check(parser, response, indexes))
+
+    missing = [i for i in range(len(answers_with_docs)) if i not in checks]
+    if missing:
+        logger.warning(f"批量检查漏判{len(missing)}个子问题，回退到逐个检查")
+    fallback = dict(zip(missing, await acheck_faithfulness_and_relevance(
+        [answers_with_docs[i] for i in missing], semaphore=semaphore)))
+
+    return [fallback[i] if i in fallback else _batch_check_item(checks[i], *item)
+            for i, item in enumerate(answers_with_docs)]
+
+
+@tracing.traced()
+async def afinal_answer_with_rag_fusion(complex_query, structured_evidence, doc_store=None,
+                                        token_budget=None):
+    """
+    final_answer_with_rag_fusion的异步版本。
+    """
+    prompt, parser = _final_answer_prompt_and_parser()
+    formatted_prompt = _format_final_answer(prompt, complex_query, structured_evidence,
+                                            doc_store, token_budget)
+    response = await _acomplete_json(formatted_prompt, "final")
+    return _parse_final_answer(parser, response), formatted_prompt
+
+
+async def afinal_answer_with_rag_fusion_stream(complex_query, structured_evidence, doc_store=None,
+                                               token_budget=None):
+    """
+    final_answer_with_rag_fusion_stream的异步版本，返回的FinalAnswerStream用async for迭代
+    """
+    prompt, parser = _final_answer_prompt_and_parser()
+    formatted_prompt = _format_final_answer(prompt, complex_query, structured_evidence,
+                                            doc_store, token_budget)
+    return FinalAnswerStream(parser, formatted_prompt,
+                             await achat_completions4(formatted_prompt, stream=True,
+                                                      prompt_type="final",
+                                                      validate=_parses("final")))
+
+
+@tracing.traced()
+async def aprocess_subquestion(subq, scene_tag, province_tag="hq", k=5, semaphore=None,
+                               answer_prompt_parser=None, check_prompt_parser=None,
+                               precheck=False, token_budget=None, doc_store=None,
+                               speculative=None):
+    """
+    单个子问题独立走完 检索 → 回答 → 检查，不等待其他子问题。
+
+    Returns:
+        tuple: (docs, subanswer, checked)，checked与check_faithfulness_and_relevance的单条结果一致
+    """
+    answer_prompt, answer_parser = answer_prompt_parser or _subquestion_answer_prompt_and_parser()
+    check_prompt, check_parser = check_prompt_parser or _check_prompt_and_parser()
+
+    _, docs = await aretrieve_docs_for_subquestion(
+        subq, scene_tag, province_tag, k, doc_store=doc_store, speculative=speculative,
+        semaphore=semaphore)
+    token_budget = token_budget if token_budget is not None else main.ANSWER_TOKEN_BUDGET
+    _, _, subanswer = await _bounded(semaphore, aanswer_subquestion(
+        subq, docs, answer_prompt, answer_parser, token_budget))
+    if precheck:
+        settled, _ = split_prechecked([(subq, docs, subanswer)])
+        if settled:
+            return docs, subanswer, settled[0]
+    checked = await _bounded(semaphore, acheck_subanswer(
+        subq, docs, subanswer, check_prompt, check_parser))
+    return docs, subanswer, checked
+
+
+async def aprocess_subquestions_dataflow(subquestions, scene_tag, province_tag="hq", k=5,
+                                         semaphore=None, precheck=False, token_budget=None,
+                                         doc_store=None, speculative=None):
+    """
+    数据流模式：每个子问题的检索、回答、检查各自流水推进，按完成先后收集结果，
+    全部完成后按输入顺序返回，避免阶段之间的等待。
+
+    Returns:
+        tuple: (subquestions_docs, subquestions_docs_subanswer, checked_subquestions_docs_subanswer)
+            结构分别与retrieve_docs_for_subquestions、answer_subquestions_with_llm、
+            check_faithfulness_and_relevance的返回一致
+    """
+    answer_prompt_parser = _subquestion_answer_prompt_and_parser()
+    check_prompt_parser = _check_prompt_and_parser()
+
+    async def _indexed(index, subq):
+        return index, await aprocess_subquestion(
+            subq, scene_tag, province_tag, k, semaphore,
+            answer_prompt_parser, check_prompt_parser, precheck, token_budget, doc_store,
+            speculative)
+
+    results = [None] * len(subquestions)
+    tasks = [_indexed(i, subq) for i, subq in enumerate(subquestions)]
+    for finished in asyncio.as_completed(tasks):
+        index, result = await finished
+        results[index] = result
+        logger.debug(f"子问题完成: {subquestions[index]}")
+
+    subquestions_docs = [(subq, docs) for subq, (docs, _, _) in zip(subquestions, results)]
+    subquestions_docs_subanswer = [(subq, docs, subanswer)
+                                   for subq, (docs, subanswer, _) in zip(subquestions, results)]
+    checked_subquestions_docs_subanswer = [checked for _, _, checked in results]
+    return subquestions_docs, subquestions_docs_subanswer, checked_subquestions_docs_subanswer
+
+
+def _answer_cache_namespace(scene_tag, k):
+    scene_tags = scene_tag if isinstance(scene_tag, list) else [scene_tag]
+    return f"{','.join(sorted(scene_tags))}|{k}"
+
+
+@tracing.traced()
+async def run_method1(complex_query, scene_tag, k=5, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                      pipeline="stage", use_semantic_cache=True, check_mode="single",
+                      precheck=False, answer_token_budget=None, final_token_budget=None,
+                      dedup_documents=False, on_answer_token=None, route=False,
+                      max_subquestions=MAX_SUBQUESTIONS, speculative_retrieval=False,
+                      speculative_keywords=False):
+    """
+    异步执行完整的Method1链路。
+
+    Args:
+        complex_query (str): 复杂问题
+        scene_tag (str | list): 检索场景标签
+        k (int): 每个子问题检索的文档数
+        max_concurrency (int): 同时在途的检索/LLM请求上限，None表示不限制
+        pipeline (str): "stage" 按阶段并发，每个阶段等待所有子问题完成后再进入下一阶段；
+            "dataflow" 每个子问题独立推进，time_stats中子问题部分合并记为
+            "subquestion_dataflow"
+        check_mode (str): "single" 每个子问题一次检查请求；"batch" 所有子问题合并为一次请求
+            （超出token预算时分批），仅对pipeline="stage"生效
+        precheck (bool): 检查前先做本地预检查，能明确判定的子问题不再调用LLM
+        answer_token_budget / final_token_budget (int): 子问题回答与最终融合时参考文档的token预算，
+            None时使用main.ANSWER_TOKEN_BUDGET / main.FINAL_TOKEN_BUDGET
+        dedup_documents (bool): 使用本次请求的共享文档库对各子问题的文档去重，
+            最终融合prompt中每篇文档只出现一次（见docstore.py）
+        on_answer_token (callable): 传入时最终答案以流式生成，每产出一段answer文本调用一次
+            on_answer_token(text)，time_stats额外记录首个token耗时"final_answer_ttft"；
+            命中语义缓存时以完整答案调用一次
+        route (bool): 先按复杂度路由（见routing.py）：简单问题不拆解，直接用原问题检索一次、
+            融合回答一次，子问题相关的返回值为[(complex_query, docs)]和空列表；
+            复杂问题拆解后合并近似重复的子问题，并截断到max_subquestions个。
+            路由明细（路由、子问题数、节省的调用次数）记入routing.routing_stats()
+        speculative_retrieval (bool): 子问题拆解期间先用原问题检索（见speculative.py），
+            拆解完成后复用给相近的子问题或补充进子问题的证据，
+            time_stats额外记录拆解完成后等待推测检索的时间"speculative_wait"
+        speculative_keywords (bool): 推测检索时同时用本地提取的关键词检索
+        use_semantic_cache (bool): 启用语义缓存（semantic_cache.configure_semantic_cache）时，
+            相似问题直接返回已缓存的完整结果，time_stats记为"semantic_cache_hit"
+
+    Returns:
+        tuple: 与test_function.method1_test相同的返回结构
+            (subquestions, subquestions_docs, subquestions_docs_subanswer,
+             checked_subquestions_docs_subanswer, structured_evidence,
+             final_answer, final_prompt, time_stats)
+
+    Example:
+        >>> import asyncio
+        >>> result = asyncio.run(run_method1("武汉5G高回落小区的主要原因是什么？", "wlyh"))
+    """
+    tracing.current_span().set(complex_query=complex_query, scene_tag=str(scene_tag), k=k,
+                               pipeline=pipeline, check_mode=check_mode)
+    # 用于存储时间统计的列表
+    time_stats = []
+
+    answer_cache = get_answer_cache() if use_semantic_cache else None
+    namespace = _answer_cache_namespace(scene_tag, k)
+    if answer_cache is not None:
+        start_time = time.time()
+        hit = answer_cache.lookup(complex_query, namespace)
+        if hit is not None:
+            cached_result, cached_query, similarity = hit
+            time_stats.append(("semantic_cache_hit", time.time() - start_time))
+            logger.info(f"最终答案命中语义缓存，相似度{similarity:.4f}，原问题: {cached_query}")
+            if on_answer_token is not None:
+                on_answer_token(cached_result[5].get("answer", ""))
+            return cached_result + (time_stats,)
+
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    doc_store = DocumentStore() if dedup_documents else None
+
+    decision = classify_query(complex_query) if route else None
+    if decision is not None and decision["route"] == "simple":
+        breakdown = record_route(route_breakdown(complex_query, decision, check_mode=check_mode))
+        logger.info(f"简单问题，跳过子问题拆解: {breakdown}")
+        start_time = time.time()
+        _, docs = await aretrieve_docs_for_subquestion(complex_query, scene_tag, k=k,
+                                                       doc_store=doc_store)
+        time_stats.append(("retrieve_docs_for_subquestions", time.time() - start_time))
+        subquestions = [complex_query]
+        subquestions_docs = [(complex_query, docs)]
+        subquestions_docs_subanswer, checked_subquestions_docs_subanswer = [], []
+        evidence_items = [{"subquestion": complex_query, "docs_per_subq": docs}]
+        return await _afinish(
+            complex_query, evidence_items, doc_store, final_token_budget, on_answer_token,
+            time_stats, answer_cache, namespace,
+            (subquestions, subquestions_docs, subquestions_docs_subanswer,
+             checked_subquestions_docs_subanswer))
+
+    speculative = None
+    if speculative_retrieval:
+        async def _speculative_retrieve(query_text):
+            _, docs = await aretrieve_docs_for_subquestion(query_text, scene_tag, k=k,
+                                                           semaphore=semaphore)
+            return docs
+        speculative = SpeculativeRetrieval(
+            complex_query, keywords=speculative_keywords).start(_speculative_retrieve)
+
+    start_time = time.time()
+    try:
+        subquestions = await agenerate_subquestions(complex_query, scene_tag)
+    except BaseException:
+        if speculative is not None:
+            speculative.cancel()
+        raise
+    decomposition_seconds = time.time() - start_time
+    time_stats.append(("generate_subquestions", decomposition_seconds))
+
+    if decision is not None:
+        kept, merged, capped = refine_subquestions(subquestions, max_subquestions)
+        breakdown = record_route(route_breakdown(
+            complex_query, decision, subquestions, kept, merged, capped, check_mode))
+        logger.info(f"复杂问题路由明细: {breakdown}")
+        subquestions = kept
+
+    if pipeline == "dataflow":
+        start_time = time.time()
+        subquestions_docs, subquestions_docs_subanswer, checked_subquestions_docs_subanswer = \
+            await aprocess_subquestions_dataflow(subquestions, scene_tag, k=k, semaphore=semaphore,
+                                                 precheck=precheck,
+                                                 token_budget=answer_token_budget,
+                                                 doc_store=doc_store, speculative=speculative)
+        time_stats.append(("subquestion_dataflow", time.time() - start_time))
+    elif pipeline == "stage":
+        start_time = time.time()
+        subquestions_docs = await aretrieve_docs_for_subquestions(
+            subquestions, scene_tag, k=k, semaphore=semaphore, doc_store=doc_store,
+            speculative=speculative)
+        time_stats.append(("retrieve_docs_for_subquestions", time.time() - start_time))
+
+        start_time = time.time()
+        subquestions_docs_subanswer = await aanswer_subquestions_with_llm(
+            subquestions_docs, semaphore=semaphore, token_budget=answer_token_budget)
+        time_stats.append(("answer_subquestions_with_llm", time.time() - start_time))
+
+        start_time = time.time()
+        if check_mode == "batch":
+            checked_subquestions_docs_subanswer = await acheck_faithfulness_and_relevance_batch(
+                subquestions_docs_subanswer, semaphore=semaphore, precheck=precheck)
+        else:
+            checked_subquestions_docs_subanswer = await acheck_faithfulness_and_relevance(
+                subquestions_docs_subanswer, semaphore=semaphore, precheck=precheck)
+        time_stats.append(("check_faithfulness_and_relevance", time.time() - start_time))
+    else:
+        raise ValueError(f"未知的pipeline模式：{pipeline}")
+
+    if speculative is not None:
+        report = record_speculative(speculative.report(decomposition_seconds))
+        time_stats.append(("speculative_wait", report["wait_seconds"]))
+        logger.info(f"推测检索统计: {report}")
+
+    return await _afinish(
+        complex_query, checked_subquestions_docs_subanswer, doc_store, final_token_budget,
+        on_answer_token, time_stats, answer_cache, namespace,
+        (subquestions, subquestions_docs, subquestions_docs_subanswer,
+         checked_subquestions_docs_subanswer))
+
+
+async def _afinish(complex_query, evidence_items, doc_store, final_token_budget, on_answer_token,
+                   time_stats, answer_cache, namespace, subquestion_results):
+    # 构造结构化证据、融合最终答案，写入语义缓存后返回完整结果
+    start_time = time.time()
+    structured_evidence = build_structured_evidence(
+        evidence_items, token_budget=final_token_budget, doc_store=doc_store)
+    time_stats.append(("build_structured_evidence", time.time() - start_time))
+
+    if on_answer_token is None:
+        start_time = time.time()
+        final_answer, final_prompt = await afinal_answer_with_rag_fusion(
+            complex_query, structured_evidence, doc_store, final_token_budget)
+        time_stats.append(("final_answer_with_rag_fusion", time.time() - start_time))
+    else:
+        stream = await afinal_answer_with_rag_fusion_stream(
+            complex_query, structured_evidence, doc_store, final_token_budget)
+        async for text in stream:
+            on_answer_token(text)
+        final_answer, final_prompt = stream.final_answer, stream.prompt
+        time_stats.extend(stream.time_stats)
+
+    if doc_store is not None:
+        logger.info(f"文档去重统计: {record_request(doc_store)}")
+
+    logger.info(f"复杂问题: {complex_query}")
+    logger.info(f"最终答案: {final_answer}")
+
+    result = subquestion_results + (structured_evidence, final_answer, final_prompt)
+    if answer_cache is not None:
+        answer_cache.add(complex_query, result, namespace)
+    return result + (time_stats,)
+
+
+@tracing.traced()
+async def run_baseline(complex_query, scene_tag, k=5, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                       on_answer_token=None):
+    """
+    异步执行baseline链路：拆解子问题、并发检索、直接用检索文档融合最终答案。
+    返回值与test_function.baseline_test一致：
+    (subquestions, subquestions_docs, structured_evidence, final_answer, final_prompt, time_stats)。
+    on_answer_token同run_method1
+    """
+    tracing.current_span().set(complex_query=complex_query, scene_tag=str(scene_tag), k=k)
+    time_stats = []
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    start_time = time.time()
+    subquestions = await agenerate_subquestions(complex_query, scene_tag)
+    time_stats.append(("generate_subquestions", time.time() - start_time))
+
+    start_time = time.time()
+    subquestions_docs = await aretrieve_docs_for_subquestions(subquestions, scene_tag, k=k,
+                                                              semaphore=semaphore)
+    time_stats.append(("retrieve_docs_for_subquestions", time.time() - start_time))
+
+    start_time = time.time()
+    structured_evidence = build_structured_evidence_baseline(subquestions_docs)
+    time_stats.append(("build_structured_evidence_baseline", time.time() - start_time))
+
+    if on_answer_token is None:
+        start_time = time.time()
+        final_answer, final_prompt = await afinal_answer_with_rag_fusion(
+            complex_query, structured_evidence)
+        time_stats.append(("final_answer_with_rag_fusion", time.time() - start_time))
+    else:
+        stream = await afinal_answer_with_rag_fusion_stream(complex_query, structured_evidence)
+        async for text in stream:
+            on_answer_token(text)
+        final_answer, final_prompt = stream.final_answer, stream.prompt
+        time_stats.extend(stream.time_stats)
+
+    return subquestions, subquestions_docs, structured_evidence, final_answer, final_prompt, \
+        time_stats
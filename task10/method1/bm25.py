@@ -0,0 +1,430 @@
+# 本地BM25倒排索引与混合检索：BM25和向量检索的结果、子问题及其改写的结果用RRF（倒数排名融合）合并
+import json
+import math
+import random
+import re
+import time
+import unicodedata
+from array import array
+
+import numpy as np
+
+from .retriever import LOCAL_POOL_SIZE, LocalVectorRetriever, Retriever, TaggedIndex, _text_hash
+from .speculative import extract_keywords
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# RRF融合：score = Σ 1 / (RRF_K + 排名)
+RRF_K = 60
+# 参与融合的每路检索结果数 = top_k * RRF_CANDIDATES_FACTOR
+RRF_CANDIDATES_FACTOR = 4
+# 子问题的本地改写最多几条（不含原子问题）
+MAX_REWRITES = 2
+
+_ASCII_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+_CJK_PATTERN = re.compile(r"[㐀-鿿]+")
+_TF_MAX = 65535  # 词频用array("H")存储
+
+_jieba = None
+_use_jieba = True
+
+
+def configure_tokenizer(use_jieba=True):
+    """
+    use_jieba=True时优先用jieba分词（需安装jieba），否则中文按字符bigram切分。
+    切换后需重建已有的索引
+    """
+    global _use_jieba
+    _use_jieba = use_jieba
+
+
+def _get_jieba():
+    global _jieba
+    if _jieba is None:
+        try:
+            import jieba
+            jieba.setLogLevel(60)
+            _jieba = jieba
+        except ImportError:
+            _jieba = False
+    return _jieba or None
+
+
+def tokenize(text):
+    """
+    BM25分词：NFKC归一化并转小写；英文/数字按词切分（如pdcp、time-to-trigger、5g），
+    连字符词同时保留各部分；中文用jieba搜索模式分词，未安装jieba时按字符bigram切分
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for match in _ASCII_PATTERN.finditer(text):
+        word = match.group()
+        tokens.append(word)
+        parts = re.split(r"[-_.]", word)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    jieba = _get_jieba() if _use_jieba else None
+    for match in _CJK_PATTERN.finditer(text):
+        run = match.group()
+        if jieba is not None:
+            tokens.extend(word for word in jieba.lcut_for_search(run) if word.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index(TaggedIndex):
+    """
+    进程内的BM25倒排索引，文档和标签过滤与LocalVectorRetriever相同（见TaggedIndex）。
+
+    每个词的倒排表是两个紧凑数组：行号array("I")和词频array("H")，文档长度为array("I")，
+    入库只在数组末尾追加，可随时增量加入文档；检索时用NumPy按倒排表累加得分。
+
+    参数:
+    - k1, b: BM25参数
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B, pool_size=LOCAL_POOL_SIZE):
+        super().__init__(pool_size)
+        self.k1 = k1
+        self.b = b
+        self._vocab = {}         # 词 -> 词编号
+        self._postings = []      # 词编号 -> array("I", 行号)
+        self._tfs = []           # 词编号 -> array("H", 词频)
+        self._doc_len = array("I")
+        self._total_len = 0
+
+    def _append(self, docs):
+        self._index_tokens([tokenize(doc.get("text")) for doc in docs])
+
+    def _index_tokens(self, tokens_list):
+        row = self._size
+        for tokens in tokens_list:
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term = self._vocab.get(token)
+                if term is None:
+                    term = self._vocab[token] = len(self._postings)
+                    self._postings.append(array("I"))
+                    self._tfs.append(array("H"))
+                self._postings[term].append(row)
+                self._tfs[term].append(min(tf, _TF_MAX))
+            self._doc_len.append(len(tokens))
+            self._total_len += len(tokens)
+            row += 1
+
+    def vocabulary_size(self):
+        return len(self._vocab)
+
+    def postings_bytes(self):
+        """
+        倒排表和文档长度数组占用的字节数
+        """
+        with self._lock:
+            return (sum(p.itemsize * len(p) for p in self._postings)
+                    + sum(t.itemsize * len(t) for t in self._tfs)
+                    + self._doc_len.itemsize * len(self._doc_len))
+
+    def search(self, query_text, scene_tag, province_tag="hq", top_k=5):
+        """
+        返回[(行号, BM25得分)]，按得分降序，只包含至少命中一个词的文档
+        """
+        terms = {}
+        for token in tokenize(query_text):
+            term = self._vocab.get(token)
+            if term is not None:
+                terms[term] = terms.get(term, 0) + 1
+        if not terms:
+            return []
+        with self._lock:
+            size = self._size
+            rows = self._rows_for(scene_tag, province_tag)
+            if rows is not None and len(rows) == 0:
+                return []
+            doc_len = np.frombuffer(self._doc_len, dtype=np.uint32)[:size].astype(np.float32)
+            avgdl = self._total_len / size if size else 1.0
+            postings = [(np.frombuffer(self._postings[term], dtype=np.uint32).copy(),
+                         np.frombuffer(self._tfs[term], dtype=np.uint16).astype(np.float32), qtf)
+                        for term, qtf in terms.items()]
+
+        scores = np.zeros(size, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * doc_len / max(avgdl, 1e-9))
+        for ids, tf, qtf in postings:
+            idf = math.log(1 + (size - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += qtf * idf * tf * (self.k1 + 1) / (tf + norm[ids])
+
+        if rows is not None:
+            scores = scores[rows]
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return []
+        k = min(top_k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        ids = top if rows is None else rows[top]
+        return [(int(row), float(scores[i])) for row, i in zip(ids, top)]
+
+    def query_faults(self, query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+        """
+        BM25检索，返回结构与检索服务一致；BM25得分没有固定范围，忽略score_threshold
+        """
+        try:
+            matches = self.search(query_text, scene_tag, province_tag, top_k)
+        except Exception as e:
+            return {"error": str(e), "status_code": None, "text": ""}
+        return {"data": {"context": [dict(self._docs[row]) for row, _ in matches]}}
+
+
+def rewrite_query(query, max_rewrites=MAX_REWRITES):
+    """
+    本地改写（不调用LLM）：原问题 + 只保留英文/数字术语的检索词 + 关键词片段，去掉重复
+    """
+    queries = [query]
+    terms = " ".join(dict.fromkeys(
+        _ASCII_PATTERN.findall(unicodedata.normalize("NFKC", query or "").lower())))
+    keywords = " ".join(extract_keywords(query))
+    for rewrite in (keywords, terms):
+        if len(queries) > max_rewrites:
+            break
+        if rewrite and rewrite not in queries:
+            queries.append(rewrite)
+    return queries
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, top_k=None):
+    """
+    倒数排名融合：rankings为多路检索结果（文档列表，按相关度降序），同一文档的得分为
+    各路 1/(k+排名) 之和，返回按得分降序的文档列表。文档按去除空白后的文本判断是否相同，
+    同一url下的不同片段视为不同文档
+    """
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            key = _text_hash(doc.get("text"))
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=lambda key: -scores[key])
+    if top_k is not None:
+        ordered = ordered[:top_k]
+    return [docs[key] for key in ordered]
+
+
+class HybridRetriever(Retriever):
+    """
+    混合检索：对子问题（rewrites为True时还有其本地改写，见rewrite_query）分别做向量检索和BM25检索，
+    所有结果用RRF合并后取top_k。
+
+    参数:
+    - dense: 向量检索后端（如RetrievalClient或LocalVectorRetriever），None时只用BM25
+    - sparse: BM25Index，None时只用向量检索
+    - rewrites: 是否对改写后的检索词也检索；默认关闭，python -m method1.bm25的评测中改写降低了召回
+    - rrf_k: RRF常数
+    """
+
+    def __init__(self, dense=None, sparse=None, rewrites=False, rrf_k=RRF_K,
+                 candidates_factor=RRF_CANDIDATES_FACTOR, pool_size=LOCAL_POOL_SIZE):
+        if dense is None and sparse is None:
+            raise ValueError("dense和sparse至少需要一个")
+        self.dense = dense
+        self.sparse = sparse
+        self.rewrites = rewrites
+        self.rrf_k = rrf_k
+        self.candidates_factor = candidates_factor
+        self.pool_size = pool_size
+
+    def query_faults(self, query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+        queries = rewrite_query(query_text) if self.rewrites else [query_text]
+        candidates = top_k * self.candidates_factor
+        rankings, errors = [], []
+        if self.dense is not None:
+            if len(queries) == 1:
+                results = [self.dense.query_faults(queries[0], scene_tag, province_tag, candidates,
+                                                   score_threshold)]
+            else:
+                results = self.dense.query_faults_many(queries, scene_tag, province_tag,
+                                                       candidates, score_threshold)
+            for result in results:
+                if "error" in result:
+                    errors.append(result)
+                else:
+                    rankings.append(result.get("data", {}).get("context", []))
+        if self.sparse is not None:
+            for query in queries:
+                rankings.append([self.sparse.doc(row) for row, _ in
+                                 self.sparse.search(query, scene_tag, province_tag, candidates)])
+        if not rankings and errors:
+            return errors[0]
+        docs = reciprocal_rank_fusion(rankings, self.rrf_k, top_k)
+        return {"data": {"context": [dict(doc) for doc in docs]}}
+
+    def close(self):
+        for retriever in (self.dense, self.sparse):
+            if retriever is not None:
+                retriever.close()
+
+
+def known_item_queries(docs, n_queries=200, min_chars=8, max_chars=20, seed=0):
+    """
+    已知答案的评测问题：从文档中随机截取一段作为问题，该文档为唯一相关文档。
+    返回[(问题, {相关文档的文本hash})]
+    """
+    rng = random.Random(seed)
+    docs = [doc for doc in docs if len(doc.get("text") or "") >= max_chars]
+    queries = []
+    for _ in range(min(n_queries, 50 * len(docs))):
+        doc = rng.choice(docs)
+        text = doc["text"]
+        length = rng.randint(min_chars, max_chars)
+        start = rng.randrange(0, len(text) - length + 1)
+        queries.append((text[start:start + length], {_text_hash(text)}))
+    return queries
+
+
+def subquestion_queries(outputs):
+    """
+    子问题评测集：outputs/*.json中的子问题，以检索服务为该子问题返回的文档作为相关文档。
+    返回[(子问题, {相关文档的文本hash})]
+    """
+    queries = []
+    for data in outputs:
+        for item in data.get("checked_subquestions_docs_subanswer", []):
+            docs = item.get("docs_per_subq", [])
+            if item.get("subquestion") and docs:
+                queries.append((item["subquestion"], {_text_hash(doc.get("text")) for doc in docs}))
+        for subq, docs in data.get("subquestions_docs", []):
+            if subq and docs:
+                queries.append((subq, {_text_hash(doc.get("text")) for doc in docs}))
+    return queries
+
+
+def evaluate_retrievers(retrievers, queries, scene_tag, province_tag="hq", ks=(1, 5, 10)):
+    """
+    各检索后端的recall@k（前k个结果覆盖的相关文档比例，按问题平均）与单次检索延迟（毫秒）
+    """
+    report = []
+    max_k = max(ks)
+    for name, retriever in retrievers.items():
+        recall = {k: 0.0 for k in ks}
+        latencies = []
+        for query, relevant in queries:
+            start_time = time.perf_counter()
+            result = retriever.query_faults(query, scene_tag, province_tag, max_k, -1.0)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            keys = [_text_hash(doc.get("text"))
+                    for doc in result.get("data", {}).get("context", [])]
+            for k in ks:
+                recall[k] += len(relevant.intersection(keys[:k])) / len(relevant)
+        record = {"retriever": name, "queries": len(queries)}
+        for k in ks:
+            record[f"recall@{k}"] = recall[k] / len(queries) if queries else 0.0
+        record["p50_ms"] = float(np.percentile(latencies, 50)) if latencies else 0.0
+        record["p95_ms"] = float(np.percentile(latencies, 95)) if latencies else 0.0
+        report.append(record)
+    return report
+
+
+def benchmark_hybrid(outputs, n_queries=200, scene_tag="wlyh", ks=(1, 5, 10), seed=0):
+    """
+    用outputs/*.json中的文档建库，对比向量检索（dense）、BM25（bm25）和两者RRF融合
+    （hybrid；hybrid_rewrites同时检索本地改写）的recall@k与延迟，向量检索用本地哈希向量索引。
+    评测集为文档片段（known_item）和子问题（subquestion）两组
+    """
+    from .retriever import _output_docs
+
+    docs = [doc for data in outputs for doc in _output_docs(data)]
+    dense = LocalVectorRetriever()
+    sparse = BM25Index()
+    dense.add_documents(docs, scene_tag)
+    sparse.add_documents(docs, scene_tag)
+    retrievers = {
+        "dense": dense,
+        "bm25": sparse,
+        "hybrid": HybridRetriever(dense, sparse, rewrites=False),
+        "hybrid_rewrites": HybridRetriever(dense, sparse, rewrites=True),
+    }
+    report = []
+    for query_set, queries in (("known_item", known_item_queries(docs, n_queries, seed=seed)),
+                               ("subquestion", subquestion_queries(outputs))):
+        for record in evaluate_retrievers(retrievers, queries, scene_tag, ks=ks):
+            report.append({"query_set": query_set, "docs": len(dense), **record})
+    return report
+
+
+def _add_random_docs(index, term_ids, scene_tag):
+    # 基准测试用：term_ids为(文档数, 每篇词数)的词编号矩阵，按词批量写入倒排表，跳过逐词入库
+    count, length = term_ids.shape
+    rows = np.repeat(np.arange(index._size, index._size + count, dtype=np.uint32), length)
+    pairs = term_ids.astype(np.int64).ravel() * (index._size + count) + rows
+    pairs, tfs = np.unique(pairs, return_counts=True)
+    terms, rows = np.divmod(pairs, index._size + count)
+    bounds = np.flatnonzero(np.diff(terms)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(terms)]):
+        token = f"w{terms[start]}"
+        term = index._vocab.get(token)
+        if term is None:
+            term = index._vocab[token] = len(index._postings)
+            index._postings.append(array("I"))
+            index._tfs.append(array("H"))
+        index._postings[term].frombytes(rows[start:end].astype(np.uint32).tobytes())
+        index._tfs[term].frombytes(np.minimum(tfs[start:end], _TF_MAX).astype(np.uint16).tobytes())
+    index._doc_len.extend([length] * count)
+    index._total_len += count * length
+    index._register([{"text": ""}] * count, scene_tag, "hq")
+
+
+def benchmark_bm25_latency(sizes=(10_000, 100_000, 1_000_000), doc_tokens=100, vocabulary=50_000,
+                           n_queries=50, query_tokens=6, top_k=5,
+                           scene_tags=("wlyh", "wxwy", "xczc", "yyjc", "xczhw"), seed=0):
+    """
+    用Zipf分布的随机词测试BM25索引在不同规模下的检索延迟，
+    与retriever.benchmark_local_retriever的向量检索延迟对比。
+
+    Returns:
+        list: 每个规模一条记录，包含建库耗时、倒排表字节数，以及
+            按单个场景标签过滤（filtered）和覆盖全部标签（all_tags）时的p50/p95延迟（毫秒）
+    """
+    rng = np.random.default_rng(seed)
+    report = []
+    for size in sizes:
+        index = BM25Index()
+        start_time = time.time()
+        # 各场景标签均分文档，每批最多10万条
+        chunk = min(100_000, -(-size // len(scene_tags)))
+        for start in range(0, size, chunk):
+            count = min(chunk, size - start)
+            term_ids = rng.zipf(1.2, (count, doc_tokens)) % vocabulary
+            with index._lock:
+                _add_random_docs(index, term_ids, scene_tags[(start // chunk) % len(scene_tags)])
+        build_seconds = time.time() - start_time
+
+        queries = [" ".join(f"w{term}" for term in row)
+                   for row in rng.zipf(1.2, (n_queries, query_tokens)) % vocabulary]
+        record = {"chunks": size, "vocabulary": index.vocabulary_size(),
+                  "build_seconds": build_seconds, "postings_bytes": index.postings_bytes()}
+        for name, tags in (("filtered", scene_tags[0]), ("all_tags", list(scene_tags))):
+            latencies = []
+            for query in queries:
+                start_time = time.perf_counter()
+                index.search(query, tags, top_k=top_k)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            record[f"{name}_p50_ms"] = float(np.percentile(latencies, 50))
+            record[f"{name}_p95_ms"] = float(np.percentile(latencies, 95))
+        report.append(record)
+        del index
+    return report
+
+
+if __name__ == "__main__":
+    import glob
+
+    outputs = []
+    for path in sorted(glob.glob("outputs/*.json")):
+        with open(path, encoding="utf-8") as f:
+            outputs.append(json.load(f))
+    for record in benchmark_hybrid(outputs) + benchmark_bm25_latency():
+        print(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,325 @@
+# 缓存工具：内存LRU（支持TTL）+ 可选的SQLite磁盘层，以及合并并发相同请求的SingleFlight
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    线程安全的内存LRU缓存。
+
+    参数:
+    - maxsize: 最多缓存的条目数
+    - ttl: 过期时间（秒），None表示不过期
+    - max_bytes: 按size计算的总容量上限，None表示不限制，set时需要传入size
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (value, expire_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        命中返回缓存值，未命中或已过期返回None
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expire_at, size = item
+            if expire_at is not None and expire_at < time.time():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0):
+        expire_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expire_at, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.maxsize or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SQLiteCache:
+    """
+    基于SQLite的磁盘缓存，进程重启后仍然有效，值以文本形式存储。
+
+    参数:
+    - path: SQLite文件路径
+    - ttl: 过期时间（秒），None表示不过期
+    - max_bytes: 磁盘层总容量上限，超出时按最近访问时间淘汰，None表示不限制
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if self.ttl is not None and created_at + self.ttl < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            if self.max_bytes is not None:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM cache ORDER BY accessed_at ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            return {
+                "size": size,
+                "bytes": total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredCache:
+    """
+    两级缓存：先查内存层，未命中再查磁盘层，磁盘命中后回填内存层。
+    值必须可以JSON序列化。
+
+    参数:
+    - memory: LRUCache实例
+    - disk: SQLiteCache实例，None表示只使用内存层
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        text = self.disk.get(key)
+        if text is None:
+            return None
+        value = json.loads(text)
+        self.memory.set(key, value, len(text.encode("utf-8")))
+        return value
+
+    def set(self, key, value):
+        text = json.dumps(value, ensure_ascii=False)
+        self.memory.set(key, value, len(text.encode("utf-8")))
+        if self.disk is not None:
+            self.disk.set(key, text)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        """
+        命中/未命中/淘汰统计，hits为两层命中之和，misses为两层均未命中的次数
+        """
+        memory_stats = self.memory.stats()
+        disk_stats = self.disk.stats() if self.disk is not None else None
+        hits = memory_stats["hits"] + (disk_stats["hits"] if disk_stats else 0)
+        misses = disk_stats["misses"] if disk_stats else memory_stats["misses"]
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory": memory_stats,
+            "disk": disk_stats,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+class SingleFlight:
+    """
+    合并并发的相同异步调用：同一个key已有调用在途时，后到的调用方等待它的结果而不是重复发起。
+    只合并同一事件循环内的调用；结果（或异常）由所有等待方共享，调用方不应修改返回值。
+    发起调用的一方被取消时，等待方各自重新发起
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> (事件循环, future)
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, func):
+        """
+        func为无参数、返回协程的函数，只在没有相同key的调用在途时执行
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None or call[0] is not loop:
+                    future = loop.create_future()
+                    self._calls[key] = (loop, future)
+                    self.leaders += 1
+                    break
+                self.coalesced += 1
+            # asyncio.wait在本方被取消时抛出CancelledError，而不会取消共享的future；
+            # 正常返回但future已取消，说明发起方被取消，重新发起
+            await asyncio.wait([call[1]])
+            if not call[1].cancelled():
+                return call[1].result()
+
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待方时避免"exception was never retrieved"
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._calls.get(key, (None, None))[1] is future:
+                    del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders,
+                    "coalesced": self.coalesced}
+
+
+def normalize_query(text):
+    """
+    归一化查询文本：全角转半角、去除首尾空白和结尾标点、合并连续空白、英文转小写
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    text = " ".join(text.split()).lower()
+    return text.rstrip("?？。.!！ ")
+
+
+def retrieval_cache_key(query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+    """
+    检索缓存的键，由归一化后的查询文本、场景标签集合、省份标签、top_k和score_threshold决定
+    """
+    scene_tags = scene_tag if isinstance(scene_tag, list) else [scene_tag]
+    payload = json.dumps({
+        "query": normalize_query(query_text),
+        "scene_tag": sorted(set(scene_tags)),
+        "province_tag": province_tag,
+        "top_k": top_k,
+        "score_threshold": score_threshold,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def llm_cache_key(model, prompt):
+    """
+    LLM响应缓存的键，由模型名和完整prompt内容决定
+    """
+    payload = json.dumps({"model": model, "prompt": prompt}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
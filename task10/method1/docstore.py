@@ -0,0 +1,161 @@
+# 单次请求内的文档库：跨子问题对检索到的文档去重（文本hash/近似重复），共享证据只出现一次
+import hashlib
+import threading
+
+from .precheck import char_ngrams
+
+# 近似重复判定：字符5-gram集合的Jaccard相似度达到阈值视为同一文档片段
+NEAR_DUPLICATE_THRESHOLD = 0.85
+SHINGLE_SIZE = 5
+
+
+def _text_hash(text):
+    return hashlib.sha1("".join((text or "").split()).encode("utf-8")).hexdigest()
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class DocumentStore:
+    """
+    单次请求内的共享文档库。
+
+    文档按以下顺序判重：去除空白后的文本hash相同 → 与已有文档的字符5-gram Jaccard相似度
+    达到near_duplicate_threshold。不按url判重：同一url下的不同片段是不同的文档。
+    重复文档映射到首次出现的文档编号（D1、D2……）。
+
+    参数:
+    - near_duplicate_threshold: 近似重复阈值，None表示只做精确去重
+    """
+
+    def __init__(self, near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self._lock = threading.Lock()
+        self._docs = []        # 下标+1即文档编号
+        self._shingles = []
+        self._by_hash = {}
+        self.docs_seen = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.bytes_seen = 0
+        self.bytes_unique = 0
+
+    def add(self, doc):
+        """
+        加入一篇文档，返回文档编号（重复文档返回已有编号）
+        """
+        text = doc.get("text") or ""
+        size = len(text.encode("utf-8"))
+        text_hash = _text_hash(text)
+        with self._lock:
+            self.docs_seen += 1
+            self.bytes_seen += size
+
+            index = self._by_hash.get(text_hash)
+            if index is not None:
+                self.exact_duplicates += 1
+                return self._doc_id(index)
+
+            shingles = char_ngrams(text, SHINGLE_SIZE)
+            if self.near_duplicate_threshold is not None:
+                for i, existing in enumerate(self._shingles):
+                    if _jaccard(shingles, existing) >= self.near_duplicate_threshold:
+                        self.near_duplicates += 1
+                        return self._doc_id(i)
+
+            index = len(self._docs)
+            self._docs.append(doc)
+            self._shingles.append(shingles)
+            self._by_hash[text_hash] = index
+            self.bytes_unique += size
+            return self._doc_id(index)
+
+    def add_many(self, docs):
+        """
+        加入一组文档，返回去重后的文档编号列表（保持首次出现的顺序）
+        """
+        doc_ids = []
+        for doc in docs or []:
+            doc_id = self.add(doc)
+            if doc_id not in doc_ids:
+                doc_ids.append(doc_id)
+        return doc_ids
+
+    def unique_docs(self, docs):
+        """
+        把一组文档加入文档库并返回去重后的文档列表，供单个子问题的prompt使用
+        """
+        return [self.get(doc_id) for doc_id in self.add_many(docs)]
+
+    def get(self, doc_id):
+        return self._docs[int(doc_id[1:]) - 1]
+
+    @staticmethod
+    def _doc_id(index):
+        return f"D{index + 1}"
+
+    def __len__(self):
+        return len(self._docs)
+
+    def render(self, doc_ids=None):
+        """
+        把文档渲染为“[D1] 文档名\\n文本”形式，每篇文档只出现一次，doc_ids为None时渲染全部文档
+        """
+        if doc_ids is None:
+            doc_ids = [self._doc_id(i) for i in range(len(self._docs))]
+        blocks = []
+        for doc_id in doc_ids:
+            doc = self.get(doc_id)
+            if doc.get("text"):
+                blocks.append(f"[{doc_id}] {doc.get('doc_name', '')}\n{doc['text']}\n")
+        return "\n".join(blocks)
+
+    def stats(self):
+        """
+        去重统计：duplicate_rate为重复文档占所有加入文档的比例，bytes_saved为去重节省的文本字节数
+        """
+        with self._lock:
+            duplicates = self.exact_duplicates + self.near_duplicates
+            return {
+                "docs_seen": self.docs_seen,
+                "unique_docs": len(self._docs),
+                "exact_duplicates": self.exact_duplicates,
+                "near_duplicates": self.near_duplicates,
+                "duplicate_rate": duplicates / self.docs_seen if self.docs_seen else 0.0,
+                "bytes_seen": self.bytes_seen,
+                "bytes_unique": self.bytes_unique,
+                "bytes_saved": self.bytes_seen - self.bytes_unique,
+            }
+
+
+_totals_lock = threading.Lock()
+_totals = {"requests": 0, "docs_seen": 0, "unique_docs": 0, "bytes_seen": 0, "bytes_unique": 0}
+
+
+def record_request(store):
+    """
+    累计一次请求的去重统计，返回该请求的统计
+    """
+    stats = store.stats()
+    with _totals_lock:
+        _totals["requests"] += 1
+        for key in ("docs_seen", "unique_docs", "bytes_seen", "bytes_unique"):
+            _totals[key] += stats[key]
+    return stats
+
+
+def docstore_stats():
+    """
+    所有请求累计的去重统计
+    """
+    with _totals_lock:
+        totals = dict(_totals)
+    duplicates = totals["docs_seen"] - totals["unique_docs"]
+    totals["duplicate_rate"] = duplicates / totals["docs_seen"] if totals["docs_seen"] else 0.0
+    totals["bytes_saved"] = totals["bytes_seen"] - totals["bytes_unique"]
+    totals["bytes_saved_per_request"] = \
+        totals["bytes_saved"] / totals["requests"] if totals["requests"] else 0.0
+    return totals
@@ -1,92 +1,369 @@
 # RAG复杂问题处理链路主流程
+import contextvars
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
-from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
-from langchain_core.prompts import PromptTemplate
-from pydantic import BaseModel, Field
-
-from .prompt import (
-    decompose_query_prompt,
-    subquestion_answer_prompt,
-    check_relevance_prompt,
-    final_answer_prompt,
+from .prompt import batch_check_item_template
+from . import tracing
+from .packing import pack_documents
+from .parsing import (
+    JsonStringFieldExtractor, JsonParseError, loads_json, reask_prompt, record_parse
 )
+from .precheck import split_prechecked
+from .prompt_registry import get_prompt, warmup_prompts
+from .semantic_cache import get_decomposition_cache
 from .tools import (
-    chat_completions4, doc_2_doclist,
-    setup_logger, query_faults
+    chat_completions4, doc_2_doclist, get_llm_pool, get_retrieval_client,
+    setup_logger, query_faults_many, rag_context, estimate_tokens
 )
 
 logger = setup_logger("MyLogger", logging.DEBUG)
 
+# 场景内检索为空时，回退检索使用的全部场景标签
+FALLBACK_SCENE_TAGS = ["wlyh", "wxwy", "xczc", "yyjc", "xczhw"]
+
+# 批量检查时单个请求的prompt token预算，超出时拆分为多个请求
+BATCH_CHECK_TOKEN_BUDGET = 24000
+
+# 证据打包的token预算，None表示不打包、完整拼接所有文档（见packing.py）
+ANSWER_TOKEN_BUDGET = None  # 回答单个子问题时，参考文档的token预算（参考值1500）
+FINAL_TOKEN_BUDGET = None   # 最终答案融合时，所有改用参考文档的子问题共享的token预算（参考值6000）
+
+# 各类prompt期望的输出：(JSON类型, 必须包含的字段)，用于容错解析和统计（见parsing.py）
+JSON_OUTPUTS = {
+    "decompose": (list, ()),
+    "subanswer": (dict, ("answer",)),
+    "check": (dict, ("relevance", "faithfulness", "evidence_from_document")),
+    "batch_check": ((list, dict), ()),
+    "final": (dict, ("answer",)),
+}
+# 本地修复失败时是否用简短prompt重问一次
+REASK_ON_PARSE_FAILURE = True
+
+# 回退检索策略
+# - "serial": 先检索场景内，结果为空时再检索全部场景（默认）
+# - "scoped_only": 只检索场景内，不回退
+# - "speculative": 场景内与全部场景同时检索，场景内结果非空时使用场景内结果，否则使用全部场景结果
+# - "broad_merge": 场景内与全部场景同时检索，合并去重两路结果
+FALLBACK_POLICIES = ("serial", "scoped_only", "speculative", "broad_merge")
+FALLBACK_POLICY = "serial"
+
+_fallback_stats_lock = threading.Lock()
+_fallback_stats = {
+    "queries": 0,             # 检索的子问题数
+    "scoped_hits": 0,         # 场景内检索非空的次数
+    "fallback_used": 0,       # 最终使用了全部场景检索结果的次数
+    "broad_requests": 0,      # 发出的全部场景检索请求数
+    "speculative_wasted": 0,  # 推测发出但未被使用的全部场景检索请求数
+}
+
+
+def _response_content(response):
+    """
+    从chat_completions4的返回中取出文本内容。
+    """
+    if hasattr(response, "choices"):
+        return response.choices[0].message.content
+    return str(response)
+
+
+def _loads(content, prompt_type):
+    expect, required = JSON_OUTPUTS[prompt_type]
+    return loads_json(content, expect, required)[0]
+
+
+def _json_status(content, prompt_type):
+    expect, required = JSON_OUTPUTS[prompt_type]
+    try:
+        _, repaired = loads_json(content, expect, required)
+    except JsonParseError:
+        return None
+    return "repaired" if repaired else "ok"
+
+
+def _parses(prompt_type):
+    # 传给chat_completions4的validate：只有能解析（含本地修复）的输出才写入LLM响应缓存
+    return lambda content: _json_status(content, prompt_type) is not None
+
+
+def _reask_prompt(content, prompt_type):
+    expect, required = JSON_OUTPUTS[prompt_type]
+    return reask_prompt(content, expect if isinstance(expect, type) else None, required)
+
 
-class SubQuestionAnswer(BaseModel):
-    reference: str = Field(description="用于推理的文档原文")
-    answer: str = Field(description="基于引用内容进行推理的答案")
+def _record_parse(prompt_type, status, reasked=False):
+    # 解析结果同时记录在当前的llm.<prompt_type> span上
+    record_parse(prompt_type, status, reasked=reasked)
+    tracing.current_span().set(parse_status=status, reasked=reasked)
 
 
-class RelevanceCheck(BaseModel):
-    relevance: bool = Field(description="回答是否解答了子问题")
+def _finish_reask(prompt_type, content, reask_content):
+    if _json_status(reask_content, prompt_type) is not None:
+        _record_parse(prompt_type, "reask_ok", reasked=True)
+        logger.warning(f"{prompt_type} 输出无法修复，重问后解析成功")
+        return reask_content
+    _record_parse(prompt_type, "failed", reasked=True)
+    logger.error(f"{prompt_type} 输出解析失败，重问后仍无法解析，content：{content}")
+    return content
 
 
-class Hallucination_Check(BaseModel):
-    relevance: bool = Field(description="回答是否与子问题相关")
-    faithfulness: bool = Field(description="回答是否严格基于证据")
-    evidence_from_document: bool = Field(description="证据是否严格来自源参考文档")
+def _complete_json(prompt, prompt_type):
+    """
+    调用大模型并返回输出文本。输出无法直接解析时先在本地修复（见parsing.loads_json），
+    修复失败才用只附带原始输出的简短prompt重问一次（REASK_ON_PARSE_FAILURE），
+    解析结果按prompt类型计入parsing.parse_stats()。
+    """
+    with tracing.span(f"llm.{prompt_type}", prompt_type=prompt_type):
+        content = _response_content(chat_completions4(prompt, prompt_type=prompt_type,
+                                                      validate=_parses(prompt_type)))
+        status = _json_status(content, prompt_type)
+        if status is None and REASK_ON_PARSE_FAILURE:
+            reask_content = _response_content(
+                chat_completions4(_reask_prompt(content, prompt_type),
+                                  prompt_type=prompt_type, validate=_parses(prompt_type)))
+            return _finish_reask(prompt_type, content, reask_content)
+        _record_parse(prompt_type, status or "failed")
+        return content
+
+
+def warmup():
+    """
+    预先构造全部prompt和解析器、创建共享的LLM与检索客户端（此时才导入langchain_core、openai、requests），
+    供常驻服务和worker进程启动时调用，避免第一个问题承担这部分延迟
+    """
+    warmup_prompts()
+    # openai在首次访问chat.completions时才导入对应的资源模块
+    get_llm_pool().client().chat.completions
+    get_retrieval_client()
 
 
-class FinalAnswer(BaseModel):
-    answer: str = Field(description="最终答案")
+# 各阶段的prompt模板和解析器由prompt_registry构造一次，在请求间复用
+def _decompose_prompt_and_parser():
+    return get_prompt("decompose")
 
 
+def _parse_subquestions(parser, content):
+    try:
+        return _loads(content, "decompose")
+    except Exception as e:
+        raise ValueError(f"模型输出解析失败，内容为：{content}\n错误信息：{e}")
+
+
+def _lookup_decomposition(complex_query):
+    cache = get_decomposition_cache()
+    if cache is None:
+        return None
+    hit = cache.lookup(complex_query)
+    if hit is None:
+        return None
+    subquestions, cached_query, similarity = hit
+    logger.info(f"子问题拆解命中语义缓存，相似度{similarity:.4f}，原问题: {cached_query}")
+    return list(subquestions)
+
+
+def _store_decomposition(complex_query, subquestions):
+    cache = get_decomposition_cache()
+    if cache is not None:
+        cache.add(complex_query, list(subquestions))
+
+
+@tracing.traced()
 def generate_subquestions(complex_query, scene_tag, province_tag="hq"):
     """
     输入复杂Query，生成m个子问题，返回结构化JSON数组。
     """
-    # 创建输出解析器
-    parser = JsonOutputParser()
+    # 语义缓存：相似问题直接复用已有的拆解
+    cached = _lookup_decomposition(complex_query)
+    if cached is not None:
+        return cached
 
-    # 构造 prompt
-    prompt = PromptTemplate(
-        template=decompose_query_prompt,
-        input_variables=["complex_query"],
-        partial_variables={
-            "format_instructions": parser.get_format_instructions()}
-    )
+    # 构造 prompt 和输出解析器
+    prompt, parser = _decompose_prompt_and_parser()
 
     # 调用大模型
-    response = chat_completions4(prompt.format(complex_query=complex_query))
-    if hasattr(response, "choices"):
-        content = response.choices[0].message.content
-    else:
-        content = str(response)
+    content = _complete_json(prompt.format(complex_query=complex_query), "decompose")
 
     # 使用解析器解析输出
-    try:
-        subquestions = parser.parse(content)
-        assert isinstance(subquestions, list)
-        return subquestions
-    except Exception as e:
-        raise ValueError(f"模型输出解析失败，内容为：{content}\n错误信息：{e}")
+    subquestions = _parse_subquestions(parser, content)
+    _store_decomposition(complex_query, subquestions)
+    return subquestions
 
 
-def retrieve_docs_for_subquestions(subquestions, scene_tag, province_tag="hq", k=5):
+def fallback_stats():
     """
-    针对每个子问题检索k个文档。
+    回退检索计数，fallback_rate为最终走回退路径的子问题占比
     """
-    subquestions_docs = []
-    for query_text in subquestions:
-        rag_result = query_faults(query_text, scene_tag, province_tag="hq",
-                                  top_k=5, score_threshold=0.5)
-        if len(rag_result["data"]["context"]) == 0:
-            rag_result = query_faults(query_text, ["wlyh", "wxwy", "xczc", "yyjc", "xczhw"], province_tag="hq",
-                                      top_k=5, score_threshold=0.5)
-        subquestions_docs.append((query_text, rag_result["data"]["context"]))
-    return subquestions_docs
+    with _fallback_stats_lock:
+        stats = dict(_fallback_stats)
+    stats["fallback_rate"] = stats["fallback_used"] / stats["queries"] if stats["queries"] else 0.0
+    return stats
+
+
+def reset_fallback_stats():
+    with _fallback_stats_lock:
+        for key in _fallback_stats:
+            _fallback_stats[key] = 0
 
 
-def answer_subquestions_with_llm(subquestions_with_docs):
+def _merge_contexts(scoped, broad):
+    merged = list(scoped)
+    seen = {(doc.get("doc_name"), doc.get("text")) for doc in scoped}
+    for doc in broad:
+        key = (doc.get("doc_name"), doc.get("text"))
+        if key not in seen:
+            seen.add(key)
+            merged.append(doc)
+    return merged
+
+
+def _select_context(policy, scoped, broad):
+    """
+    按回退策略从场景内与全部场景的检索结果中选出最终文档列表，并更新计数。
+    broad为None表示没有发出全部场景检索。
+    """
+    if policy == "broad_merge":
+        context = _merge_contexts(scoped, broad or [])
+        fallback_used = len(scoped) == 0 and len(context) > 0
+    elif len(scoped) > 0 or broad is None:
+        context = scoped
+        fallback_used = False
+    else:
+        context = broad
+        fallback_used = True
+
+    with _fallback_stats_lock:
+        _fallback_stats["queries"] += 1
+        _fallback_stats["scoped_hits"] += int(len(scoped) > 0)
+        _fallback_stats["fallback_used"] += int(fallback_used)
+        _fallback_stats["broad_requests"] += int(broad is not None)
+        _fallback_stats["speculative_wasted"] += int(
+            policy == "speculative" and broad is not None and len(scoped) > 0)
+    return context
+
+
+def _dedupe(doc_store, docs):
+    return doc_store.unique_docs(docs) if doc_store is not None else docs
+
+
+@tracing.traced()
+def retrieve_docs_for_subquestions(subquestions, scene_tag, province_tag="hq", k=5,
+                                   fallback_policy=None, doc_store=None):
+    """
+    针对每个子问题检索k个文档，所有子问题并发检索。
+    fallback_policy为None时使用FALLBACK_POLICY，可选值见FALLBACK_POLICIES。
+    传入doc_store（docstore.DocumentStore）时，文档登记到本次请求的共享文档库，
+    每个子问题的文档列表去掉重复和近似重复的片段。
+    """
+    policy = fallback_policy or FALLBACK_POLICY
+    if policy not in FALLBACK_POLICIES:
+        raise ValueError(f"未知的回退检索策略：{policy}")
+
+    if policy in ("speculative", "broad_merge"):
+        # 场景内与全部场景两路检索同时发出，在复制的上下文中运行以保留链路追踪的span
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            scoped_future = executor.submit(
+                contextvars.copy_context().run, query_faults_many, subquestions, scene_tag,
+                province_tag="hq", top_k=5, score_threshold=0.5)
+            broad_future = executor.submit(
+                contextvars.copy_context().run, query_faults_many, subquestions,
+                FALLBACK_SCENE_TAGS, province_tag="hq", top_k=5, score_threshold=0.5)
+            scoped_contexts = [rag_context(r) for r in scoped_future.result()]
+            broad_contexts = [rag_context(r) for r in broad_future.result()]
+    else:
+        scoped_contexts = [rag_context(r) for r in query_faults_many(
+            subquestions, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5)]
+        broad_contexts = [None] * len(subquestions)
+
+        # 场景内检索为空的子问题，回退到全部场景再并发检索一次
+        if policy == "serial":
+            empty_indexes = [i for i, context in enumerate(scoped_contexts) if len(context) == 0]
+            fallback_results = query_faults_many(
+                [subquestions[i] for i in empty_indexes], FALLBACK_SCENE_TAGS, province_tag="hq",
+                top_k=5, score_threshold=0.5)
+            for i, rag_result in zip(empty_indexes, fallback_results):
+                broad_contexts[i] = rag_context(rag_result)
+
+    return [(query_text, _dedupe(doc_store, _select_context(policy, scoped, broad)))
+            for query_text, scoped, broad in zip(subquestions, scoped_contexts, broad_contexts)]
+
+
+def _subquestion_answer_prompt_and_parser():
+    return get_prompt("subanswer")
+
+
+def _format_subquestion_answer(prompt, subq, docs, token_budget=None):
+    # 处理文档内容，超出token预算时只保留与子问题最相关的句子
+    doc_texts = doc_2_doclist(pack_documents(subq, docs, token_budget, stage="answer"))
+    document_content = "\n\n".join(doc_texts) if doc_texts else "无相关文档"
+    return prompt.format(question=subq, document=document_content)
+
+
+def _parse_subanswer(parser, response):
+    try:
+        return {"reference": "", **_loads(_response_content(response), "subanswer")}
+    except JsonParseError:
+        # 如果解析失败，提供默认值
+        return {
+            "reference": "",
+            "answer": ""
+        }
+
+
+def _check_prompt_and_parser():
+    return get_prompt("check")
+
+
+def _format_check(prompt, subq, docs, subanswer):
+    # 提取文档文本内容用于faithfulness检查
+    doc_texts = doc_2_doclist(docs)
+
+    # faithfulness: 判断答案是否引用了文档内容
+    answer_text = subanswer.get("answer", "")
+    evidence = subanswer.get("reference", "")
+    return prompt.format(
+        subquestion=subq, answer=answer_text, evidence=evidence, document=doc_texts)
+
+
+def _verdict(value):
+    # 模型可能把判断写成字符串"true"/"false"，其他取值视为解析失败
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        verdict = {"true": True, "false": False}.get(value.strip().lower())
+        if verdict is not None:
+            return verdict
+    raise ValueError(f"无法识别的检查结果：{value!r}")
+
+
+def _parse_check(parser, response, subq, docs, subanswer):
+    try:
+        result = _loads(_response_content(response), "check")
+        relevance = _verdict(result["relevance"])
+        faithfulness = _verdict(result["faithfulness"])
+        evidence_from_document = _verdict(result["evidence_from_document"])
+    except Exception as e:
+        relevance = False
+        faithfulness = False
+        evidence_from_document = False
+        logger.error(f"check_faithfulness_and_relevance 返回结果解析异常")
+
+    return {
+        "subquestion": subq,
+        "docs_per_subq": docs,
+        "answer": subanswer.get("answer", ""),
+        "evidence": subanswer.get("reference", ""),
+        "faithfulness": faithfulness,
+        "relevance": relevance,
+        "evidence_from_document": evidence_from_document,
+    }
+
+
+@tracing.traced()
+def answer_subquestions_with_llm(subquestions_with_docs, token_budget=None):
     """
     LLM逐个回答子问题，基于检索到的文档生成结构化答案。
 
@@ -128,132 +405,224 @@ def answer_subquestions_with_llm(subquestions_with_docs):
         - 如果文档列表为空，会使用"无相关文档"作为输入
         - 多个文档会自动编号并合并文本内容
         - 解析失败时会返回空的answer字段
+        - token_budget（默认ANSWER_TOKEN_BUDGET）不为None时，参考文档超出预算会按句子裁剪
     """
-    parser = JsonOutputParser(pydantic_object=SubQuestionAnswer)
-
-    # 创建prompt模板
-    prompt = PromptTemplate(
-        template=subquestion_answer_prompt,
-        input_variables=["question", "document"],
-        partial_variables={
-            "format_instructions": parser.get_format_instructions()}
-    )
+    prompt, parser = _subquestion_answer_prompt_and_parser()
+    token_budget = token_budget if token_budget is not None else ANSWER_TOKEN_BUDGET
 
     results = []
     for subq, docs in subquestions_with_docs:
-        # 处理文档内容
-        doc_texts = doc_2_doclist(docs)
-        document_content = "\n\n".join(doc_texts) if doc_texts else "无相关文档"
-
         # 生成回答
-        formatted_prompt = prompt.format(
-            question=subq, document=document_content)
-        response = chat_completions4(formatted_prompt)
-
-        try:
-            if hasattr(response, "choices"):
-                content = response.choices[0].message.content
-            else:
-                content = str(response)
-
-            result = parser.parse(content)
-            subanswer = result
-        except Exception as e:
-            # 如果解析失败，提供默认值
-            subanswer = {
-                "reference": "",
-                "answer": ""
-            }
+        response = _complete_json(_format_subquestion_answer(prompt, subq, docs, token_budget),
+                                  "subanswer")
 
         # 返回三元组：(subquestion, docs, subanswer)
-        results.append((subq, docs, subanswer))
+        results.append((subq, docs, _parse_subanswer(parser, response)))
 
     return results
 
 
-def check_faithfulness_and_relevance(answers_with_docs):
-    parser = JsonOutputParser(pydantic_object=Hallucination_Check)
+def _merge_prechecked(settled, pending, checked_pending):
+    checked = dict(settled)
+    checked.update(zip(pending, checked_pending))
+    return [checked[i] for i in range(len(checked))]
 
-    # 创建prompt模板
-    prompt = PromptTemplate(
-        template=check_relevance_prompt,
-        input_variables=["subquestion", "answer", "document"],
-        partial_variables={
-            "format_instructions": parser.get_format_instructions()}
-    )
+
+@tracing.traced()
+def check_faithfulness_and_relevance(answers_with_docs, precheck=False):
+    """
+    逐个子问题调用LLM检查相关性、可信度和证据来源。
+    precheck=True时先做本地预检查（见precheck.py），只有模糊的情况才调用LLM。
+    """
+    if precheck:
+        answers_with_docs = list(answers_with_docs)
+        settled, pending = split_prechecked(answers_with_docs)
+        return _merge_prechecked(settled, pending, check_faithfulness_and_relevance(
+            [answers_with_docs[i] for i in pending]))
+
+    prompt, parser = _check_prompt_and_parser()
 
     results = []
     for subq, docs, subanswer in answers_with_docs:
-        # 提取文档文本内容用于faithfulness检查
-        doc_texts = doc_2_doclist(docs)
+        # relevance: 由LLM判断
+        response = _complete_json(_format_check(prompt, subq, docs, subanswer), "check")
+        results.append(_parse_check(parser, response, subq, docs, subanswer))
+    return results
 
-        # faithfulness: 判断答案是否引用了文档内容
-        answer_text = subanswer.get("answer", "")
-        evidence = subanswer.get("reference", "")
 
-        # relevance: 由LLM判断
-        formatted_prompt = prompt.format(
-            subquestion=subq, answer=answer_text, evidence=evidence, document=doc_texts)
-        response = chat_completions4(formatted_prompt)
+def _batch_check_prompt_and_parser():
+    return get_prompt("batch_check")
 
-        try:
-            if hasattr(response, "choices"):
-                content = response.choices[0].message.content
-            else:
-                content = str(response)
-
-            result = parser.parse(content)
-            relevance = result["relevance"]
-            faithfulness = result["faithfulness"]
-            evidence_from_document = result["evidence_from_document"]
-        except Exception as e:
-            relevance = False
-            faithfulness = False
-            evidence_from_document = False
-            logger.error(f"check_faithfulness_and_relevance 返回结果解析异常")
-
-        results.append({
-            "subquestion": subq,
-            "docs_per_subq": docs,
-            "answer": answer_text,
-            "evidence": evidence,
-            "faithfulness": faithfulness,
-            "relevance": relevance,
-            "evidence_from_document": evidence_from_document,
-        })
-    return results
+
+def _format_batch_check_item(index, subq, docs, subanswer):
+    return batch_check_item_template.format(
+        index=index, subquestion=subq,
+        answer=subanswer.get("answer", ""), evidence=subanswer.get("reference", ""),
+        document="\n".join(doc_2_doclist(docs)))
 
 
-def build_structured_evidence(subquestions_docs_subanswer):
+def _chunk_batch_check(answers_with_docs, prompt, max_prompt_tokens):
+    """
+    按token预算把待检查的子问题切成若干批，返回[(下标列表, formatted_prompt)]。
+    单组超出预算时独占一批。
+    """
+    base_tokens = estimate_tokens(prompt.format(items=""))
+    chunks = []
+    indexes, texts, tokens = [], [], base_tokens
+    for i, (subq, docs, subanswer) in enumerate(answers_with_docs):
+        text = _format_batch_check_item(i + 1, subq, docs, subanswer)
+        text_tokens = estimate_tokens(text)
+        if indexes and tokens + text_tokens > max_prompt_tokens:
+            chunks.append((indexes, prompt.format(items="\n".join(texts))))
+            indexes, texts, tokens = [], [], base_tokens
+        indexes.append(i)
+        texts.append(text)
+        tokens += text_tokens
+    if indexes:
+        chunks.append((indexes, prompt.format(items="\n".join(texts))))
+    return chunks
+
+
+def _parse_batch_check(parser, response, indexes):
+    """
+    解析批量检查结果，返回{下标: 检查结果}，缺失或格式不对的组不出现在结果中
+    """
+    try:
+        result = _loads(_response_content(response), "batch_check")
+    except JsonParseError:
+        logger.error(f"check_faithfulness_and_relevance_batch 返回结果解析异常")
+        return {}
+    if isinstance(result, dict):
+        result = [result]
+    if not isinstance(result, list):
+        return {}
+
+    wanted = set(indexes)
+    checks = {}
+    for item in result:
+        try:
+            index = int(item["index"]) - 1
+            check = {key: _verdict(item[key])
+                     for key in ("relevance", "faithfulness", "evidence_from_document")}
+        except (KeyError, TypeError, ValueError):
+            continue
+        if index in wanted:
+            checks[index] = check
+    return checks
+
+
+def _batch_check_item(check, subq, docs, subanswer):
+    return {
+        "subquestion": subq,
+        "docs_per_subq": docs,
+        "answer": subanswer.get("answer", ""),
+        "evidence": subanswer.get("reference", ""),
+        "faithfulness": check["faithfulness"],
+        "relevance": check["relevance"],
+        "evidence_from_document": check["evidence_from_document"],
+    }
+
+
+@tracing.traced()
+def check_faithfulness_and_relevance_batch(answers_with_docs,
+                                           max_prompt_tokens=BATCH_CHECK_TOKEN_BUDGET,
+                                           precheck=False):
+    """
+    批量检查：一次请求判断多个子问题的相关性、可信度和证据来源，
+    prompt超出max_prompt_tokens时按预算拆成多批并发请求。
+    模型漏判的子问题回退到逐个检查。返回结构与check_faithfulness_and_relevance一致。
+    precheck=True时本地预检查能判定的子问题不进入批量请求。
+    """
+    answers_with_docs = list(answers_with_docs)
+    if precheck:
+        settled, pending = split_prechecked(answers_with_docs)
+        return _merge_prechecked(settled, pending, check_faithfulness_and_relevance_batch(
+            [answers_with_docs[i] for i in pending], max_prompt_tokens))
+    if not answers_with_docs:
+        return []
+    prompt, parser = _batch_check_prompt_and_parser()
+    chunks = _chunk_batch_check(answers_with_docs, prompt, max_prompt_tokens)
+
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _complete_json, chunk_prompt,
+                                   "batch_check")
+                   for _, chunk_prompt in chunks]
+        responses = [future.result() for future in futures]
+
+    checks = {}
+    for (indexes, _), response in zip(chunks, responses):
+        checks.update(_parse_batch_check(parser, response, indexes))
+
+    missing = [i for i in range(len(answers_with_docs)) if i not in checks]
+    if missing:
+        logger.warning(f"批量检查漏判{len(missing)}个子问题，回退到逐个检查")
+    fallback = dict(zip(missing, check_faithfulness_and_relevance(
+        [answers_with_docs[i] for i in missing])))
+
+    return [fallback[i] if i in fallback else _batch_check_item(checks[i], *item)
+            for i, item in enumerate(answers_with_docs)]
+
+
+def _uses_docs(item):
+    return not item.get("faithfulness", False) or not item.get("relevance", False) \
+        or not item.get("evidence_from_document", False)
+
+
+@tracing.traced()
+def build_structured_evidence(subquestions_docs_subanswer, token_budget=None, doc_store=None):
     """
     拼接子问题+答案或子问题+参考文档构成structured evidence。
     faithfulness和relevance都为true时，拼接子问题-子答案；否则拼接子问题-参考文档。
+    token_budget（默认FINAL_TOKEN_BUDGET）不为None时，由所有拼接参考文档的子问题平分，
+    每个子问题的参考文档按句子裁剪到各自的预算内。
+    传入doc_store时参考文档只记录文档编号（doc_ids），文档内容由final_answer_with_rag_fusion
+    在共享参考文档中统一给出一次，token预算也在那里统一应用。
     返回所有数据对组成的列表。
     """
+    if doc_store is not None:
+        return _build_shared_structured_evidence(subquestions_docs_subanswer, doc_store)
+
+    token_budget = token_budget if token_budget is not None else FINAL_TOKEN_BUDGET
+    doc_items = sum(1 for item in subquestions_docs_subanswer if _uses_docs(item))
+    item_budget = token_budget // doc_items if token_budget is not None and doc_items else None
+
     structured_evidence = []
     for item in subquestions_docs_subanswer:
         subq = item["subquestion"]
-        docs = item.get("docs_per_subq", [])
-        answer = item.get("answer", "")
-        faithfulness = item.get("faithfulness", False)
-        relevance = item.get("relevance", False)
-        evidence_from_document = item.get("evidence_from_document", False)
-
-        docs_texts = doc_2_doclist(docs)
-
-        if not faithfulness or not relevance or not evidence_from_document:
+        # 只有改用参考文档的子问题才打包文档，使用子答案的不计入final阶段的打包统计
+        if _uses_docs(item):
+            docs = item.get("docs_per_subq", [])
             structured_evidence.append({
                 "subquestion": subq,
-                "evidence": docs_texts
+                "evidence": doc_2_doclist(pack_documents(subq, docs, item_budget, stage="final"))
             })
         else:
             structured_evidence.append({
                 "subquestion": subq,
-                "evidence": answer
+                "evidence": item.get("answer", "")
             })
     return structured_evidence
 
 
+def _build_shared_structured_evidence(subquestions_docs_subanswer, doc_store):
+    structured_evidence = []
+    for item in subquestions_docs_subanswer:
+        if _uses_docs(item):
+            doc_ids = doc_store.add_many(item.get("docs_per_subq", []))
+            structured_evidence.append({
+                "subquestion": item["subquestion"],
+                "evidence": f"参考文档：{'、'.join(doc_ids)}" if doc_ids else "无相关文档",
+                "doc_ids": doc_ids,
+            })
+        else:
+            structured_evidence.append({
+                "subquestion": item["subquestion"],
+                "evidence": item.get("answer", "")
+            })
+    return structured_evidence
+
+
+@tracing.traced()
 def build_structured_evidence_baseline(subquestions_docs):
     """
     拼接子问题+答案或子问题+参考文档构成structured evidence。
@@ -273,47 +642,205 @@ def build_structured_evidence_baseline(subquestions_docs):
     return structured_evidence
 
 
-def final_answer_with_rag_fusion(complex_query, structured_evidence):
-    """
-    LLM生成最终复杂问题答案（用RAG-Fusion做路径融合）。
-    要求模型严格按照提供的子问题答案或文档回答，不要编造内容。
-    """
-    # 创建输出解析器
-    parser = JsonOutputParser(pydantic_object=FinalAnswer)
+def _final_answer_prompt_and_parser():
+    return get_prompt("final")
 
-    # 创建prompt模板
-    prompt = PromptTemplate(
-        template=final_answer_prompt,
-        input_variables=["complex_query", "doc_anwer"],
-        partial_variables={
-            "format_instructions": parser.get_format_instructions()}
-    )
 
+def _render_shared_documents(complex_query, structured_evidence, doc_store, token_budget):
+    """
+    把结构化证据引用到的文档按编号各渲染一次，超出token预算时按与复杂问题的相关度裁剪
+    """
+    doc_ids = []
+    for item in structured_evidence:
+        for doc_id in item.get("doc_ids", []):
+            if doc_id not in doc_ids:
+                doc_ids.append(doc_id)
+    if not doc_ids:
+        return ""
+    docs = [{**doc_store.get(doc_id), "doc_id": doc_id} for doc_id in doc_ids]
+    docs = pack_documents(complex_query, docs, token_budget, stage="final")
+    blocks = [f"[{doc['doc_id']}] {doc.get('doc_name', '')}\n{doc['text']}\n"
+              for doc in docs if doc.get("text")]
+    return "共享参考文档：\n" + "\n".join(blocks) + "\n"
+
+
+def _format_final_answer(prompt, complex_query, structured_evidence, doc_store=None,
+                         token_budget=None):
     # 构造结构化证据字符串
     evidence_str = ""
+    if doc_store is not None:
+        token_budget = token_budget if token_budget is not None else FINAL_TOKEN_BUDGET
+        evidence_str += _render_shared_documents(
+            complex_query, structured_evidence, doc_store, token_budget)
     for i, item in enumerate(structured_evidence, 1):
         evidence_str += f"子问题{i}: {item['subquestion']}\n"
-        evidence_str += f"{item['evidence']}\n\n"
+        evidence = item["evidence"]
+        if isinstance(evidence, list):
+            # 参考文档按文本拼接，而不是把列表的repr放进prompt
+            evidence = "\n".join(evidence)
+        evidence_str += f"{evidence}\n\n"
 
-    formatted_prompt = prompt.format(
+    return prompt.format(
         complex_query=complex_query,
         structured_evidence=evidence_str
     )
 
-    response = chat_completions4(formatted_prompt)
 
+def _parse_final_answer(parser, response):
+    content = _response_content(response)
     try:
-        if hasattr(response, "choices"):
-            content = response.choices[0].message.content
-        else:
-            content = str(response)
-
-        result = parser.parse(content)
-        return result, formatted_prompt
-    except Exception as e:
+        return _loads(content, "final")
+    except JsonParseError:
         return {
             "answer": f"final_answer_with_rag_fusion解析失败，content：{content}",
-        }, formatted_prompt
+        }
+
+
+@tracing.traced()
+def final_answer_with_rag_fusion(complex_query, structured_evidence, doc_store=None):
+    """
+    LLM生成最终复杂问题答案（用RAG-Fusion做路径融合）。
+    要求模型严格按照提供的子问题答案或文档回答，不要编造内容。
+    structured_evidence由build_structured_evidence(..., doc_store=doc_store)生成时，
+    需传入同一个doc_store，引用到的文档在prompt中只出现一次。
+    """
+    prompt, parser = _final_answer_prompt_and_parser()
+    formatted_prompt = _format_final_answer(prompt, complex_query, structured_evidence, doc_store)
+
+    response = _complete_json(formatted_prompt, "final")
+    return _parse_final_answer(parser, response), formatted_prompt
+
+
+class FinalAnswerStream:
+    """
+    流式最终答案：迭代时产出answer字段新生成的文本，迭代结束后可读取完整结果。
+
+    属性（迭代结束后可用）:
+    - final_answer: 与final_answer_with_rag_fusion返回的final_answer相同的字典
+    - prompt: 完整prompt
+    - ttft: 从发出请求到产出第一段answer文本的耗时（秒），未产出时为None
+    - total_time: 从发出请求到生成结束的耗时（秒）
+    - content: 模型输出的完整原始文本
+
+    同步链路用for迭代，异步链路（chunks为异步生成器）用async for迭代。
+    """
+
+    def __init__(self, parser, prompt, chunks):
+        self.parser = parser
+        self.prompt = prompt
+        self._chunks = chunks
+        self.final_answer = None
+        self.ttft = None
+        self.total_time = None
+        self.content = None
+        self._span = tracing.NOOP_SPAN
+
+    def _start_span(self):
+        # 流式输出跨越多次yield，span不设为当前span，只在取下一段时临时激活，
+        # 使chat_completions4的span嵌套在其下
+        self._span = tracing.start_span("llm.final", prompt_type="final", stream=True)
+
+    def __iter__(self):
+        start_time = time.time()
+        extractor = JsonStringFieldExtractor("answer")
+        parts = []
+        self._start_span()
+        chunks = iter(self._chunks)
+        while True:
+            with tracing.use_span(self._span):
+                try:
+                    chunk = next(chunks, None)
+                except Exception as e:
+                    self._span.end(e)
+                    raise
+            if chunk is None:
+                break
+            parts.append(chunk)
+            text = extractor.feed(chunk)
+            if text:
+                if self.ttft is None:
+                    self.ttft = time.time() - start_time
+                yield text
+        # 输出在高位代理处截断时补出U+FFFD
+        text = extractor.finish()
+        if text:
+            if self.ttft is None:
+                self.ttft = time.time() - start_time
+            yield text
+        tail = self._finish(parts, start_time)
+        if tail:
+            yield tail
+
+    async def __aiter__(self):
+        start_time = time.time()
+        extractor = JsonStringFieldExtractor("answer")
+        parts = []
+        self._start_span()
+        chunks = self._chunks.__aiter__()
+        while True:
+            with tracing.use_span(self._span):
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    chunk = None
+                except Exception as e:
+                    self._span.end(e)
+                    raise
+            if chunk is None:
+                break
+            parts.append(chunk)
+            text = extractor.feed(chunk)
+            if text:
+                if self.ttft is None:
+                    self.ttft = time.time() - start_time
+                yield text
+        # 输出在高位代理处截断时补出U+FFFD
+        text = extractor.finish()
+        if text:
+            if self.ttft is None:
+                self.ttft = time.time() - start_time
+            yield text
+        tail = self._finish(parts, start_time)
+        if tail:
+            yield tail
+
+    def _finish(self, parts, start_time):
+        # 生成结束后按非流式的方式解析完整输出；answer字段没有被增量提取出来时
+        # （输出不是预期的JSON），把解析结果的answer一次性产出
+        self.content = "".join(parts)
+        with tracing.use_span(self._span):
+            _record_parse("final", _json_status(self.content, "final") or "failed")
+        self.final_answer = _parse_final_answer(self.parser, self.content)
+        self.total_time = time.time() - start_time
+        tail = ""
+        if self.ttft is None:
+            self.ttft = self.total_time
+            tail = self.final_answer.get("answer", "")
+        self._span.set(ttft=self.ttft)
+        self._span.end()
+        return tail
+
+    @property
+    def time_stats(self):
+        return [("final_answer_ttft", self.ttft), ("final_answer_with_rag_fusion", self.total_time)]
+
+
+def final_answer_with_rag_fusion_stream(complex_query, structured_evidence, doc_store=None):
+    """
+    final_answer_with_rag_fusion的流式版本，返回FinalAnswerStream，
+    迭代得到answer字段的增量文本，结束后从final_answer/ttft/total_time读取结果和耗时。
+
+    Example:
+        >>> stream = final_answer_with_rag_fusion_stream(complex_query, structured_evidence)
+        >>> for text in stream:
+        ...     print(text, end="", flush=True)
+        >>> stream.final_answer, stream.ttft, stream.total_time
+    """
+    prompt, parser = _final_answer_prompt_and_parser()
+    formatted_prompt = _format_final_answer(prompt, complex_query, structured_evidence, doc_store)
+    return FinalAnswerStream(parser, formatted_prompt,
+                             chat_completions4(formatted_prompt, stream=True,
+                                               prompt_type="final", validate=_parses("final")))
 
 
 def main():
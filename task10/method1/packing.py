@@ -0,0 +1,182 @@
+# 证据打包：在token预算内按与问题的相关度挑选文档句子，按句子边界截断
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from .precheck import char_ngrams
+from .tools import estimate_tokens
+
+# 本地分词器，None表示尚未加载；加载失败时退回到estimate_tokens
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?；;\n]+[。！？!?；;\n]*|[。！？!?；;\n]+")
+
+_stats_lock = threading.Lock()
+_stats = {}  # stage -> {"calls", "tokens_before", "tokens_after", "seconds"}
+
+
+def configure_tokenizer(tokenizer_path=None):
+    """
+    加载本地分词器用于计数token。
+
+    参数:
+    - tokenizer_path: 本地HuggingFace分词器目录（如qwen3-32b的tokenizer），
+      None时尝试tiktoken的cl100k_base，都不可用时使用estimate_tokens估算
+    """
+    global _tokenizer
+    encode = None
+    if tokenizer_path:
+        try:
+            from transformers import AutoTokenizer
+            hf_tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, local_files_only=True)
+            encode = lambda text: hf_tokenizer.encode(text, add_special_tokens=False)
+        except Exception:
+            encode = None
+    if encode is None:
+        try:
+            import tiktoken
+            encode = tiktoken.get_encoding("cl100k_base").encode
+        except Exception:
+            encode = None
+    with _tokenizer_lock:
+        _tokenizer = encode or False
+    return _tokenizer
+
+
+def count_tokens(text):
+    if _tokenizer is None:
+        configure_tokenizer()
+    if _tokenizer:
+        return len(_tokenizer(text))
+    return estimate_tokens(text)
+
+
+def split_sentences(text):
+    """
+    按句末标点和换行切分句子，句末标点保留在句子中，拼接后与原文一致
+    """
+    return [m.group(0) for m in _SENTENCE_PATTERN.finditer(text)]
+
+
+def truncate_to_tokens(text, token_budget):
+    """
+    截取text不超过token_budget个token的最长前缀
+    """
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def _score_sentences(query, sentences):
+    # 以字符bigram为词项的简化BM25：越稀有的问题词项命中权重越高，长句适当降权
+    query_grams = char_ngrams(query)
+    sentence_grams = [char_ngrams(sentence) for sentence in sentences]
+    df = Counter(gram for grams in sentence_grams for gram in grams & query_grams)
+    n = len(sentences)
+    avg_len = sum(len(grams) for grams in sentence_grams) / n if n else 1.0
+    scores = []
+    for grams in sentence_grams:
+        norm = 0.25 + 0.75 * len(grams) / (avg_len or 1.0)
+        scores.append(sum(math.log(1 + (n - df[gram] + 0.5) / (df[gram] + 0.5)) / norm
+                          for gram in grams & query_grams))
+    return scores
+
+
+def pack_documents(query, docs, token_budget, stage="answer"):
+    """
+    在token预算内挑选与query最相关的句子，返回结构相同的文档列表（text只保留入选句子，
+    句子保持原文顺序，没有入选句子的文档被去掉）。放不下的句子中得分最高、与问题相关的一句截取到剩余预算。
+    token_budget为None或文档本身未超预算时原样返回。
+
+    Args:
+        query (str): 用于排序的问题
+        docs (list): 检索得到的文档列表，每个文档为包含text字段的字典
+        token_budget (int | None): 所有文档text的token总预算
+        stage (str): 统计用的阶段名
+
+    Returns:
+        list: 打包后的文档列表
+    """
+    if token_budget is None or not docs:
+        return docs
+    start_time = time.time()
+    tokens_before = sum(count_tokens(doc.get("text") or "") for doc in docs)
+    if tokens_before <= token_budget:
+        _record(stage, tokens_before, tokens_before, time.time() - start_time)
+        return docs
+
+    # (文档下标, 句子下标, 句子)
+    sentences = [(doc_index, sentence_index, sentence)
+                 for doc_index, doc in enumerate(docs)
+                 for sentence_index, sentence in enumerate(split_sentences(doc.get("text") or ""))
+                 if sentence.strip()]
+    scores = _score_sentences(query, [sentence for _, _, sentence in sentences])
+    # 同分时优先检索排名靠前的文档和文档中靠前的句子
+    order = sorted(range(len(sentences)),
+                   key=lambda i: (-scores[i], sentences[i][0], sentences[i][1]))
+
+    selected, used, skipped = {}, 0, None  # 句子下标 -> 入选文本
+    for i in order:
+        cost = count_tokens(sentences[i][2])
+        if used + cost > token_budget:
+            if skipped is None:
+                skipped = i
+            continue
+        selected[i] = sentences[i][2]
+        used += cost
+    # 剩余预算截取放不下的句子中得分最高的一句（与问题无关且已有入选句子时不截取）；
+    # 没有句末标点的长文档只有一个"句子"，不截取时会整篇丢失
+    if skipped is not None and used < token_budget and (scores[skipped] > 0 or not selected):
+        text = truncate_to_tokens(sentences[skipped][2], token_budget - used)
+        if text.strip():
+            selected[skipped] = text
+            used += count_tokens(text)
+
+    packed = []
+    for doc_index, doc in enumerate(docs):
+        text = "".join(selected[i] for i, (d, _, _) in enumerate(sentences)
+                       if d == doc_index and i in selected)
+        if text.strip():
+            packed.append({**doc, "text": text})
+
+    _record(stage, tokens_before, used, time.time() - start_time)
+    return packed
+
+
+def _record(stage, tokens_before, tokens_after, seconds):
+    with _stats_lock:
+        stats = _stats.setdefault(stage, {
+            "calls": 0, "tokens_before": 0, "tokens_after": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        stats["tokens_before"] += tokens_before
+        stats["tokens_after"] += tokens_after
+        stats["seconds"] += seconds
+
+
+def packing_stats():
+    """
+    各阶段的证据打包统计：打包前后的文档token数、节省比例和打包耗时
+    """
+    with _stats_lock:
+        result = {}
+        for stage, stats in _stats.items():
+            saved = stats["tokens_before"] - stats["tokens_after"]
+            result[stage] = {
+                **stats,
+                "tokens_saved": saved,
+                "saved_rate": saved / stats["tokens_before"] if stats["tokens_before"] else 0.0,
+            }
+        return result
+
+
+def reset_packing_stats():
+    with _stats_lock:
+        _stats.clear()
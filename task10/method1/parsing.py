@@ -0,0 +1,292 @@
+# LLM输出解析：容错的JSON解析与修复、解析失败统计，流式输出时从尚未生成完的JSON中增量提取字符串字段
+import json
+import re
+import threading
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# 不成对的UTF-16代理（\uD800-\uDFFF）解码为替换字符
+REPLACEMENT_CHAR = "\ufffd"
+
+
+class JsonStringFieldExtractor:
+    """
+    从流式生成的JSON文本中增量提取某个字符串字段的值。
+
+    每次feed一段新生成的文本，返回这段文本中新解码出的字段内容（可能为空字符串），
+    转义字符（包括\\uXXXX和代理对）不完整时等待后续文本。不成对的代理解码为U+FFFD；
+    文本以高位代理结尾时它会留到下一次feed，流结束时调用finish()取出。
+    模型先输出<think>...</think>时，只在思考内容结束后查找字段。
+
+    参数:
+    - field: 要提取的字段名，默认"answer"
+    """
+
+    def __init__(self, field="answer"):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos = None    # 字段值在buffer中的当前解码位置，None表示还未找到字段
+        self._pending_high = None  # 等待低位代理的高位代理
+        self.done = False   # 字段值的结束引号已出现
+
+    @property
+    def found(self):
+        return self._pos is not None
+
+    def feed(self, chunk):
+        self._buffer += chunk or ""
+        if self.done:
+            return ""
+        if self._pos is None and not self._locate():
+            return ""
+        return self._decode()
+
+    def finish(self):
+        """
+        流结束时调用，返回还未输出的内容（末尾等待低位代理的高位代理输出为U+FFFD）
+        """
+        if self._pending_high is None:
+            return ""
+        self._pending_high = None
+        return REPLACEMENT_CHAR
+
+    def _flush_high(self, out):
+        # 高位代理后面不是低位代理
+        if self._pending_high is not None:
+            out.append(REPLACEMENT_CHAR)
+            self._pending_high = None
+
+    def _locate(self):
+        start = 0
+        stripped = self._buffer.lstrip()
+        if stripped.startswith("<think>"):
+            end = self._buffer.find("</think>")
+            if end < 0:
+                return False
+            start = end + len("</think>")
+        match = self._key.search(self._buffer, start)
+        if match is None:
+            return False
+        self._pos = match.end()
+        return True
+
+    def _decode(self):
+        out = []
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer):
+            ch = buffer[pos]
+            if ch == '"':
+                self._flush_high(out)
+                self.done = True
+                pos += 1
+                break
+            if ch != "\\":
+                self._flush_high(out)
+                out.append(ch)
+                pos += 1
+                continue
+            if pos + 1 >= len(buffer):
+                break
+            esc = buffer[pos + 1]
+            if esc == "u":
+                if pos + 6 > len(buffer):
+                    break
+                try:
+                    code = int(buffer[pos + 2:pos + 6], 16)
+                except ValueError:
+                    code = ord("?")
+                pos += 6
+                if 0xDC00 <= code <= 0xDFFF and self._pending_high is not None:
+                    out.append(chr(0x10000 + ((self._pending_high - 0xD800) << 10) + (code - 0xDC00)))
+                    self._pending_high = None
+                    continue
+                self._flush_high(out)
+                if 0xD800 <= code <= 0xDBFF:
+                    self._pending_high = code
+                elif 0xDC00 <= code <= 0xDFFF:
+                    out.append(REPLACEMENT_CHAR)
+                else:
+                    out.append(chr(code))
+                continue
+            self._flush_high(out)
+            out.append(_ESCAPES.get(esc, esc))
+            pos += 2
+        self._pos = pos
+        return "".join(out)
+
+
+def extract_json_string_field(text, field="answer"):
+    """
+    从（可能不完整的）JSON文本中一次性提取字符串字段的值，未出现该字段时返回None
+    """
+    extractor = JsonStringFieldExtractor(field)
+    value = extractor.feed(text) + extractor.finish()
+    return value if extractor.found else None
+
+
+# 修复失败后的重新请求中，附带的原始输出最多保留的字符数
+REASK_MAX_CHARS = 4000
+# 提取JSON时最多尝试的起始位置数，避免超长输出上的重复解码
+MAX_EXTRACT_ATTEMPTS = 50
+
+_THINK_PATTERN = re.compile(r"<think>.*?</think>", re.S)
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?[ \t]*\n?(.*?)```", re.S)
+
+_stats_lock = threading.Lock()
+_stats = {}  # prompt类型 -> 计数
+
+
+class JsonParseError(ValueError):
+    """
+    模型输出中找不到符合要求的JSON
+    """
+
+
+def strip_think(text):
+    """
+    去掉qwen3等模型输出的<think>...</think>思考内容；思考内容未闭合时去掉<think>之后的全部内容
+    """
+    text = _THINK_PATTERN.sub("", text or "")
+    start = text.find("<think>")
+    return text[:start] if start >= 0 else text
+
+
+def strip_code_fences(text):
+    """
+    有```json代码块时取第一个代码块的内容，否则原样返回
+    """
+    match = _FENCE_PATTERN.search(text)
+    return match.group(1) if match else text
+
+
+def remove_trailing_commas(text):
+    """
+    去掉对象和数组中最后一个元素后多余的逗号，字符串内的内容不受影响
+    """
+    out, in_string, escaped = [], False, False
+    for i, ch in enumerate(text):
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == ",":
+            rest = text[i + 1:].lstrip()
+            if rest[:1] in ("}", "]"):
+                continue
+        out.append(ch)
+    return "".join(out)
+
+
+def _matches(value, expect, required):
+    if expect is not None and not isinstance(value, expect):
+        return False
+    return not required or (isinstance(value, dict) and all(key in value for key in required))
+
+
+def _extract_first(text, expect, required):
+    # 从任意位置开始尝试解码，返回第一个符合要求的JSON对象或数组
+    decoder = json.JSONDecoder()
+    attempts = 0
+    for match in re.finditer(r"[\[{]", text):
+        attempts += 1
+        if attempts > MAX_EXTRACT_ATTEMPTS:
+            break
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if _matches(value, expect, required):
+            return value
+    raise JsonParseError("找不到符合要求的JSON")
+
+
+def loads_json(text, expect=None, required=()):
+    """
+    容错地解析模型输出的JSON。
+
+    依次尝试：直接解析 → 去掉<think>和代码块标记 → 去掉多余的逗号 →
+    提取文本中第一个符合要求的JSON对象或数组。
+
+    Args:
+        text (str): 模型输出
+        expect (type | tuple): 期望的类型，如dict、list，None表示不限
+        required (tuple): expect为dict时必须包含的字段
+
+    Returns:
+        tuple: (value, repaired)，repaired表示是否经过了修复
+
+    Raises:
+        JsonParseError: 无法得到符合要求的JSON
+    """
+    text = text or ""
+    try:
+        value = json.loads(text)
+        if _matches(value, expect, required):
+            return value, False
+    except ValueError:
+        pass
+    cleaned = remove_trailing_commas(strip_code_fences(strip_think(text)).strip())
+    try:
+        value = json.loads(cleaned)
+        if _matches(value, expect, required):
+            return value, True
+    except ValueError:
+        pass
+    return _extract_first(cleaned, expect, required), True
+
+
+def reask_prompt(text, expect=None, required=()):
+    """
+    修复失败时的简短重问prompt：只附带原始输出，不重复文档等上下文
+    """
+    if expect is list:
+        kind = "JSON数组"
+    elif expect is dict:
+        kind = "JSON对象"
+    else:
+        kind = "JSON"
+    fields = f"，必须包含字段：{'、'.join(required)}" if required else ""
+    content = strip_think(text).strip()[:REASK_MAX_CHARS]
+    return (f"下面是一段模型输出，其中的{kind}格式有误或不完整。"
+            f"请只输出修正后的合法{kind}{fields}，保持原有内容，"
+            f"不要输出任何解释、代码块标记或思考过程。\n\n{content}")
+
+
+def record_parse(prompt_type, status, reasked=False):
+    """
+    记录一次解析结果，status为"ok"（直接解析成功）、"repaired"（本地修复成功）、
+    "reask_ok"（重问后解析成功）或"failed"，reasked表示是否发起了重问
+    """
+    with _stats_lock:
+        stats = _stats.setdefault(prompt_type, {
+            "calls": 0, "ok": 0, "repaired": 0, "reasked": 0, "reask_ok": 0, "failed": 0})
+        stats["calls"] += 1
+        stats[status] += 1
+        stats["reasked"] += int(reasked)
+
+
+def parse_stats():
+    """
+    各prompt类型的解析统计：直接成功、本地修复、重问及最终失败的次数
+    """
+    with _stats_lock:
+        result = {}
+        for prompt_type, stats in _stats.items():
+            result[prompt_type] = {
+                **stats,
+                "failure_rate": stats["failed"] / stats["calls"] if stats["calls"] else 0.0,
+                "repair_rate": (stats["repaired"] + stats["reask_ok"]) / stats["calls"]
+                if stats["calls"] else 0.0,
+            }
+        return result
+
+
+def reset_parse_stats():
+    with _stats_lock:
+        _stats.clear()
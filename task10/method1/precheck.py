@@ -0,0 +1,186 @@
+# 忠实性/相关性本地预检查：用字符n-gram重叠判断明确的情况，只有模糊的情况才交给LLM
+import threading
+
+from .cache import normalize_query
+
+# 预检查阈值
+REFERENCE_SUPPORTED = 0.9     # 引用的n-gram有至少这么多出现在某篇文档中，视为引用来自文档
+REFERENCE_UNSUPPORTED = 0.2   # 引用的n-gram在所有文档中的覆盖率都低于该值，视为引用不是来自文档
+ANSWER_GROUNDED = 0.6         # 回答的n-gram有至少这么多出现在引用或文档中，视为回答基于证据
+QUESTION_COVERED = 0.3        # 子问题的n-gram有至少这么多出现在回答中，视为回答与子问题相关
+NGRAM = 2
+
+_CHECK_FIELDS = ("relevance", "faithfulness", "evidence_from_document")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checked": 0,            # 经过预检查的子问题数
+    "settled_positive": 0,   # 本地判定三项均为true的数量
+    "settled_negative": 0,   # 本地判定不通过的数量
+    "sent_to_llm": 0,        # 交给LLM判断的数量
+}
+
+
+def _clean(text):
+    # 去除空白后比较，避免换行/空格差异影响子串判断
+    return "".join(normalize_query(text).split())
+
+
+def char_ngrams(text, n=NGRAM):
+    text = _clean(text)
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def ngram_containment(text, source, n=NGRAM):
+    """
+    text的字符n-gram中出现在source里的比例，text为空时返回0
+    """
+    grams = char_ngrams(text, n)
+    if not grams:
+        return 0.0
+    return len(grams & char_ngrams(source, n)) / len(grams)
+
+
+def reference_support(reference, doc_texts):
+    """
+    引用与各篇文档的最大匹配程度：是某篇文档的子串时为1，否则为n-gram覆盖率的最大值
+    """
+    cleaned = _clean(reference)
+    if not cleaned:
+        return 0.0
+    best = 0.0
+    for text in doc_texts:
+        if cleaned in _clean(text):
+            return 1.0
+        best = max(best, ngram_containment(reference, text))
+    return best
+
+
+def precheck_answer(subq, docs, subanswer):
+    """
+    本地判断子问题回答是否通过检查。
+
+    Returns:
+        dict | None: 明确的情况返回{"relevance", "faithfulness", "evidence_from_document",
+            "reason"}，模糊的情况返回None交给LLM判断。
+            判定不通过时未单独判断的字段记为false，与LLM结果解析失败时的处理一致，
+            build_structured_evidence只要有一项为false就会改用参考文档。
+    """
+    answer = subanswer.get("answer", "") or ""
+    reference = subanswer.get("reference", "") or ""
+    doc_texts = [doc["text"] for doc in docs or [] if doc.get("text")]
+
+    if not _clean(answer):
+        return _settled(False, False, False, "empty_answer")
+    if not doc_texts:
+        # 没有文档时LLM按约定把证据来源判为true，交给LLM判断其余两项
+        return None
+
+    support = reference_support(reference, doc_texts)
+    if _clean(reference) and support < REFERENCE_UNSUPPORTED:
+        return _settled(False, False, False, "reference_not_in_documents")
+
+    grounded = ngram_containment(answer, reference + "\n" + "\n".join(doc_texts))
+    covered = ngram_containment(subq, answer)
+    if support >= REFERENCE_SUPPORTED and grounded >= ANSWER_GROUNDED and covered >= QUESTION_COVERED:
+        return _settled(True, True, True, "supported")
+    return None
+
+
+def _settled(relevance, faithfulness, evidence_from_document, reason):
+    return {
+        "relevance": relevance,
+        "faithfulness": faithfulness,
+        "evidence_from_document": evidence_from_document,
+        "reason": reason,
+    }
+
+
+def split_prechecked(answers_with_docs):
+    """
+    对一批子问题回答做预检查。
+
+    Returns:
+        tuple: (settled, pending)
+            - settled (dict): {下标: 与check_faithfulness_and_relevance单条结果相同结构的字典}
+            - pending (list): 需要交给LLM判断的下标
+    """
+    settled, pending = {}, []
+    for i, (subq, docs, subanswer) in enumerate(answers_with_docs):
+        check = precheck_answer(subq, docs, subanswer)
+        if check is None:
+            pending.append(i)
+            continue
+        settled[i] = {
+            "subquestion": subq,
+            "docs_per_subq": docs,
+            "answer": subanswer.get("answer", ""),
+            "evidence": subanswer.get("reference", ""),
+            "faithfulness": check["faithfulness"],
+            "relevance": check["relevance"],
+            "evidence_from_document": check["evidence_from_document"],
+            "precheck": check["reason"],
+        }
+
+    with _stats_lock:
+        _stats["checked"] += len(answers_with_docs)
+        _stats["settled_positive"] += sum(1 for item in settled.values() if item["relevance"])
+        _stats["settled_negative"] += sum(1 for item in settled.values() if not item["relevance"])
+        _stats["sent_to_llm"] += len(pending)
+    return settled, pending
+
+
+def precheck_stats():
+    """
+    预检查计数，llm_calls_avoided为逐个检查模式下省下的LLM调用次数
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["llm_calls_avoided"] = stats["settled_positive"] + stats["settled_negative"]
+    stats["avoided_rate"] = stats["llm_calls_avoided"] / stats["checked"] if stats["checked"] else 0.0
+    return stats
+
+
+def reset_precheck_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def evaluate_precheck(labeled_items):
+    """
+    在带LLM标注的样本上评估预检查与LLM的一致率。
+
+    Args:
+        labeled_items (list): check_faithfulness_and_relevance的输出（或outputs/*_method1.json中
+            的checked_subquestions_docs_subanswer），包含subquestion、docs_per_subq、answer、
+            evidence及三个LLM判定字段
+
+    Returns:
+        dict: settled为本地判定的数量，agreement为本地判定与LLM在“是否采用子答案”
+            （三项同时为true）上一致的比例，field_agreement为各字段分别一致的比例
+    """
+    settled = agree = 0
+    field_agree = {field: 0 for field in _CHECK_FIELDS}
+    for item in labeled_items:
+        check = precheck_answer(item["subquestion"], item.get("docs_per_subq", []), {
+            "answer": item.get("answer", ""), "reference": item.get("evidence", "")})
+        if check is None:
+            continue
+        settled += 1
+        llm_pass = all(item.get(field, False) for field in _CHECK_FIELDS)
+        agree += int(llm_pass == all(check[field] for field in _CHECK_FIELDS))
+        for field in _CHECK_FIELDS:
+            field_agree[field] += int(bool(item.get(field, False)) == check[field])
+
+    total = len(labeled_items)
+    return {
+        "total": total,
+        "settled": settled,
+        "coverage": settled / total if total else 0.0,
+        "agreement": agree / settled if settled else None,
+        "field_agreement": {field: count / settled if settled else None
+                            for field, count in field_agree.items()},
+    }
@@ -92,3 +92,40 @@ final_answer_prompt = """
 {structured_evidence}
 
 """
+
+
+batch_check_relevance_prompt = """
+你是一名严谨的学术评审专家。下面给出多组“子问题-回答-回答证据-源参考文档”，请逐组判断“回答”是否满足以下三个标准：
+
+1. **相关性**：回答是否直接回答了“子问题”。
+2. **可信度**：回答是否严格基于提供的证据。
+3. **证据来源**：证据是否严格来自于提供的文档内容。
+
+要求：
+- 每组只根据本组的子问题、回答、回答证据和源参考文档进行判断，不引入外部知识，也不参考其他组的内容。
+- 输出 JSON 数组，每组对应数组中的一个对象，对象包含以下字段：
+  - "index"：组编号，与下方的编号一致。
+  - "relevance"：判断回答是否与子问题相关，值为 `true` 或 `false`。
+  - "faithfulness"：判断回答是否严格基于回答证据，值为 `true` 或 `false`，evidence为空则为`true`。
+  - "evidence_from_document"：判断证据是否严格来自源参考文档，值为 `true` 或 `false`，document为空则为`true`。
+- 数组中必须包含所有组，不要输出解释或额外文字，仅输出最终的 JSON 数组。
+
+数组中每个对象的格式说明：
+{format_instructions}
+
+{items}
+"""
+
+batch_check_item_template = """### 第{index}组
+子问题：
+{subquestion}
+
+回答：
+{answer}
+
+回答证据：
+{evidence}
+
+源参考文档：
+{document}
+"""
@@ -0,0 +1,105 @@
+# prompt注册表：各阶段的prompt模板和输出解析器按prompt类型注册，首次使用时构造一次，之后在请求间复用。
+# langchain_core和pydantic只在构造时导入，导入method1本身不加载它们
+import threading
+
+from .prompt import (
+    decompose_query_prompt,
+    subquestion_answer_prompt,
+    check_relevance_prompt,
+    final_answer_prompt,
+    batch_check_relevance_prompt,
+)
+
+
+class CompiledPrompt:
+    """
+    预编译的prompt模板。
+
+    格式说明（format_instructions）在构造时生成一次，format()只用str.format填充请求相关的变量，
+    输出与同一模板的langchain f-string PromptTemplate一致，但不再经过langchain的校验和格式化开销。
+    """
+
+    def __init__(self, template, input_variables, partial_variables=None):
+        self.template = template
+        self.input_variables = tuple(input_variables)
+        self.partial_variables = dict(partial_variables or {})
+
+    def format(self, **kwargs):
+        return self.template.format(**self.partial_variables, **kwargs)
+
+
+def _output_models():
+    # 各prompt期望输出的结构，只用于生成格式说明（解析见main._loads）
+    from pydantic import BaseModel, Field
+
+    class SubQuestionAnswer(BaseModel):
+        reference: str = Field(description="用于推理的文档原文")
+        answer: str = Field(description="基于引用内容进行推理的答案")
+
+    class Hallucination_Check(BaseModel):
+        relevance: bool = Field(description="回答是否与子问题相关")
+        faithfulness: bool = Field(description="回答是否严格基于证据")
+        evidence_from_document: bool = Field(description="证据是否严格来自源参考文档")
+
+    class BatchHallucinationCheck(Hallucination_Check):
+        index: int = Field(description="组编号")
+
+    class FinalAnswer(BaseModel):
+        answer: str = Field(description="最终答案")
+
+    return {
+        "subanswer": SubQuestionAnswer,
+        "check": Hallucination_Check,
+        "batch_check": BatchHallucinationCheck,
+        "final": FinalAnswer,
+    }
+
+
+# prompt类型 -> (模板, 请求相关的变量)，输出结构见_output_models，没有的按任意JSON生成格式说明
+PROMPT_SPECS = {
+    "decompose": (decompose_query_prompt, ("complex_query",)),
+    "subanswer": (subquestion_answer_prompt, ("question", "document")),
+    "check": (check_relevance_prompt, ("subquestion", "answer", "evidence", "document")),
+    "batch_check": (batch_check_relevance_prompt, ("items",)),
+    "final": (final_answer_prompt, ("complex_query", "structured_evidence")),
+}
+
+_prompts = {}
+_prompts_lock = threading.Lock()
+
+
+def _build(prompt_type, models):
+    from langchain_core.output_parsers import JsonOutputParser
+
+    template, input_variables = PROMPT_SPECS[prompt_type]
+    parser = JsonOutputParser(pydantic_object=models.get(prompt_type))
+    prompt = CompiledPrompt(template, input_variables,
+                            {"format_instructions": parser.get_format_instructions()})
+    return prompt, parser
+
+
+def get_prompt(prompt_type):
+    """
+    获取prompt类型对应的(CompiledPrompt, JsonOutputParser)，首次调用时构造整个注册表
+    """
+    entry = _prompts.get(prompt_type)
+    if entry is not None:
+        return entry
+    if prompt_type not in PROMPT_SPECS:
+        raise KeyError(f"未注册的prompt类型：{prompt_type}")
+    warmup_prompts()
+    return _prompts[prompt_type]
+
+
+def warmup_prompts():
+    """
+    构造全部已注册的prompt，供服务和worker进程启动时预热，避免首个请求承担导入和构造的开销
+    """
+    with _prompts_lock:
+        if len(_prompts) == len(PROMPT_SPECS):
+            return
+        models = _output_models()
+        for prompt_type in PROMPT_SPECS:
+            if prompt_type not in _prompts:
+                _prompts[prompt_type] = _build(prompt_type, models)
+
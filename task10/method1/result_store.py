@@ -0,0 +1,592 @@
+# 结果存储：评测运行结果按列追加写入，检索文档和最终prompt按内容hash只存一份。
+# 安装了pyarrow时使用Parquet（每次flush写出一个文件），否则每列一个JSONL文件；
+# 读取时只流式读取需要的列（Parquet以内存映射方式按批读取，JSONL列文件用mmap逐行读取）
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+
+from .tools import setup_logger
+
+STORE_VERSION = 1
+FLUSH_ROWS = 256         # Parquet后端缓冲的行数，达到后写出一个文件
+READ_BATCH_SIZE = 1024   # Parquet按批读取的行数
+PARQUET_COMPRESSION = "zstd"
+
+# 每个子问题的结果：文档只记录编号（docs表的doc_id），baseline的记录只有subquestion和doc_ids。
+# 字段顺序与check_faithfulness_and_relevance的输出一致，load_record按此顺序还原
+SUBQUESTION_FIELDS = (
+    ("subquestion", "string"),
+    ("doc_ids", "strings"),
+    ("answer", "string"),
+    ("evidence", "string"),
+    ("faithfulness", "bool"),
+    ("relevance", "bool"),
+    ("evidence_from_document", "bool"),
+    ("precheck", "string"),
+)
+# 表名 -> [(列名, 类型)]
+TABLES = {
+    "runs": (
+        ("run_id", "string"),
+        ("id", "string"),
+        ("method", "string"),
+        ("source", "string"),
+        ("created_at", "float"),
+        ("complex_query", "string"),
+        ("reference_answer", "string"),
+        ("final_answer", "string"),
+        ("final_prompt_id", "string"),      # texts表的text_id
+        ("subquestions", "strings"),
+        ("results_key", "string"),          # 原记录中子问题结果的字段名
+        ("subquestion_results", "subquestion_results"),
+        ("timestatus", "timestatus"),
+        ("elapsed", "float"),
+        ("error", "string"),
+        ("record_keys", "strings"),         # 原记录的字段名及顺序（如baseline的Timestatus）
+        ("extra", "string"),                # 其余字段，JSON
+    ),
+    "docs": (
+        ("doc_id", "string"),
+        ("doc_name", "string"),
+        ("text", "string"),
+        ("url", "string"),
+        ("img_url", "string"),
+        ("doc_keys", "strings"),            # 原文档的字段名及顺序
+        ("extra", "string"),                # 其余字段，JSON
+    ),
+    "texts": (
+        ("text_id", "string"),
+        ("text", "string"),
+    ),
+}
+_DOC_FIELDS = ("doc_name", "text", "url", "img_url")
+# 记录中按列存储的字段，其余字段存入runs表的extra列
+_RECORD_FIELDS = ("id", "method", "complex_query", "reference_answer", "final_answer", "final_prompt",
+                  "subquestions", "subquestions_docs", "checked_subquestions_docs_subanswer",
+                  "timestatus", "Timestatus", "elapsed", "error")
+
+logger = setup_logger("ResultStore", logging.INFO)
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _content_hash(value):
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True)
+                        .encode("utf-8")).hexdigest()
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return {"true": True, "false": False}.get(value.strip().lower())
+    return bool(value)
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "float": pa.float64(), "bool": pa.bool_(),
+             "strings": pa.list_(pa.string())}
+    types["timestatus"] = pa.list_(pa.struct([("stage", pa.string()), ("seconds", pa.float64())]))
+    types["subquestion_results"] = pa.list_(pa.struct(
+        [(name, types[kind]) for name, kind in SUBQUESTION_FIELDS]))
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+class _JsonlTable:
+    # 每列一个JSONL文件，第i行是第i条记录在该列的值。追加时各列依次写入一行，
+    # 进程崩溃可能导致各列行数不一致或最后一行不完整，打开时截到所有列都完整的行数
+    def __init__(self, directory, columns, readonly=False):
+        self.directory = directory
+        self.columns = tuple(name for name, _ in columns)
+        self._files = None
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+            for column in self.columns:
+                open(self._path(column), "ab").close()
+        self.rows = self._complete_rows(truncate=not readonly)
+
+    def _path(self, column):
+        return os.path.join(self.directory, f"{column}.jsonl")
+
+    def _complete_rows(self, truncate):
+        counts, complete_ends = {}, {}
+        for column in self.columns:
+            path = self._path(column)
+            if not os.path.exists(path):
+                raise ValueError(f"结果存储缺少列文件：{path}")
+            # 按块统计换行数，不逐行解析；以换行结尾的行才算完整
+            counts[column] = complete_ends[column] = offset = 0
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    lines = chunk.count(b"\n")
+                    if lines:
+                        counts[column] += lines
+                        complete_ends[column] = offset + chunk.rindex(b"\n") + 1
+                    offset += len(chunk)
+        rows = min(counts.values())
+        if truncate:
+            for column in self.columns:
+                path = self._path(column)
+                end = self._line_end(path, rows) if counts[column] > rows else complete_ends[column]
+                size = os.path.getsize(path)
+                if size > end:
+                    logger.warning(f"截掉{path}末尾不完整的{size - end}字节")
+                    with open(path, "rb+") as f:
+                        f.truncate(end)
+        return rows
+
+    @staticmethod
+    def _line_end(path, rows):
+        # 第rows行结尾的偏移量，只在修复行数不一致的列时使用
+        end = 0
+        with open(path, "rb") as f:
+            for _ in range(rows):
+                end += len(f.readline())
+        return end
+
+    def append(self, rows):
+        if self._files is None:
+            self._files = {column: open(self._path(column), "a", encoding="utf-8")
+                           for column in self.columns}
+        for column in self.columns:
+            self._files[column].write("".join(
+                json.dumps(row.get(column), ensure_ascii=False) + "\n" for row in rows))
+        for f in self._files.values():
+            f.flush()
+        self.rows += len(rows)
+
+    def flush(self):
+        pass
+
+    def iter_rows(self, columns):
+        if self.rows == 0:
+            return
+        with contextlib.ExitStack() as stack:
+            readers = []
+            for column in columns:
+                f = stack.enter_context(open(self._path(column), "rb"))
+                data = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                readers.append(iter(data.readline, b""))
+            # 只读到打开时的完整行数，其他进程之后追加的行不会读到一半
+            for _ in range(self.rows):
+                yield {column: json.loads(next(reader)) for column, reader in zip(columns, readers)}
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+
+class _ParquetTable:
+    # 追加的行先缓冲在内存中，每次flush写出一个Parquet文件（part-00000.parquet, ...）。
+    # 先写临时文件再改名，进程崩溃时不会留下不完整的文件，只丢失尚未flush的行
+    def __init__(self, directory, columns, readonly=False):
+        import pyarrow.parquet as pq
+
+        self.directory = directory
+        self.columns = tuple(name for name, _ in columns)
+        self._schema = _arrow_schema(columns)
+        self._buffer = []
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self.rows = sum(pq.ParquetFile(path).metadata.num_rows for path in self._parts())
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.directory, "part-*.parquet")))
+
+    def append(self, rows):
+        self._buffer.extend(rows)
+        self.rows += len(rows)
+        if len(self._buffer) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        parts = self._parts()
+        index = int(os.path.basename(parts[-1])[len("part-"):-len(".parquet")]) + 1 if parts else 0
+        path = os.path.join(self.directory, f"part-{index:05d}.parquet")
+        table = pa.Table.from_pylist(self._buffer, schema=self._schema)
+        pq.write_table(table, path + ".tmp", compression=PARQUET_COMPRESSION)
+        os.replace(path + ".tmp", path)
+        self._buffer = []
+
+    def iter_rows(self, columns):
+        import pyarrow.parquet as pq
+
+        for path in self._parts():
+            parquet_file = pq.ParquetFile(path, memory_map=True)
+            for batch in parquet_file.iter_batches(batch_size=READ_BATCH_SIZE, columns=list(columns)):
+                yield from batch.to_pylist()
+        for row in self._buffer:
+            yield {column: row.get(column) for column in columns}
+
+    def close(self):
+        self.flush()
+
+
+class ResultStore:
+    """
+    评测结果存储。
+
+    目录下meta.json记录存储格式，三张表均只追加、不修改已有的行：
+    - runs: 每次运行一行，包括问题、方法、最终答案、各阶段耗时，以及每个子问题的答案、
+      检查结果和引用文档的编号
+    - docs: 检索文档，按内容hash（doc_id）只存一份
+    - texts: 最终prompt等长文本，按内容hash（text_id）只存一份
+    分析时用iter_runs(columns)只读取需要的列，load_record还原outputs/*.json格式的完整记录。
+
+    参数:
+    - path: 存储目录
+    - backend: "parquet"或"jsonl"；None表示已有存储沿用原格式，新建时安装了pyarrow用parquet，否则用jsonl
+    - readonly: 只读打开，不截断也不写入，可以与正在追加的进程同时读取
+    """
+
+    def __init__(self, path, backend=None, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if backend is not None and backend != meta["backend"]:
+                raise ValueError(f"{path}已使用{meta['backend']}格式，不能以{backend}格式打开")
+            backend = meta["backend"]
+        elif readonly:
+            raise FileNotFoundError(f"结果存储不存在：{path}")
+        else:
+            backend = backend or ("parquet" if _has_pyarrow() else "jsonl")
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"backend": backend, "version": STORE_VERSION}, f)
+        if backend not in ("parquet", "jsonl"):
+            raise ValueError(f"未知的存储格式：{backend}")
+        self.backend = backend
+
+        table_cls = _ParquetTable if backend == "parquet" else _JsonlTable
+        self._tables = {name: table_cls(os.path.join(path, name), columns, readonly)
+                        for name, columns in TABLES.items()}
+        self._lock = threading.Lock()
+        self._known = None
+
+    def _known_ids(self):
+        # 已写入的run_id、doc_id、text_id，首次追加时从各表读取，用于去重
+        if self._known is None:
+            self._known = {
+                "runs": {row["run_id"] for row in self._tables["runs"].iter_rows(("run_id",))},
+                "docs": {row["doc_id"] for row in self._tables["docs"].iter_rows(("doc_id",))},
+                "texts": {row["text_id"] for row in self._tables["texts"].iter_rows(("text_id",))},
+            }
+        return self._known
+
+    def append(self, record, method=None, source=None):
+        """
+        追加一条运行结果。record为outputs/*.json或batch_runner结果记录的格式，
+        method未指定时取record["method"]。返回run_id；内容完全相同的记录已存在时跳过并返回None
+        """
+        if self.readonly:
+            raise ValueError("结果存储以只读方式打开")
+        method = method or record.get("method")
+        docs, texts = {}, {}
+        row = self._run_row(record, method, source, docs, texts)
+        with self._lock:
+            known = self._known_ids()
+            if row["run_id"] in known["runs"]:
+                return None
+            # 先写文档和文本再写运行记录，崩溃时不会出现引用了不存在文档的运行记录
+            for table, key, values in (("docs", "doc_id", docs), ("texts", "text_id", texts)):
+                new_rows = [value for value_id, value in values.items()
+                            if value_id not in known[table]]
+                if new_rows:
+                    self._tables[table].append(new_rows)
+                    known[table].update(value[key] for value in new_rows)
+            self._tables["runs"].append([row])
+            known["runs"].add(row["run_id"])
+        return row["run_id"]
+
+    def _run_row(self, record, method, source, docs, texts):
+        def intern_doc(doc):
+            doc_id = _content_hash(doc)
+            if doc_id not in docs:
+                extra = {key: value for key, value in doc.items() if key not in _DOC_FIELDS}
+                docs[doc_id] = dict({field: _text(doc.get(field)) for field in _DOC_FIELDS},
+                                    doc_id=doc_id, doc_keys=list(doc),
+                                    extra=_text(extra) if extra else None)
+            return doc_id
+
+        results_key, results = None, []
+        if record.get("checked_subquestions_docs_subanswer") is not None:
+            results_key = "checked_subquestions_docs_subanswer"
+            for item in record[results_key]:
+                results.append({
+                    "subquestion": _text(item.get("subquestion")),
+                    "doc_ids": [intern_doc(doc) for doc in item.get("docs_per_subq") or []],
+                    "answer": _text(item.get("answer")),
+                    "evidence": _text(item.get("evidence")),
+                    "relevance": _bool(item.get("relevance")),
+                    "faithfulness": _bool(item.get("faithfulness")),
+                    "evidence_from_document": _bool(item.get("evidence_from_document")),
+                    "precheck": _text(item.get("precheck")),
+                })
+        elif record.get("subquestions_docs") is not None:
+            results_key = "subquestions_docs"
+            for subquestion, subquestion_docs in record[results_key]:
+                results.append({"subquestion": _text(subquestion),
+                                "doc_ids": [intern_doc(doc) for doc in subquestion_docs or []]})
+
+        final_prompt_id = None
+        if record.get("final_prompt") is not None:
+            final_prompt = _text(record["final_prompt"])
+            final_prompt_id = _content_hash(final_prompt)
+            texts[final_prompt_id] = {"text_id": final_prompt_id, "text": final_prompt}
+
+        extra = {key: value for key, value in record.items() if key not in _RECORD_FIELDS}
+        final_answer = record.get("final_answer")
+        if isinstance(final_answer, dict) and list(final_answer) == ["answer"] \
+                and isinstance(final_answer["answer"], (str, type(None))):
+            final_answer = final_answer["answer"]
+        elif final_answer is not None:
+            # 不是{"answer": 文本}形式的最终答案原样存入extra，final_answer列只保留答案文本
+            extra["final_answer"] = final_answer
+            final_answer = final_answer.get("answer") if isinstance(final_answer, dict) else final_answer
+        timestatus = record.get("timestatus", record.get("Timestatus")) or []
+        return {
+            "run_id": _content_hash([method, record])[:16],
+            "id": _text(record.get("id")),
+            "method": method,
+            "source": source,
+            "created_at": time.time(),
+            "complex_query": _text(record.get("complex_query")),
+            "reference_answer": _text(record.get("reference_answer")),
+            "final_answer": _text(final_answer),
+            "final_prompt_id": final_prompt_id,
+            "subquestions": [_text(subquestion) for subquestion in record.get("subquestions") or []],
+            "results_key": results_key,
+            "subquestion_results": results,
+            "timestatus": [{"stage": stage, "seconds": _float(seconds)}
+                           for stage, seconds in timestatus],
+            "elapsed": _float(record.get("elapsed")),
+            "error": _text(record.get("error")),
+            "record_keys": list(record),
+            "extra": _text(extra) if extra else None,
+        }
+
+    def flush(self):
+        with self._lock:
+            for table in self._tables.values():
+                table.flush()
+
+    def close(self):
+        with self._lock:
+            for table in self._tables.values():
+                table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def iter_runs(self, columns=None):
+        """
+        逐行返回运行记录，columns指定只读取的列（见TABLES["runs"]），None表示全部列
+        """
+        columns = tuple(columns or self._tables["runs"].columns)
+        unknown = set(columns) - set(self._tables["runs"].columns)
+        if unknown:
+            raise ValueError(f"未知的列：{sorted(unknown)}")
+        return self._tables["runs"].iter_rows(columns)
+
+    def get_docs(self, doc_ids):
+        """
+        按doc_id取文档，返回{doc_id: 文档字典（与检索结果中的格式相同）}
+        """
+        wanted, found = set(doc_ids), {}
+        columns = self._tables["docs"].columns
+        for row in self._tables["docs"].iter_rows(columns):
+            if row["doc_id"] in wanted:
+                values = {field: row[field] for field in _DOC_FIELDS}
+                if row["extra"]:
+                    values.update(json.loads(row["extra"]))
+                found[row["doc_id"]] = {key: values.get(key) for key in row["doc_keys"]}
+                if len(found) == len(wanted):
+                    break
+        return found
+
+    def get_texts(self, text_ids):
+        wanted, found = set(text_ids), {}
+        for row in self._tables["texts"].iter_rows(("text_id", "text")):
+            if row["text_id"] in wanted:
+                found[row["text_id"]] = row["text"]
+                if len(found) == len(wanted):
+                    break
+        return found
+
+    def load_record(self, run_id):
+        """
+        还原一次运行的原始记录（outputs/*.json或batch_runner结果记录），字段名和顺序与追加时相同，
+        找不到时返回None
+        """
+        row = next((row for row in self.iter_runs() if row["run_id"] == run_id), None)
+        if row is None:
+            return None
+        results = row["subquestion_results"] or []
+        docs = self.get_docs({doc_id for item in results for doc_id in item["doc_ids"] or []})
+        final_prompt = self.get_texts([row["final_prompt_id"]]).get(row["final_prompt_id"]) \
+            if row["final_prompt_id"] else None
+
+        timestatus = [[item["stage"], item["seconds"]] for item in row["timestatus"] or []]
+        values = {"id": row["id"], "method": row["method"], "complex_query": row["complex_query"],
+                  "reference_answer": row["reference_answer"],
+                  "final_answer": {"answer": row["final_answer"]}, "final_prompt": final_prompt,
+                  "subquestions": row["subquestions"], "timestatus": timestatus,
+                  "Timestatus": timestatus, "elapsed": row["elapsed"], "error": row["error"]}
+        if row["results_key"] == "subquestions_docs":
+            values["subquestions_docs"] = [
+                [item["subquestion"], [docs[doc_id] for doc_id in item["doc_ids"] or []]]
+                for item in results]
+        elif row["results_key"] is not None:
+            values[row["results_key"]] = []
+            for item in results:
+                entry = {"subquestion": item["subquestion"],
+                         "docs_per_subq": [docs[doc_id] for doc_id in item["doc_ids"] or []]}
+                entry.update((name, item[name]) for name, _ in SUBQUESTION_FIELDS[2:]
+                             if item[name] is not None or name != "precheck")
+                values[row["results_key"]].append(entry)
+        if row["extra"]:
+            values.update(json.loads(row["extra"]))
+        return {key: values.get(key) for key in row["record_keys"]}
+
+    def stage_latencies(self, method=None):
+        """
+        只读取method和timestatus两列，返回{方法: {阶段: 耗时列表}}
+        """
+        latencies = {}
+        for row in self.iter_runs(("method", "timestatus")):
+            if method is not None and row["method"] != method:
+                continue
+            stages = latencies.setdefault(row["method"], {})
+            for item in row["timestatus"] or []:
+                stages.setdefault(item["stage"], []).append(item["seconds"])
+        return latencies
+
+    def summary(self):
+        """
+        每个方法的运行数和各阶段耗时的均值与p50/p95
+        """
+        import numpy as np
+        summary = {}
+        for method, stages in self.stage_latencies().items():
+            summary[method] = {"stages": {
+                stage: {"count": len(values), "mean": float(np.mean(values)),
+                        "p50": float(np.percentile(values, 50)),
+                        "p95": float(np.percentile(values, 95))}
+                for stage, values in stages.items()}}
+        for row in self.iter_runs(("method",)):
+            summary.setdefault(row["method"], {"stages": {}})
+            summary[row["method"]]["runs"] = summary[row["method"]].get("runs", 0) + 1
+        return summary
+
+    def stats(self):
+        """
+        各表的行数和磁盘占用（字节）
+        """
+        stats = {"backend": self.backend}
+        for name, table in self._tables.items():
+            size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.path, name, "*")))
+            stats[name] = {"rows": table.rows, "bytes": size}
+        return stats
+
+
+def _method_from_filename(path):
+    # outputs/MOS质差_method1.json -> method1
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.rsplit("_", 1)[-1] if "_" in stem else None
+
+
+def import_outputs(store, pattern="outputs/*.json"):
+    """
+    导入已有的结果文件，返回新导入的记录数（已导入过的记录会被跳过）：
+    - *.json: outputs目录下单次运行的结果，方法名取文件名最后一个下划线之后的部分（MOS质差_method1.json → method1）
+    - *.jsonl: batch_runner的结果文件，每行一条记录，方法名取记录中的method字段
+    """
+    imported = 0
+    for path in sorted(glob.glob(pattern)):
+        source = os.path.basename(path)
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                records = [(json.loads(line), None) for line in f if line.strip()]
+            else:
+                records = [(json.load(f), _method_from_filename(path))]
+        for record, method in records:
+            if store.append(record, method=method, source=source) is not None:
+                imported += 1
+    store.flush()
+    return imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="评测结果存储：导入、汇总和还原运行记录")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="导入outputs/*.json或batch_runner的结果文件")
+    import_parser.add_argument("store")
+    import_parser.add_argument("patterns", nargs="+", help="文件glob，如 outputs/*.json")
+    import_parser.add_argument("--backend", choices=("parquet", "jsonl"))
+    for name, help_text in (("summary", "各方法的运行数和阶段耗时分位数"), ("stats", "各表的行数和磁盘占用")):
+        subparsers.add_parser(name, help=help_text).add_argument("store")
+    show_parser = subparsers.add_parser("show", help="还原一次运行的完整记录")
+    show_parser.add_argument("store")
+    show_parser.add_argument("run_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        with ResultStore(args.store, backend=args.backend) as store:
+            imported = sum(import_outputs(store, pattern) for pattern in args.patterns)
+            print(json.dumps({"imported": imported, **store.stats()}, ensure_ascii=False))
+        return 0
+    store = ResultStore(args.store, readonly=True)
+    if args.command == "summary":
+        output = store.summary()
+    elif args.command == "stats":
+        output = store.stats()
+    else:
+        output = store.load_record(args.run_id)
+        if output is None:
+            print(f"找不到运行记录：{args.run_id}", file=sys.stderr)
+            return 1
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+# 检索后端：统一的检索接口，检索服务（tools.RetrievalClient）和进程内本地向量索引是两种实现
+import abc
+import contextvars
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from . import tracing
+from .semantic_cache import HashingEmbedder
+
+# 本地向量索引的默认配置
+LOCAL_EMBEDDING_DIM = 256     # 默认哈希向量维度
+LOCAL_EMBED_BATCH_SIZE = 256  # 入库时每批计算向量的文档数
+LOCAL_POOL_SIZE = 4           # query_faults_many的默认并发数
+
+
+class Retriever(abc.ABC):
+    """
+    检索后端接口，子类实现query_faults。
+
+    query_faults的参数和返回结构与检索服务一致：成功返回{"data": {"context": [文档, ...]}}，
+    失败返回包含error字段的字典。query_faults_many默认用线程池并发调用query_faults。
+    """
+
+    pool_size = LOCAL_POOL_SIZE
+    cache = None
+
+    @abc.abstractmethod
+    def query_faults(self, query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+        """
+        检索单个query
+        """
+
+    def query_faults_many(self, queries, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5,
+                          max_workers=None):
+        """
+        并发检索多个query，返回结果顺序与queries一致
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        max_workers = min(max_workers or self.pool_size, len(queries))
+
+        def run(submitted_at, query_text):
+            # 每个任务在提交时复制的上下文中运行，使链路追踪的span嵌套在调用方下
+            tracing.add_queue_wait(time.perf_counter() - submitted_at)
+            return self.query_faults(query_text, scene_tag, province_tag, top_k, score_threshold)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, run,
+                                       time.perf_counter(), query_text)
+                       for query_text in queries]
+            return [future.result() for future in futures]
+
+    def close(self):
+        pass
+
+
+def _text_hash(text):
+    return hashlib.sha1("".join((text or "").split()).encode("utf-8")).hexdigest()
+
+
+def _tag_key(scene_tag, province_tag):
+    return f"{scene_tag}|{province_tag}"
+
+
+class TaggedIndex(Retriever):
+    """
+    本地索引的公共部分：按行号存放文档，相同文本只存一行，
+    (scene_tag, province_tag)到行号的倒排表（array("q")）用于按标签过滤。
+    子类实现_append(docs)，把一批新文档写入自己的索引结构。
+    """
+
+    def __init__(self, pool_size=LOCAL_POOL_SIZE):
+        self.pool_size = pool_size
+        self._size = 0
+        self._docs = []            # 行号 -> 文档
+        self._rows_by_hash = {}    # 文本hash -> 行号
+        self._tag_rows = {}        # "scene_tag|province_tag" -> array("q", 行号)
+        self._tag_arrays = {}      # 倒排表的NumPy视图缓存，入库后失效
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    def tags(self):
+        with self._lock:
+            return {key: len(rows) for key, rows in self._tag_rows.items()}
+
+    def doc(self, row):
+        return self._docs[row]
+
+    @abc.abstractmethod
+    def _append(self, docs):
+        """
+        把一批新文档写入索引结构，之后由add_documents调用_register登记
+        """
+
+    def _register(self, docs, scene_tag, province_tag):
+        # 子类写入索引后调用，登记文档和标签，返回新增的行号范围
+        start = self._size
+        self._size += len(docs)
+        self._docs.extend(docs)
+        rows = self._tag_rows.setdefault(_tag_key(scene_tag, province_tag), array("q"))
+        rows.extend(range(start, self._size))
+        self._tag_arrays.clear()
+        return range(start, self._size)
+
+    def add_documents(self, docs, scene_tag, province_tag="hq", batch_size=LOCAL_EMBED_BATCH_SIZE):
+        """
+        加入文档（包含text字段的字典），相同文本只写入一次索引，已存在的文档只补充标签。
+        返回新增的文档数
+        """
+        key = _tag_key(scene_tag, province_tag)
+        new_docs, seen = [], set()
+        with self._lock:
+            for doc in docs:
+                text_hash = _text_hash(doc.get("text"))
+                row = self._rows_by_hash.get(text_hash)
+                if row is not None:
+                    rows = self._tag_rows.setdefault(key, array("q"))
+                    if row not in rows:
+                        rows.append(row)
+                        self._tag_arrays.clear()
+                elif text_hash not in seen and doc.get("text"):
+                    seen.add(text_hash)
+                    new_docs.append((text_hash, doc))
+
+        for i in range(0, len(new_docs), batch_size):
+            batch = new_docs[i:i + batch_size]
+            with self._lock:
+                self._append([doc for _, doc in batch])
+                rows = self._register([doc for _, doc in batch], scene_tag, province_tag)
+                for (text_hash, _), row in zip(batch, rows):
+                    self._rows_by_hash[text_hash] = row
+        return len(new_docs)
+
+    def _rows_for(self, scene_tag, province_tag):
+        # 返回标签对应的行号数组；scene_tag为None或覆盖全部文档时返回None
+        import numpy as np
+        if scene_tag is None:
+            return None
+        scene_tags = scene_tag if isinstance(scene_tag, list) else [scene_tag]
+        keys = tuple(sorted({_tag_key(tag, province_tag) for tag in scene_tags}))
+        with self._lock:
+            rows = self._tag_arrays.get(keys)
+            if rows is None:
+                postings = [np.frombuffer(self._tag_rows[key], dtype=np.int64)
+                            for key in keys if key in self._tag_rows and len(self._tag_rows[key])]
+                if not postings:
+                    rows = np.zeros(0, dtype=np.int64)
+                elif len(postings) == 1:
+                    rows = postings[0].copy()
+                else:
+                    rows = np.unique(np.concatenate(postings))
+                self._tag_arrays[keys] = rows
+            return None if len(rows) == self._size else rows
+
+
+class LocalVectorRetriever(TaggedIndex):
+    """
+    进程内的本地向量检索。
+
+    文档向量按行存放在NumPy矩阵中（可从磁盘以mmap方式加载），按标签过滤见TaggedIndex。
+    相似度为归一化向量的内积（余弦相似度），低于score_threshold的结果被过滤。
+
+    参数:
+    - embedder: 提供encode(texts)方法和dim属性的向量模型，默认LOCAL_EMBEDDING_DIM维哈希向量
+    - dtype: 向量矩阵的存储类型（NumPy dtype或其名称），"float16"可将内存减半
+    - score_threshold: 本地向量模型的相似度分布与检索服务不同，不为None时替代调用方传入的阈值
+    """
+
+    def __init__(self, embedder=None, dtype="float32", score_threshold=None,
+                 pool_size=LOCAL_POOL_SIZE):
+        import numpy as np
+        super().__init__(pool_size)
+        self.embedder = embedder or HashingEmbedder(dim=LOCAL_EMBEDDING_DIM)
+        self.dim = self.embedder.dim
+        self.dtype = np.dtype(dtype)
+        self.score_threshold = score_threshold
+        self._matrix = np.zeros((0, self.dim), dtype=self.dtype)
+
+    def _reserve(self, count):
+        # 容量按倍数扩展；mmap加载的只读矩阵在第一次入库时复制到内存
+        import numpy as np
+        needed = self._size + count
+        if needed <= len(self._matrix) and self._matrix.flags.writeable:
+            return
+        capacity = max(needed, 2 * len(self._matrix), 1024)
+        grown = np.zeros((capacity, self.dim), dtype=self.dtype)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def _write_vectors(self, vectors):
+        self._reserve(len(vectors))
+        self._matrix[self._size:self._size + len(vectors)] = vectors
+
+    def _append(self, docs):
+        self._write_vectors(self.embedder.encode([doc["text"] for doc in docs]))
+
+    def add_vectors(self, vectors, docs, scene_tag, province_tag="hq"):
+        """
+        直接加入已计算好的向量（需预先归一化）和对应文档，不做去重，返回新增的行号范围
+        """
+        import numpy as np
+        vectors = np.asarray(vectors).reshape(-1, self.dim)
+        with self._lock:
+            self._write_vectors(vectors)
+            return self._register(docs, scene_tag, province_tag)
+
+    def search(self, vector, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+        """
+        返回[(行号, 相似度)]，按相似度降序
+        """
+        import numpy as np
+        rows = self._rows_for(scene_tag, province_tag)
+        matrix = self._matrix[:self._size]
+        vector = np.asarray(vector, dtype=self.dtype)
+        if rows is None:
+            scores = matrix @ vector
+        elif len(rows) == 0:
+            return []
+        else:
+            scores = matrix[rows] @ vector
+        candidates = np.flatnonzero(scores >= score_threshold)
+        if len(candidates) == 0:
+            return []
+        k = min(top_k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        ids = top if rows is None else rows[top]
+        return [(int(row), float(scores[i])) for row, i in zip(ids, top)]
+
+    def query_faults(self, query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+        """
+        本地检索，返回结构与检索服务一致
+        """
+        if self.score_threshold is not None:
+            score_threshold = self.score_threshold
+        try:
+            vector = self.embedder.encode([query_text])[0]
+            matches = self.search(vector, scene_tag, province_tag, top_k, score_threshold)
+        except Exception as e:
+            return {"error": str(e), "status_code": None, "text": ""}
+        return {"data": {"context": [dict(self._docs[row]) for row, _ in matches]}}
+
+    def save(self, directory):
+        """
+        保存到目录：embeddings.npy（向量矩阵）、docs.jsonl（文档）、tags.json（标签倒排表）
+        """
+        import numpy as np
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            np.save(os.path.join(directory, "embeddings.npy"), self._matrix[:self._size])
+            with open(os.path.join(directory, "docs.jsonl"), "w", encoding="utf-8") as f:
+                for doc in self._docs:
+                    f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            with open(os.path.join(directory, "tags.json"), "w", encoding="utf-8") as f:
+                json.dump({key: list(rows) for key, rows in self._tag_rows.items()}, f)
+
+    @classmethod
+    def load(cls, directory, embedder=None, mmap=True, **kwargs):
+        """
+        从save保存的目录加载，mmap=True时向量矩阵以只读mmap方式打开，不整体读入内存。
+        embedder需与入库时使用的向量模型一致
+        """
+        import numpy as np
+        matrix = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        retriever = cls(embedder=embedder, dtype=matrix.dtype, **kwargs)
+        if matrix.shape[1] != retriever.dim:
+            raise ValueError(f"向量维度不一致：索引为{matrix.shape[1]}，向量模型为{retriever.dim}")
+        retriever._matrix = matrix
+        retriever._size = len(matrix)
+        with open(os.path.join(directory, "docs.jsonl"), encoding="utf-8") as f:
+            retriever._docs = [json.loads(line) for line in f if line.strip()]
+        with open(os.path.join(directory, "tags.json"), encoding="utf-8") as f:
+            retriever._tag_rows = {key: array("q", rows) for key, rows in json.load(f).items()}
+        retriever._rows_by_hash = {_text_hash(doc.get("text")): row
+                                   for row, doc in enumerate(retriever._docs)}
+        return retriever
+
+
+def _output_docs(data):
+    # outputs/*_method1.json中的文档在checked_subquestions_docs_subanswer里，
+    # outputs/*_baseline.json中的文档在subquestions_docs里
+    for item in data.get("checked_subquestions_docs_subanswer", []):
+        yield from item.get("docs_per_subq", [])
+    for _, docs in data.get("subquestions_docs", []):
+        yield from docs
+
+
+def ingest_outputs(retriever, pattern="outputs/*.json", scene_tag="wlyh", province_tag="hq"):
+    """
+    把outputs/*.json中出现过的文档加入本地索引，返回新增的文档数
+    """
+    added = 0
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        added += retriever.add_documents(list(_output_docs(data)), scene_tag, province_tag)
+    return added
+
+
+def benchmark_local_retriever(sizes=(10_000, 100_000, 1_000_000), dim=LOCAL_EMBEDDING_DIM,
+                              n_queries=50, top_k=5, scene_tags=("wlyh", "wxwy", "xczc", "yyjc",
+                                                                 "xczhw"), dtype="float32",
+                              seed=0):
+    """
+    用随机单位向量测试本地索引在不同规模下的检索延迟（不含query向量计算）。
+
+    Returns:
+        list: 每个规模一条记录，包含建库耗时、矩阵占用字节数，以及
+            按单个场景标签过滤（filtered）和覆盖全部标签（all_tags）时的p50/p95延迟（毫秒）
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    report = []
+    for size in sizes:
+        # 向量直接由add_vectors写入，embedder只用于确定维度
+        retriever = LocalVectorRetriever(embedder=HashingEmbedder(dim=dim), dtype=dtype)
+        start_time = time.time()
+        # 各场景标签均分文档，每批最多10万条，避免生成随机向量时占用过多内存
+        chunk = min(100_000, -(-size // len(scene_tags)))
+        for start in range(0, size, chunk):
+            count = min(chunk, size - start)
+            vectors = rng.standard_normal((count, dim), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            tag = scene_tags[(start // chunk) % len(scene_tags)]
+            retriever.add_vectors(vectors, [{"text": ""}] * count, tag)
+        build_seconds = time.time() - start_time
+
+        queries = rng.standard_normal((n_queries, dim), dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        record = {"chunks": size, "dim": dim, "dtype": np.dtype(dtype).name,
+                  "build_seconds": build_seconds,
+                  "matrix_bytes": int(retriever._matrix[:size].nbytes)}
+        for name, tags in (("filtered", scene_tags[0]), ("all_tags", list(scene_tags))):
+            latencies = []
+            for vector in queries:
+                start_time = time.perf_counter()
+                retriever.search(vector, tags, top_k=top_k, score_threshold=-1.0)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            record[f"{name}_p50_ms"] = float(np.percentile(latencies, 50))
+            record[f"{name}_p95_ms"] = float(np.percentile(latencies, 95))
+        report.append(record)
+        del retriever
+    return report
+
+
+if __name__ == "__main__":
+    for record in benchmark_local_retriever():
+        print(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,190 @@
+# 问题路由：按复杂度决定是否拆解子问题，拆解后合并近似重复的子问题并限制数量
+import threading
+from collections import deque
+
+from .precheck import char_ngrams
+
+# 复杂度打分达到阈值视为复杂问题，走子问题拆解链路
+COMPLEXITY_THRESHOLD = 1.0
+# 拆解后最多保留的子问题数，None表示不限制
+MAX_SUBQUESTIONS = 5
+# 子问题合并阈值：字符bigram的Jaccard相似度 / 向量余弦相似度
+LEXICAL_MERGE_THRESHOLD = 0.7
+EMBEDDING_MERGE_THRESHOLD = 0.9
+# 简单问题节省调用数的估算基准：完整链路平均拆出的子问题数（outputs/*_method1.json中为4~6个）
+ESTIMATED_SUBQUESTIONS = 5
+
+# 强连接词：通常连接两个独立的问题
+STRONG_CONJUNCTIONS = ("以及", "并且", "而且", "同时", "从而", "进而", "还是", "此外", "另外", "然后")
+# 弱连接词：常出现在名词短语内部（如“效率和质量”），权重较低
+WEAK_CONJUNCTIONS = ("和", "与", "及", "或")
+INTERROGATIVES = ("是什么", "为什么", "如何", "怎么", "怎样", "多少", "哪些", "哪个", "是否", "能否",
+                  "有没有")
+CLAUSE_SEPARATORS = "，,；;。？?！!"
+
+_stats_lock = threading.Lock()
+_stats = {"queries": 0, "simple": 0, "complex": 0, "subquestions_generated": 0,
+          "subquestions_kept": 0, "llm_calls_saved": 0, "retrievals_saved": 0}
+_recent = deque(maxlen=1000)
+
+
+def query_features(query):
+    """
+    复杂度特征：问号数、分句数、连接词数、疑问词数、长度
+    """
+    query = query or ""
+    clauses = [query]
+    for separator in CLAUSE_SEPARATORS:
+        clauses = [part for clause in clauses for part in clause.split(separator)]
+    return {
+        "length": len(query),
+        "question_marks": query.count("？") + query.count("?"),
+        "clauses": sum(1 for clause in clauses if clause.strip()),
+        "strong_conjunctions": sum(query.count(word) for word in STRONG_CONJUNCTIONS),
+        "weak_conjunctions": sum(query.count(word) for word in WEAK_CONJUNCTIONS),
+        "interrogatives": sum(1 for word in INTERROGATIVES if word in query),
+    }
+
+
+def complexity_score(features):
+    return (max(features["question_marks"] - 1, 0)
+            + max(features["interrogatives"] - 1, 0)
+            + features["strong_conjunctions"]
+            + 0.5 * features["weak_conjunctions"]
+            + 0.5 * max(features["clauses"] - 1, 0)
+            + (0.5 if features["length"] > 40 else 0.0))
+
+
+def classify_query(query, threshold=COMPLEXITY_THRESHOLD):
+    """
+    判断问题复杂度。
+
+    Returns:
+        dict: {"route": "simple" | "complex", "score": 打分, "features": 特征}
+    """
+    features = query_features(query)
+    score = complexity_score(features)
+    return {
+        "route": "complex" if score >= threshold else "simple",
+        "score": score,
+        "features": features,
+    }
+
+
+def _lexical_similarity(a, b):
+    grams_a, grams_b = char_ngrams(a), char_ngrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def refine_subquestions(subquestions, max_subquestions=MAX_SUBQUESTIONS, embedder=None,
+                        threshold=None):
+    """
+    合并近似重复的子问题（保留先出现的一个），再截断到max_subquestions个。
+
+    Args:
+        subquestions (list): 拆解得到的子问题
+        max_subquestions (int | None): 最多保留的子问题数
+        embedder: 提供encode(texts)方法的向量模型（如semantic_cache.get_embedder()），
+            None时按字符bigram的Jaccard相似度判断
+        threshold (float): 相似度阈值，None时按判断方式使用
+            EMBEDDING_MERGE_THRESHOLD / LEXICAL_MERGE_THRESHOLD
+
+    Returns:
+        tuple: (kept, merged, capped)
+            - kept: 保留的子问题
+            - merged: [(被合并的子问题, 保留的相似子问题, 相似度)]
+            - capped: 因超出数量上限被去掉的子问题
+    """
+    if embedder is not None:
+        import numpy as np
+        threshold = EMBEDDING_MERGE_THRESHOLD if threshold is None else threshold
+        vectors = embedder.encode(list(subquestions)) if subquestions else np.zeros((0, 1))
+        similarity = lambda i, j: float(np.dot(vectors[i], vectors[j]))
+    else:
+        threshold = LEXICAL_MERGE_THRESHOLD if threshold is None else threshold
+        similarity = lambda i, j: _lexical_similarity(subquestions[i], subquestions[j])
+
+    kept, merged = [], []
+    for i, subq in enumerate(subquestions):
+        best = max(((similarity(i, j), j) for j in kept), default=None)
+        if best is not None and best[0] >= threshold:
+            merged.append((subq, subquestions[best[1]], best[0]))
+        else:
+            kept.append(i)
+
+    kept = [subquestions[i] for i in kept]
+    capped = []
+    if max_subquestions is not None and len(kept) > max_subquestions:
+        kept, capped = kept[:max_subquestions], kept[max_subquestions:]
+    return kept, merged, capped
+
+
+def pipeline_calls(subquestions, check_mode="single"):
+    """
+    完整链路的调用次数估算：拆解1次 + 每个子问题回答1次、检查1次（批量检查合计1次）+ 融合1次
+    """
+    checks = subquestions if check_mode != "batch" else min(subquestions, 1)
+    return {"llm_calls": 2 + subquestions + checks, "retrievals": subquestions}
+
+
+def route_breakdown(query, decision, generated=None, kept=None, merged=(), capped=(),
+                    check_mode="single"):
+    """
+    单个问题的路由明细：走的路由、子问题数变化以及相对完整链路节省的调用次数。
+    简单问题没有实际拆解，节省数按ESTIMATED_SUBQUESTIONS个子问题估算（estimated为True）。
+    """
+    if decision["route"] == "simple":
+        actual = {"llm_calls": 1, "retrievals": 1}
+        full = pipeline_calls(ESTIMATED_SUBQUESTIONS, check_mode)
+    else:
+        actual = pipeline_calls(len(kept), check_mode)
+        full = pipeline_calls(len(generated), check_mode)
+    return {
+        "query": query,
+        "route": decision["route"],
+        "score": decision["score"],
+        "features": decision["features"],
+        "subquestions_generated": len(generated) if generated is not None else None,
+        "subquestions_kept": len(kept) if kept is not None else None,
+        "merged": [list(item) for item in merged],
+        "capped": list(capped),
+        "llm_calls": actual["llm_calls"],
+        "retrievals": actual["retrievals"],
+        "llm_calls_saved": full["llm_calls"] - actual["llm_calls"],
+        "retrievals_saved": full["retrievals"] - actual["retrievals"],
+        "estimated": decision["route"] == "simple",
+    }
+
+
+def record_route(breakdown):
+    with _stats_lock:
+        _stats["queries"] += 1
+        _stats[breakdown["route"]] += 1
+        _stats["subquestions_generated"] += breakdown["subquestions_generated"] or 0
+        _stats["subquestions_kept"] += breakdown["subquestions_kept"] or 0
+        _stats["llm_calls_saved"] += breakdown["llm_calls_saved"]
+        _stats["retrievals_saved"] += breakdown["retrievals_saved"]
+        _recent.append(breakdown)
+    return breakdown
+
+
+def routing_stats(recent=False):
+    """
+    路由统计：各路由的问题数、子问题合并/截断数量、节省的LLM调用与检索次数，
+    recent=True时附带最近的逐问题明细
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        if recent:
+            stats["recent"] = list(_recent)
+    stats["simple_rate"] = stats["simple"] / stats["queries"] if stats["queries"] else 0.0
+    return stats
+
+
+def reset_routing_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+        _recent.clear()
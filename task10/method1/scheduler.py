@@ -0,0 +1,340 @@
+# LLM请求调度：进程内共享的令牌桶限流（每分钟请求数RPM、每分钟token数TPM）和按prompt类型的优先级。
+# 并发的问题集中发出请求时，在本地排队而不是触发服务端429限流和重试风暴；
+# 最终答案融合优先于子问题检查，使已经进入最后阶段的问题先完成
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+# 默认配额，None表示不限制
+LLM_RPM = None                    # 每分钟请求数
+LLM_TPM = None                    # 每分钟token数（输入 + 输出）
+BURST_SECONDS = 1.0               # 令牌桶容量为该时长内补充的令牌数（至少1个请求），限制突发
+COMPLETION_TOKENS_ESTIMATE = 512  # 发放时按 prompt估算token数 + 该值 预留TPM，响应返回后按实际用量多退少补
+THROTTLE_SECONDS = 5.0            # 收到429且响应没有Retry-After时暂停发放的时间（秒）
+WAIT_SAMPLES = 4096               # 每种prompt类型保留的最近排队等待时间样本数
+
+# prompt类型 -> 优先级，数值越小越优先，同一优先级先到先得；未列出的类型使用DEFAULT_PRIORITY
+PROMPT_PRIORITIES = {
+    "final": 0,
+    "decompose": 1,
+    "subanswer": 2,
+    "check": 3,
+    "batch_check": 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+class TokenBucket:
+    """
+    每分钟补充per_minute个令牌的令牌桶，容量为burst_seconds秒补充的令牌数。
+    服务端通常按更短的时间窗口执行每分钟限额，一次性用掉整分钟的额度同样会被429，
+    因此只允许很小的突发，请求按速率均匀发放。
+
+    单个请求需要的令牌可以超过容量（如长prompt的TPM）：令牌数达到容量即可发放，
+    扣除后余额为负，之后的请求相应等待
+    """
+
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount):
+        # 可以扣除amount还需等待的时间（秒）
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Ticket:
+    """
+    一次发放的配额：请求结束后调用settle按实际token数修正TPM预留
+    """
+    __slots__ = ("scheduler", "prompt_type", "priority", "tokens", "prompt_tokens", "wait",
+                 "_settled")
+
+    def __init__(self, scheduler, prompt_type, priority, tokens, prompt_tokens):
+        self.scheduler = scheduler
+        self.prompt_type = prompt_type
+        self.priority = priority
+        self.tokens = tokens
+        self.prompt_tokens = prompt_tokens
+        self.wait = 0.0
+        self._settled = False
+
+    def settle(self, total_tokens=None):
+        """
+        total_tokens为实际消耗的token数（usage.total_tokens），None表示未知，保留预留值
+        """
+        if self._settled:
+            return
+        self._settled = True
+        self.scheduler._settle(self, total_tokens)
+
+
+class _Waiter:
+    __slots__ = ("ticket", "admitted", "wake")
+
+    def __init__(self, ticket):
+        self.ticket = ticket
+        self.admitted = False
+        self.wake = None
+
+
+class LLMScheduler:
+    """
+    LLM请求调度器，同步（线程）和异步调用方共用同一个队列和令牌桶。
+
+    请求按(优先级, 到达顺序)排队，只有队首在RPM和TPM令牌都足够时才被发放，
+    低优先级的请求不会越过等待中的高优先级请求；收到429时暂停发放（见throttle）。
+
+    参数:
+    - rpm / tpm: 每分钟请求数 / token数上限，None表示不限制该项
+    - priorities: prompt类型 -> 优先级，默认PROMPT_PRIORITIES
+    - burst_seconds: 允许的突发量（秒），见TokenBucket
+    - completion_tokens: 发放时为输出预留的token数
+    - throttle_seconds: 429响应没有Retry-After时暂停发放的时间（秒）
+    """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, priorities=None, burst_seconds=BURST_SECONDS,
+                 completion_tokens=COMPLETION_TOKENS_ESTIMATE, throttle_seconds=THROTTLE_SECONDS):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.priorities = dict(PROMPT_PRIORITIES if priorities is None else priorities)
+        self.completion_tokens = completion_tokens
+        self.throttle_seconds = throttle_seconds
+
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self._tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self._queue = []
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"admitted": 0, "throttled": 0, "max_queue_depth": len(self._queue),
+                           "tokens_reserved": 0, "tokens_settled": 0}
+            self._waits = {}
+            self._admitted = {}
+
+    def priority_of(self, prompt_type):
+        return self.priorities.get(prompt_type, DEFAULT_PRIORITY)
+
+    def _ticket(self, prompt_type, prompt_tokens):
+        return Ticket(self, prompt_type, self.priority_of(prompt_type),
+                      prompt_tokens + self.completion_tokens, prompt_tokens)
+
+    def _enqueue_locked(self, waiter):
+        heapq.heappush(self._queue, (waiter.ticket.priority, next(self._seq), waiter))
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._queue))
+
+    def _remove_locked(self, waiter):
+        self._queue = [item for item in self._queue if item[2] is not waiter]
+        heapq.heapify(self._queue)
+
+    def _admit_locked(self, caller):
+        """
+        按顺序发放队首能够发放的请求，返回队首还需等待的时间（秒），队列为空时返回None。
+        被发放的请求和新的队首会被唤醒（caller自己除外），队首按返回的时间定时重试
+        """
+        now = time.monotonic()
+        for bucket in (self._requests, self._tokens):
+            if bucket is not None:
+                bucket.refill(now)
+        while self._queue:
+            waiter = self._queue[0][2]
+            delay = max(self._blocked_until - now,
+                        self._requests.delay(1) if self._requests is not None else 0.0,
+                        self._tokens.delay(waiter.ticket.tokens) if self._tokens is not None else 0.0)
+            if delay > 0:
+                if waiter is not caller:
+                    waiter.wake()
+                return delay
+            heapq.heappop(self._queue)
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(waiter.ticket.tokens)
+            waiter.admitted = True
+            self._stats["admitted"] += 1
+            self._stats["tokens_reserved"] += waiter.ticket.tokens
+            if waiter is not caller:
+                waiter.wake()
+        return None
+
+    def _timeout_locked(self, waiter, delay):
+        # 只有队首需要定时重试，其余请求等待被唤醒
+        return delay if self._queue and self._queue[0][2] is waiter else None
+
+    def _record_wait(self, ticket, started):
+        ticket.wait = time.monotonic() - started
+        with self._lock:
+            samples = self._waits.get(ticket.prompt_type)
+            if samples is None:
+                samples = self._waits[ticket.prompt_type] = deque(maxlen=WAIT_SAMPLES)
+            samples.append(ticket.wait)
+            self._admitted[ticket.prompt_type] = self._admitted.get(ticket.prompt_type, 0) + 1
+
+    def acquire(self, prompt_type=None, prompt_tokens=0):
+        """
+        阻塞直到获得配额，返回Ticket，请求结束后需调用ticket.settle()
+        """
+        waiter = _Waiter(self._ticket(prompt_type, prompt_tokens))
+        event = threading.Event()
+        waiter.wake = event.set
+        started = time.monotonic()
+        with self._lock:
+            self._enqueue_locked(waiter)
+        try:
+            while True:
+                with self._lock:
+                    event.clear()
+                    delay = self._admit_locked(waiter)
+                    if waiter.admitted:
+                        break
+                    timeout = self._timeout_locked(waiter, delay)
+                event.wait(timeout)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        self._record_wait(waiter.ticket, started)
+        return waiter.ticket
+
+    async def aacquire(self, prompt_type=None, prompt_tokens=0):
+        """
+        acquire的异步版本，等待时不阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(self._ticket(prompt_type, prompt_tokens))
+        event = asyncio.Event()
+        waiter.wake = lambda: loop.call_soon_threadsafe(event.set)
+        started = time.monotonic()
+        with self._lock:
+            self._enqueue_locked(waiter)
+        try:
+            while True:
+                with self._lock:
+                    event.clear()
+                    delay = self._admit_locked(waiter)
+                    if waiter.admitted:
+                        break
+                    timeout = self._timeout_locked(waiter, delay)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        self._record_wait(waiter.ticket, started)
+        return waiter.ticket
+
+    def _abandon(self, waiter):
+        # 等待中被取消（如异步任务被cancel）：已发放的配额退回，未发放的移出队列
+        with self._lock:
+            if waiter.admitted:
+                if self._requests is not None:
+                    self._requests.give(1)
+                if self._tokens is not None:
+                    self._tokens.give(waiter.ticket.tokens)
+            else:
+                self._remove_locked(waiter)
+            self._admit_locked(None)
+
+    def _settle(self, ticket, total_tokens):
+        with self._lock:
+            if total_tokens is None:
+                total_tokens = ticket.tokens
+            self._stats["tokens_settled"] += total_tokens
+            if self._tokens is not None and total_tokens != ticket.tokens:
+                # 少用的退回，多用的从桶中扣除
+                self._tokens.refill(time.monotonic())
+                self._tokens.give(ticket.tokens - total_tokens)
+            self._admit_locked(None)
+
+    def throttle(self, seconds=None):
+        """
+        服务端返回429时调用，seconds秒内（默认throttle_seconds）暂停发放新的请求
+        """
+        seconds = self.throttle_seconds if seconds is None else seconds
+        with self._lock:
+            self._stats["throttled"] += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """
+        调度统计：当前/最大排队数、已发放请求数、429次数、预留与实际token数，
+        以及按prompt类型的排队数和排队等待时间分位数（秒）
+        """
+        import numpy as np
+        with self._lock:
+            depth = {}
+            for _, _, waiter in self._queue:
+                depth[waiter.ticket.prompt_type] = depth.get(waiter.ticket.prompt_type, 0) + 1
+            by_type = {}
+            for prompt_type in set(depth) | set(self._waits):
+                waits = list(self._waits.get(prompt_type, ()))
+                entry = {"priority": self.priority_of(prompt_type),
+                         "queue_depth": depth.get(prompt_type, 0),
+                         "admitted": self._admitted.get(prompt_type, 0)}
+                if waits:
+                    entry.update(wait_mean=float(np.mean(waits)),
+                                 wait_p50=float(np.percentile(waits, 50)),
+                                 wait_p95=float(np.percentile(waits, 95)),
+                                 wait_max=float(np.max(waits)))
+                by_type[prompt_type or "other"] = entry
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "queue_depth": len(self._queue),
+                **self._stats,
+                "throttled_for": max(self._blocked_until - time.monotonic(), 0.0),
+                "by_prompt_type": by_type,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def configure_scheduler(enabled=True, **kwargs):
+    """
+    启用/关闭进程内共享的LLM调度器，默认不启用。参数同LLMScheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = LLMScheduler(**kwargs) if enabled else None
+    return _scheduler
+
+
+def get_scheduler():
+    """
+    获取共享的LLM调度器，未启用时返回None
+    """
+    return _scheduler
+
+
+def scheduler_stats():
+    scheduler = _scheduler
+    return scheduler.stats() if scheduler is not None else None
+
+
+def reset_scheduler_stats():
+    scheduler = _scheduler
+    if scheduler is not None:
+        scheduler.reset_stats()
@@ -0,0 +1,287 @@
+# 语义缓存：复杂问题与已缓存问题的向量相似度超过阈值时，直接复用已有的子问题拆解或最终答案
+import difflib
+import re
+import threading
+import zlib
+from collections import deque
+
+from .cache import normalize_query
+
+# 语义缓存默认配置
+SEMANTIC_CACHE_THRESHOLD = 0.92  # 余弦相似度阈值，达到阈值才视为命中
+HASHING_DIM = 1024               # 哈希向量维度
+HASHING_NGRAMS = (1, 2, 3)       # 字符n-gram长度
+SEARCH_CANDIDATES = 5            # 命中前逐个校验的候选数
+
+# 数字和拉丁字母词（5G、4G、MOS、PDCP、2024……），两问题的集合不同则不命中
+_KEY_TERM_RE = re.compile(r"[0-9a-z]+(?:[._-][0-9a-z]+)*")
+
+
+class HashingEmbedder:
+    """
+    离线哈希向量：对归一化后的字符n-gram做特征哈希，不依赖任何模型文件，
+    结果跨进程稳定（使用crc32而不是Python内置hash）。
+
+    只反映字面重叠：长问题中替换一个地名或反义词（武汉→襄阳、下降→上升）后相似度仍有0.95-0.97，
+    高于同义改写，因此语义缓存对它只允许增删字符（见SemanticCache的insert_only）。
+    """
+
+    lexical = True
+
+    def __init__(self, dim=HASHING_DIM, ngrams=HASHING_NGRAMS):
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def encode(self, texts):
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = normalize_query(text)
+            for n in self.ngrams:
+                for i in range(len(text) - n + 1):
+                    h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                    # 用hash的最高位决定符号，减少哈希冲突带来的偏差
+                    vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _l2_normalize(vectors)
+
+
+class LocalModelEmbedder:
+    """
+    本地向量模型（sentence-transformers），model_path指向本地模型目录，不访问网络
+    """
+
+    def __init__(self, model_path, device=None):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_path, device=device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        import numpy as np
+        vectors = self.model.encode(list(texts), convert_to_numpy=True)
+        return _l2_normalize(vectors.astype(np.float32))
+
+
+def get_embedder(model_path=None):
+    """
+    有本地模型且安装了sentence-transformers时使用本地模型，否则退回到哈希向量
+    """
+    if model_path:
+        try:
+            return LocalModelEmbedder(model_path)
+        except ImportError:
+            pass
+    return HashingEmbedder()
+
+
+def key_terms(query):
+    """
+    问题中的数字和拉丁字母词集合（归一化后小写）
+    """
+    return set(_KEY_TERM_RE.findall(normalize_query(query)))
+
+
+def only_insertions(query, cached_query):
+    """
+    两问题归一化后是否只相差若干插入/删除的字符（如“请问”、标点），没有替换
+    """
+    matcher = difflib.SequenceMatcher(None, normalize_query(cached_query), normalize_query(query),
+                                      autojunk=False)
+    return all(tag != "replace" for tag, _, _, _, _ in matcher.get_opcodes())
+
+
+def _l2_normalize(vectors):
+    import numpy as np
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class BruteForceIndex:
+    """
+    NumPy暴力检索的内积索引，适合几万条以内的规模，向量需预先归一化
+    """
+
+    def __init__(self, dim):
+        import numpy as np
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, vectors):
+        import numpy as np
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        # 容量按倍数扩展，避免每次add都复制整个矩阵
+        if self._size + len(vectors) > len(self._vectors):
+            capacity = max(2 * len(self._vectors), self._size + len(vectors), 64)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size:self._size + len(vectors)] = vectors
+        self._size += len(vectors)
+
+    def search(self, vector, k=1):
+        """
+        返回[(行号, 相似度)]，按相似度降序
+        """
+        import numpy as np
+        if self._size == 0:
+            return []
+        scores = self._vectors[:self._size] @ np.asarray(vector, dtype=np.float32)
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+class FaissIndex:
+    """
+    基于faiss的HNSW近似检索索引，规模较大时使用，接口与BruteForceIndex一致
+    """
+
+    def __init__(self, dim, m=32):
+        import faiss
+        self.dim = dim
+        self._index = faiss.IndexHNSWFlat(dim, m, faiss.METRIC_INNER_PRODUCT)
+
+    def __len__(self):
+        return self._index.ntotal
+
+    def add(self, vectors):
+        import numpy as np
+        self._index.add(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+
+    def search(self, vector, k=1):
+        import numpy as np
+        if self._index.ntotal == 0:
+            return []
+        scores, ids = self._index.search(
+            np.asarray(vector, dtype=np.float32).reshape(1, self.dim), k)
+        return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+
+
+class SemanticCache:
+    """
+    基于向量相似度的缓存。namespace用于隔离不同检索范围（如不同scene_tag）下的结果。
+
+    命中除了相似度达到阈值，还要求两问题的数字和拉丁字母词（key_terms）完全相同，
+    避免5G/4G、不同年份等只差一个关键词的问题互相命中。
+
+    参数:
+    - embedder: 提供encode(texts)方法的向量模型
+    - threshold: 余弦相似度阈值
+    - index_factory: 以向量维度为参数创建索引的函数，默认BruteForceIndex
+    - max_recent_similarities: stats中保留的最近命中相似度条数
+    - insert_only: 只有与已缓存问题相比仅增删字符时才命中（only_insertions）；
+      None表示embedder只反映字面重叠（HashingEmbedder）时开启
+    """
+
+    def __init__(self, embedder=None, threshold=SEMANTIC_CACHE_THRESHOLD, index_factory=None,
+                 max_recent_similarities=1000, insert_only=None):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        if insert_only is None:
+            insert_only = getattr(self.embedder, "lexical", False)
+        self.insert_only = insert_only
+        self.index_factory = index_factory or BruteForceIndex
+        self._indexes = {}  # namespace -> 索引
+        self._entries = {}  # namespace -> [(query, value)]，下标与索引行号一致
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0   # 相似度达到阈值但关键词不一致而未命中的次数
+        self._hit_similarities = deque(maxlen=max_recent_similarities)
+
+    def lookup(self, query, namespace=""):
+        """
+        命中返回(value, 命中的原始问题, 相似度)，未命中返回None
+        """
+        vector = self.embedder.encode([query])[0]
+        terms = key_terms(query)
+        with self._lock:
+            self.lookups += 1
+            index = self._indexes.get(namespace)
+            matches = index.search(vector, SEARCH_CANDIDATES) if index is not None else []
+            for row, similarity in matches:
+                if similarity < self.threshold:
+                    break
+                cached_query, value = self._entries[namespace][row]
+                if key_terms(cached_query) != terms or \
+                        (self.insert_only and not only_insertions(query, cached_query)):
+                    self.rejected += 1
+                    continue
+                self.hits += 1
+                self._hit_similarities.append(similarity)
+                return value, cached_query, similarity
+            return None
+
+    def add(self, query, value, namespace=""):
+        vector = self.embedder.encode([query])[0]
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = self.index_factory(len(vector))
+                self._entries[namespace] = []
+            index.add(vector)
+            self._entries[namespace].append((query, value))
+
+    def stats(self):
+        with self._lock:
+            similarities = list(self._hit_similarities)
+            return {
+                "size": sum(len(entries) for entries in self._entries.values()),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "rejected": self.rejected,
+                "threshold": self.threshold,
+                "insert_only": self.insert_only,
+                "hit_similarities": similarities,
+                "mean_hit_similarity": (sum(similarities) / len(similarities)
+                                        if similarities else None),
+            }
+
+
+# 共享的语义缓存，默认不启用
+_decomposition_cache = None  # 复杂问题 -> 子问题列表
+_answer_cache = None         # 复杂问题（按scene_tag隔离）-> 完整链路结果
+
+
+def configure_semantic_cache(enabled=True, threshold=SEMANTIC_CACHE_THRESHOLD, model_path=None,
+                             index_factory=None, cache_answers=None):
+    """
+    启用/关闭共享的语义缓存
+
+    参数:
+    - threshold: 余弦相似度阈值
+    - model_path: 本地向量模型目录，None或无法加载时使用哈希向量
+    - index_factory: 向量索引工厂，默认BruteForceIndex，规模大时可传入FaissIndex
+    - cache_answers: 是否同时缓存完整链路的最终答案（否则只缓存子问题拆解）；
+      None表示只在使用本地向量模型时缓存，哈希向量分不清只差一个关键词的问题，默认不用它复用答案
+    """
+    global _decomposition_cache, _answer_cache
+    if not enabled:
+        _decomposition_cache = _answer_cache = None
+        return
+    embedder = get_embedder(model_path)
+    _decomposition_cache = SemanticCache(embedder, threshold, index_factory)
+    if cache_answers is None:
+        cache_answers = not getattr(embedder, "lexical", False)
+    _answer_cache = SemanticCache(embedder, threshold, index_factory) if cache_answers else None
+
+
+def get_decomposition_cache():
+    return _decomposition_cache
+
+
+def get_answer_cache():
+    return _answer_cache
+
+
+def semantic_cache_stats():
+    return {
+        "decomposition": _decomposition_cache.stats() if _decomposition_cache else None,
+        "answer": _answer_cache.stats() if _answer_cache else None,
+    }
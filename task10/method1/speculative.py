@@ -0,0 +1,213 @@
+# 推测检索：子问题拆解的LLM请求进行期间，先用原问题（及本地提取的关键词）检索，
+# 拆解完成后复用给相近的子问题，或把相关的文档补充进子问题的证据
+import asyncio
+import hashlib
+import re
+import threading
+import time
+
+from .precheck import char_ngrams
+from .routing import CLAUSE_SEPARATORS, STRONG_CONJUNCTIONS, WEAK_CONJUNCTIONS, INTERROGATIVES
+
+# 本地关键词提取最多得到的检索词数
+MAX_KEYWORDS = 3
+# 关键词片段的最短长度（字符）
+MIN_KEYWORD_LENGTH = 4
+# 子问题与推测检索词的字符bigram Jaccard相似度达到该值时，直接复用推测检索结果
+REUSE_THRESHOLD = 0.8
+# 子问题的字符bigram有至少这么多出现在推测检索到的文档中时，把该文档补充进子问题的证据
+MERGE_MIN_COVERAGE = 0.5
+# 每个子问题最多补充的推测检索文档数
+MAX_MERGED_DOCS = 2
+
+_SPLIT_PATTERN = re.compile("|".join(
+    re.escape(word) for word in sorted(
+        STRONG_CONJUNCTIONS + WEAK_CONJUNCTIONS + INTERROGATIVES + tuple(CLAUSE_SEPARATORS),
+        key=len, reverse=True)))
+_EDGE_STOPWORDS = "的了吗呢吧是在对从而来去"
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "speculative_queries": 0, "reused_subquestions": 0, "merged_docs": 0,
+          "overlap_samples": 0, "overlap_sum": 0.0, "overlapped_seconds": 0.0, "wait_seconds": 0.0}
+
+
+def extract_keywords(query, max_keywords=MAX_KEYWORDS):
+    """
+    按标点、连接词和疑问词切分问题，取最长的几个片段作为检索词，保持在原问题中的顺序
+    """
+    fragments = []
+    for fragment in _SPLIT_PATTERN.split(query or ""):
+        fragment = fragment.strip().strip(_EDGE_STOPWORDS).strip()
+        if len(fragment) >= MIN_KEYWORD_LENGTH and fragment not in fragments:
+            fragments.append(fragment)
+    longest = set(sorted(fragments, key=len, reverse=True)[:max_keywords])
+    return [fragment for fragment in fragments if fragment in longest]
+
+
+def _similarity(a, b):
+    grams_a, grams_b = char_ngrams(a), char_ngrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def _doc_key(doc):
+    return hashlib.sha1("".join((doc.get("text") or "").split()).encode("utf-8")).hexdigest()
+
+
+class SpeculativeRetrieval:
+    """
+    单次请求的推测检索。
+
+    start()在拆解请求发出的同时启动检索；拆解完成后，aretrieve_docs_for_subquestion
+    通过lookup()复用相近检索词的结果，通过merge()补充相关文档。
+
+    参数:
+    - complex_query: 复杂问题
+    - keywords: 是否同时用本地提取的关键词检索
+    - max_keywords: 关键词检索的数量上限
+    """
+
+    def __init__(self, complex_query, keywords=False, max_keywords=MAX_KEYWORDS):
+        self.queries = [complex_query]
+        if keywords:
+            self.queries += [word for word in extract_keywords(complex_query, max_keywords)
+                             if word != complex_query]
+        self.results = {}      # 检索词 -> 文档列表
+        self.latencies = {}    # 检索词 -> 检索耗时
+        self._task = None
+        self._started_at = None
+        self.seconds = None    # 推测检索整体耗时
+        self.wait_seconds = 0.0
+        self.reused = []       # [(子问题, 复用的检索词)]
+        self.merged_docs = 0
+        self._overlaps = []    # 每个子问题自己检索到的文档中，推测检索也检索到的比例
+        self._pool = None      # 文档key -> (文档, 字符bigram)，推测检索完成后首次merge时建立
+
+    def start(self, retrieve):
+        """
+        retrieve: 以检索词为参数、返回文档列表的协程函数
+        """
+        self._started_at = time.time()
+        self._task = asyncio.ensure_future(self._run(retrieve))
+        return self
+
+    async def _run(self, retrieve):
+        async def _one(query):
+            start_time = time.time()
+            docs = await retrieve(query)
+            self.latencies[query] = time.time() - start_time
+            return query, docs
+        results = await asyncio.gather(*[_one(query) for query in self.queries],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                continue
+            query, docs = result
+            self.results[query] = docs
+        self.seconds = time.time() - self._started_at
+
+    async def wait(self):
+        if self._task is None:
+            return
+        if not self._task.done():
+            start_time = time.time()
+            await asyncio.shield(self._task)
+            self.wait_seconds += time.time() - start_time
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def lookup(self, subq):
+        """
+        子问题与某个推测检索词足够相近时返回该检索词的文档，否则返回None
+        """
+        best, best_query = 0.0, None
+        for query in self.results:
+            similarity = _similarity(subq, query)
+            if similarity > best:
+                best, best_query = similarity, query
+        if best_query is None or best < REUSE_THRESHOLD:
+            return None
+        self.reused.append((subq, best_query))
+        return list(self.results[best_query])
+
+    def merge(self, subq, docs):
+        """
+        记录子问题文档与推测检索结果的重合度，并补充与子问题相关、尚未包含的推测检索文档
+        """
+        pool = self._doc_pool()
+        keys = [_doc_key(doc) for doc in docs]
+        if docs:
+            self._overlaps.append(sum(1 for key in keys if key in pool) / len(docs))
+
+        subq_grams = char_ngrams(subq)
+        candidates = []
+        for key, (doc, grams) in pool.items():
+            if key in keys or not subq_grams:
+                continue
+            coverage = len(subq_grams & grams) / len(subq_grams)
+            if coverage >= MERGE_MIN_COVERAGE:
+                candidates.append((coverage, doc))
+        candidates.sort(key=lambda item: -item[0])
+        extra = [doc for _, doc in candidates[:MAX_MERGED_DOCS]]
+        self.merged_docs += len(extra)
+        return list(docs) + extra
+
+    def _doc_pool(self):
+        if self._pool is None:
+            pool = {}
+            for query_docs in self.results.values():
+                for doc in query_docs:
+                    key = _doc_key(doc)
+                    if key not in pool:
+                        pool[key] = (doc, char_ngrams(doc.get("text") or ""))
+            self._pool = pool
+        return self._pool
+
+    def report(self, decomposition_seconds):
+        """
+        推测检索报告：overlapped_seconds为与拆解请求重叠（不在关键路径上）的检索耗时，
+        wait_seconds为拆解完成后仍需等待推测检索的时间，retrievals_saved为直接复用省下的检索次数，
+        overlap为子问题检索结果中推测检索也命中的文档比例的平均值
+        """
+        seconds = self.seconds or 0.0
+        return {
+            "queries": list(self.queries),
+            "speculative_seconds": seconds,
+            "query_seconds": dict(self.latencies),
+            "decomposition_seconds": decomposition_seconds,
+            "overlapped_seconds": min(seconds, decomposition_seconds),
+            "wait_seconds": self.wait_seconds,
+            "reused": [list(item) for item in self.reused],
+            "retrievals_saved": len(self.reused),
+            "merged_docs": self.merged_docs,
+            "overlap": sum(self._overlaps) / len(self._overlaps) if self._overlaps else None,
+        }
+
+
+def record_speculative(report):
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["speculative_queries"] += len(report["queries"])
+        _stats["reused_subquestions"] += report["retrievals_saved"]
+        _stats["merged_docs"] += report["merged_docs"]
+        if report["overlap"] is not None:
+            _stats["overlap_samples"] += 1
+            _stats["overlap_sum"] += report["overlap"]
+        _stats["overlapped_seconds"] += report["overlapped_seconds"]
+        _stats["wait_seconds"] += report["wait_seconds"]
+    return report
+
+
+def speculative_stats():
+    """
+    累计的推测检索统计
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    overlap_sum = stats.pop("overlap_sum")
+    samples = stats.pop("overlap_samples")
+    stats["mean_overlap"] = overlap_sum / samples if samples else None
+    return stats
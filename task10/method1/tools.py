@@ -1,23 +1,61 @@
+import asyncio
+import contextvars
+import functools
 import logging
-import requests
+import threading
+import time
+import weakref
 import json
-from openai import OpenAI
-from .config import API_SECRET_KEY, BASE_URL, MODEL_NAME
+from . import tracing
+from .retriever import Retriever
+from .scheduler import get_scheduler
+from .cache import (
+    LRUCache, SQLiteCache, SingleFlight, TieredCache, retrieval_cache_key, llm_cache_key
+)
 
+# LLM连接池默认配置
+LLM_POOL_SIZE = 16           # 最大连接数（同时也是最大保活连接数）
+LLM_KEEPALIVE_EXPIRY = 60.0  # 空闲连接保活时间（秒）
+LLM_TIMEOUT = 120.0          # 单次请求超时时间（秒）
+LLM_CONNECT_TIMEOUT = 10.0   # 建立连接超时时间（秒）
+LLM_MAX_RETRIES = 3          # 失败重试次数，由openai客户端按指数退避执行
 
-def query_faults(query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+# LLM响应缓存默认配置
+LLM_CACHE_SIZE = 4096                   # 内存层最多缓存的响应数
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 内存层容量上限（字节），超出时按LRU淘汰
+
+
+# 检索服务配置
+# RAG_URL = "http://10.141.179.170:20028/bm/query/kg/trace"
+# RAG_URL = "http://10.128.86.64:8000/serviceAgent/rest/bm/query/kg/new/trag"
+RAG_URL = "http://10.141.179.170:20028/bm/query/kg/trag"
+RAG_HEADERS = {
+    "Content-Type": "application/json",
+    "X-APP-ID": "91d71bebe01b563ff5a5add03c27ca54",
+    "X-APP-KEY": "ea15864c66c22c4f0f88e47a8d1cf0d5"
+}
+# 添加代理配置，具体代理网址需要查看http://127.0.0.1:18033/proxy.pac里的匹配内容
+RAG_PROXIES = {
+    'http': 'http://10.141.248.54:8443',
+    'https': 'http://10.141.248.54:8443'
+}
+
+# 检索连接池默认配置
+RAG_POOL_SIZE = 16           # 连接池最大连接数，同时也是query_faults_many的默认并发数
+RAG_CONNECT_TIMEOUT = 5.0    # 建立连接超时时间（秒）
+RAG_READ_TIMEOUT = 30.0      # 读取响应超时时间（秒）
+RAG_MAX_RETRIES = 2          # 连接失败或5xx时的重试次数
+RAG_BACKOFF_FACTOR = 0.5     # 重试退避系数，第n次重试前等待 backoff_factor * 2^(n-1) 秒
+
+# 检索缓存默认配置
+RAG_CACHE_SIZE = 2048        # 内存层最多缓存的检索结果数
+RAG_CACHE_TTL = 3600.0       # 缓存过期时间（秒），None表示不过期
+
+
+def build_rag_body(query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
     """
-    调用RAG
+    构造检索服务的请求体
     """
-    # url = "http://10.141.179.170:20028/bm/query/kg/trace"
-    # url = "http://10.128.86.64:8000/serviceAgent/rest/bm/query/kg/new/trag"
-    url = "http://10.141.179.170:20028/bm/query/kg/trag"
-    headers = {
-        "Content-Type": "application/json",
-        "X-APP-ID": "91d71bebe01b563ff5a5add03c27ca54",
-        "X-APP-KEY": "ea15864c66c22c4f0f88e47a8d1cf0d5"
-    }
-
     # 处理scene_tag为列表的情况
     if isinstance(scene_tag, list):
         # 为每个scene_tag创建一个字典
@@ -39,7 +77,7 @@ def query_faults(query_text, scene_tag, province_tag="hq", top_k=5, score_thresh
             }
         ]
 
-    body = {
+    return {
         "query": query_text,
         "tag": tag_list,
         "top_k": top_k,
@@ -47,33 +85,814 @@ def query_faults(query_text, scene_tag, province_tag="hq", top_k=5, score_thresh
         "score_threshold": score_threshold
     }
 
-    # 添加代理配置，具体代理网址需要查看http://127.0.0.1:18033/proxy.pac里的匹配内容
-    proxies = {
-        'http': 'http://10.141.248.54:8443',
-        'https': 'http://10.141.248.54:8443'
-    }
 
+class RetrievalClient(Retriever):
+    """
+    检索服务客户端，Retriever接口基于HTTP检索服务的实现。
+
+    持有一个requests.Session复用连接（含代理连接），线程安全地供多个线程共用；
+    所有请求都带超时，连接失败和5xx响应按指数退避重试。
+
+    参数:
+    - url: 检索服务地址
+    - pool_size: 连接池最大连接数，同时也是query_faults_many的默认并发数
+    - connect_timeout / read_timeout: 连接与读取超时时间（秒）
+    - max_retries: 重试次数
+    - backoff_factor: 重试退避系数
+    - proxies: 代理配置，None表示不使用代理
+    - cache: 检索结果缓存（TieredCache），None表示不缓存
+    """
+
+    def __init__(self, url=RAG_URL, headers=None, proxies=RAG_PROXIES, pool_size=RAG_POOL_SIZE,
+                 connect_timeout=RAG_CONNECT_TIMEOUT, read_timeout=RAG_READ_TIMEOUT,
+                 max_retries=RAG_MAX_RETRIES, backoff_factor=RAG_BACKOFF_FACTOR, cache=None):
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = cache
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries,
+                      status=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers or RAG_HEADERS)
+        if proxies:
+            self.session.proxies.update(proxies)
+
+    def query_faults(self, query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+        """
+        调用RAG，失败时返回包含error字段的字典，失败结果不写入缓存
+        """
+        with tracing.span("retrieval.query_faults", kind="retrieval", top_k=top_k,
+                          query_bytes=len(query_text.encode("utf-8"))) as span:
+            span.set(queue_wait=tracing.consume_queue_wait())
+            result = self._query_faults(span, query_text, scene_tag, province_tag, top_k,
+                                        score_threshold)
+            if "error" in result:
+                span.set(error=result["error"], status_code=result["status_code"])
+            else:
+                span.set(docs=len(rag_context(result)))
+            return result
+
+    def _query_faults(self, span, query_text, scene_tag, province_tag, top_k, score_threshold):
+        import requests
+        cache = self.cache
+        if cache is not None:
+            key = retrieval_cache_key(query_text, scene_tag, province_tag, top_k, score_threshold)
+            cached = cache.get(key)
+            if cached is not None:
+                span.set(cache_hit=True)
+                return cached
+        span.set(cache_hit=False)
+
+        body = build_rag_body(query_text, scene_tag, province_tag, top_k, score_threshold)
+        try:
+            response = self.session.post(self.url, data=json.dumps(body), timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e), "status_code": None, "text": ""}
+        # urllib3在响应上记录了本次请求经历的重试
+        retries = getattr(response.raw, "retries", None)
+        span.set(status_code=response.status_code, response_bytes=len(response.content),
+                 retries=len(retries.history) if retries is not None else 0)
+        try:
+            response.raise_for_status()
+            result = response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e), "status_code": response.status_code, "text": response.text}
+
+        if cache is not None:
+            cache.set(key, result)
+        return result
+
+    def close(self):
+        self.session.close()
+
+
+_retrieval_client = None
+_retrieval_cache = TieredCache(LRUCache(maxsize=RAG_CACHE_SIZE, ttl=RAG_CACHE_TTL))
+_retrieval_client_lock = threading.Lock()
+
+
+def get_retrieval_client():
+    """
+    获取进程内共享的检索客户端，首次调用时按默认配置创建
+    """
+    global _retrieval_client
+    with _retrieval_client_lock:
+        if _retrieval_client is None:
+            _retrieval_client = RetrievalClient(cache=_retrieval_cache)
+        return _retrieval_client
+
+
+def configure_retrieval_client(**kwargs):
+    """
+    按给定参数重建共享的检索客户端，参数同RetrievalClient，旧客户端会被关闭。
+    未指定cache时沿用当前的共享检索缓存
+    """
+    global _retrieval_client
+    kwargs.setdefault("cache", _retrieval_cache)
+    with _retrieval_client_lock:
+        old_client, _retrieval_client = _retrieval_client, RetrievalClient(**kwargs)
+    if old_client is not None:
+        old_client.close()
+    return _retrieval_client
+
+
+def set_retriever(retriever):
+    """
+    替换共享的检索后端（如retriever.LocalVectorRetriever），之后query_faults等函数都使用它。
+    旧的检索后端会被关闭
+    """
+    global _retrieval_client
+    with _retrieval_client_lock:
+        old_client, _retrieval_client = _retrieval_client, retriever
+    if old_client is not None and old_client is not retriever:
+        old_client.close()
+    return retriever
+
+
+def configure_retrieval_cache(enabled=True, maxsize=RAG_CACHE_SIZE, ttl=RAG_CACHE_TTL,
+                              disk_path=None, disk_max_bytes=None):
+    """
+    重建共享的检索缓存
+
+    参数:
+    - enabled: 是否启用检索缓存
+    - maxsize / ttl: 内存层容量与过期时间（秒）
+    - disk_path: SQLite磁盘层路径，进程重启后仍可命中，None表示只使用内存层
+    - disk_max_bytes: 磁盘层容量上限，超出时按最近访问时间淘汰
+    """
+    global _retrieval_cache
+    cache = None
+    if enabled:
+        disk = SQLiteCache(disk_path, ttl=ttl, max_bytes=disk_max_bytes) if disk_path else None
+        cache = TieredCache(LRUCache(maxsize=maxsize, ttl=ttl), disk)
+    with _retrieval_client_lock:
+        old_cache, _retrieval_cache = _retrieval_cache, cache
+        if _retrieval_client is not None:
+            _retrieval_client.cache = cache
+    if old_cache is not None:
+        old_cache.close()
+    return cache
+
+
+def retrieval_cache_stats():
+    """
+    检索缓存的命中/未命中/淘汰统计，未启用缓存时返回None
+    """
+    return _retrieval_cache.stats() if _retrieval_cache is not None else None
+
+
+def query_faults(query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+    """
+    调用RAG
+    """
+    return get_retrieval_client().query_faults(
+        query_text, scene_tag, province_tag, top_k, score_threshold)
+
+
+def query_faults_many(queries, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5,
+                      max_workers=None):
+    """
+    并发调用RAG，返回结果顺序与queries一致
+    """
+    return get_retrieval_client().query_faults_many(
+        queries, scene_tag, province_tag, top_k, score_threshold, max_workers)
+
+
+def rag_context(rag_result):
+    """
+    取出检索结果中的文档列表，检索失败时记录日志并返回空列表
+    """
+    if "error" in rag_result:
+        logging.getLogger("MyLogger").error(f"query_faults 检索失败: {rag_result['error']}")
+        return []
+    return rag_result["data"]["context"]
+
+
+def _config_value(name):
+    # config.py不随仓库提供（见config_example.py），只在缺少对应参数时读取
+    from . import config
+    return getattr(config, name)
+
+
+class LLMClientPool:
+    """
+    进程内共享的LLM客户端池。
+
+    同步客户端全局共用一个，底层httpx连接池开启keep-alive，线程安全；
+    异步客户端的连接绑定事件循环，因此按事件循环各建一个。
+    openai客户端自带按指数退避的重试，max_retries控制重试次数。
+
+    参数:
+    - pool_size: 最大连接数，同时也是最大保活连接数
+    - timeout: 单次请求超时时间（秒）
+    - connect_timeout: 建立连接超时时间（秒）
+    - max_retries: 失败重试次数
+    - keepalive_expiry: 空闲连接保活时间（秒）
+
+    api_key / base_url / model为None时取config.py中的API_SECRET_KEY / BASE_URL / MODEL_NAME
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=None, pool_size=LLM_POOL_SIZE, timeout=LLM_TIMEOUT,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 keepalive_expiry=LLM_KEEPALIVE_EXPIRY):
+        self.api_key = _config_value("API_SECRET_KEY") if api_key is None else api_key
+        self.base_url = _config_value("BASE_URL") if base_url is None else base_url
+        self.model = _config_value("MODEL_NAME") if model is None else model
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.keepalive_expiry = keepalive_expiry
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._in_flight = 0
+        self._calls = 0
+        self._http_requests = 0
+        self._new_connections = 0
+        self._rate_limited = 0
+
+    def _limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.pool_size,
+                            max_keepalive_connections=self.pool_size,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def _timeout(self):
+        import httpx
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _trace(self, event_name, info):
+        # httpcore的trace回调，只有新建TCP连接时才会出现connect_tcp事件
+        if event_name == "connection.connect_tcp.complete":
+            self._count("_new_connections")
+
+    async def _atrace(self, event_name, info):
+        self._trace(event_name, info)
+
+    def _span_trace(self, span):
+        # 追踪时额外记录在连接池中等待连接的时间：请求钩子之后的第一个httpcore事件
+        # 是新建连接（connect_tcp）或在已有连接上发送请求头，两者之间即为排队等待
+        requested_at = time.perf_counter()
+        waiting = True
+
+        def trace(event_name, info):
+            nonlocal waiting
+            self._trace(event_name, info)
+            if waiting and event_name.endswith((".connect_tcp.started",
+                                                ".send_request_headers.started")):
+                waiting = False
+                span.add("queue_wait", time.perf_counter() - requested_at)
+        return trace
+
+    def _on_request_span(self):
+        # openai的每次重试都会重新经过请求钩子
+        span = tracing.current_span()
+        if not span.recording:
+            return None
+        span.add("retries", 1 if span.get("http_requests") else 0)
+        span.add("http_requests")
+        return span
 
-    response = requests.post(url, headers=headers, data=json.dumps(body), proxies=proxies)
+    def _on_request(self, request):
+        self._count("_http_requests")
+        span = self._on_request_span()
+        request.extensions["trace"] = self._span_trace(span) if span is not None else self._trace
+
+    async def _aon_request(self, request):
+        self._count("_http_requests")
+        span = self._on_request_span()
+        if span is None:
+            request.extensions["trace"] = self._atrace
+            return
+        trace = self._span_trace(span)
+
+        async def atrace(event_name, info):
+            trace(event_name, info)
+        request.extensions["trace"] = atrace
+
+    def _on_response(self, response):
+        # 429限流时通知调度器暂停发放，openai客户端自身仍会按退避重试本次请求
+        if response.status_code == 429:
+            self._count("_rate_limited")
+            scheduler = get_scheduler()
+            if scheduler is not None:
+                scheduler.throttle(_retry_after(response))
+
+    async def _aon_response(self, response):
+        self._on_response(response)
+
+    def client(self):
+        """
+        获取共享的同步客户端
+        """
+        from openai import OpenAI, DefaultHttpxClient
+        with self._lock:
+            if self._client is None:
+                http_client = DefaultHttpxClient(
+                    limits=self._limits(), timeout=self._timeout(),
+                    event_hooks={"request": [self._on_request], "response": [self._on_response]})
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                      max_retries=self.max_retries, timeout=self._timeout(),
+                                      http_client=http_client)
+            return self._client
+
+    def async_client(self):
+        """
+        获取当前事件循环对应的异步客户端，必须在事件循环内调用
+        """
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                http_client = DefaultAsyncHttpxClient(
+                    limits=self._limits(), timeout=self._timeout(),
+                    event_hooks={"request": [self._aon_request],
+                                 "response": [self._aon_response]})
+                client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                     max_retries=self.max_retries, timeout=self._timeout(),
+                                     http_client=http_client)
+                self._async_clients[loop] = client
+            return client
+
+    def begin(self):
+        with self._lock:
+            self._in_flight += 1
+            self._calls += 1
+
+    def end(self):
+        self._count("_in_flight", -1)
+
+    def stats(self):
+        """
+        连接池统计信息，用于按QPS估算连接池大小
+
+        返回:
+        - in_flight: 当前在途的调用数
+        - calls: 累计调用次数
+        - http_requests: 累计HTTP请求数（包含重试）
+        - retries: 累计重试次数
+        - new_connections: 累计新建连接数
+        - reused_connections: 累计复用已有连接的请求数
+        - rate_limited: 累计收到的429响应数
+        """
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "in_flight": self._in_flight,
+                "calls": self._calls,
+                "http_requests": self._http_requests,
+                "retries": max(self._http_requests - self._calls, 0),
+                "new_connections": self._new_connections,
+                "reused_connections": max(self._http_requests - self._new_connections, 0),
+                "rate_limited": self._rate_limited,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+            self._async_clients = weakref.WeakKeyDictionary()
+
+    async def aclose(self):
+        """
+        关闭当前事件循环对应的异步客户端，必须在事件循环内调用
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+
+_llm_pool = None
+_llm_pool_lock = threading.Lock()
+
+
+def get_llm_pool():
+    """
+    获取进程内共享的LLM客户端池，首次调用时按默认配置创建
+    """
+    global _llm_pool
+    with _llm_pool_lock:
+        if _llm_pool is None:
+            _llm_pool = LLMClientPool()
+        return _llm_pool
+
+
+def configure_llm_pool(**kwargs):
+    """
+    按给定参数重建共享的LLM客户端池，参数同LLMClientPool，旧连接池会被关闭
+    """
+    global _llm_pool
+    with _llm_pool_lock:
+        old_pool, _llm_pool = _llm_pool, LLMClientPool(**kwargs)
+    if old_pool is not None:
+        old_pool.close()
+    return _llm_pool
+
+
+def llm_pool_stats():
+    return get_llm_pool().stats()
+
+
+_llm_cache = TieredCache(LRUCache(maxsize=LLM_CACHE_SIZE, max_bytes=LLM_CACHE_MAX_BYTES))
+_llm_cache_lock = threading.Lock()
+
+
+def configure_llm_cache(enabled=True, maxsize=LLM_CACHE_SIZE, max_bytes=LLM_CACHE_MAX_BYTES,
+                        disk_path=None, disk_max_bytes=None):
+    """
+    重建共享的LLM响应缓存，按模型名+完整prompt内容寻址
+
+    参数:
+    - enabled: 是否启用LLM响应缓存
+    - maxsize / max_bytes: 内存层条目数与容量上限（字节）
+    - disk_path: SQLite磁盘层路径，用于评测重跑时跨进程复用，None表示只使用内存层
+    - disk_max_bytes: 磁盘层容量上限，超出时按最近访问时间淘汰
+    """
+    global _llm_cache
+    cache = None
+    if enabled:
+        disk = SQLiteCache(disk_path, max_bytes=disk_max_bytes) if disk_path else None
+        cache = TieredCache(LRUCache(maxsize=maxsize, max_bytes=max_bytes), disk)
+    with _llm_cache_lock:
+        old_cache, _llm_cache = _llm_cache, cache
+    if old_cache is not None:
+        old_cache.close()
+    return cache
+
+
+def llm_cache_stats():
+    """
+    LLM响应缓存的命中/未命中/淘汰统计，未启用缓存时返回None
+    """
+    return _llm_cache.stats() if _llm_cache is not None else None
+
+
+# 合并并发的相同异步请求：多个问题共享子问题时，相同的检索和LLM调用只发出一次
+_llm_single_flight = SingleFlight()
+_retrieval_single_flight = SingleFlight()
+
+
+def configure_single_flight(enabled=True):
+    """
+    启用/关闭achat_completions4和aquery_faults的并发请求合并（默认启用）。
+    LLM调用只在use_cache=True时合并，与响应缓存的语义一致
+    """
+    global _llm_single_flight, _retrieval_single_flight
+    _llm_single_flight = SingleFlight() if enabled else None
+    _retrieval_single_flight = SingleFlight() if enabled else None
+
+
+def single_flight_stats():
+    """
+    请求合并统计：leaders为实际发出的调用数，coalesced为合并到在途调用上的次数，未启用时返回None
+    """
+    llm, retrieval = _llm_single_flight, _retrieval_single_flight
+    if llm is None or retrieval is None:
+        return None
+    return {"llm": llm.stats(), "retrieval": retrieval.stats()}
+
+
+def _llm_cache_get(model, query, use_cache):
+    cache = _llm_cache
+    if not use_cache or cache is None:
+        return None, None
+    key = llm_cache_key(model, query)
+    cached = cache.get(key)
+    if cached is None:
+        return key, None
+    from openai.types.chat import ChatCompletion
+    return key, ChatCompletion.model_validate(cached)
+
+
+def _llm_cache_set(key, resp, validate=None):
+    # validate(输出文本)返回False的响应（如无法解析的JSON）不写入缓存，重跑时重新请求
+    cache = _llm_cache
+    if key is None or cache is None:
+        return
+    if validate is not None and not validate(resp.choices[0].message.content or ""):
+        return
+    cache.set(key, resp.model_dump(mode="json"))
+
+
+def _stream_completion(model, content, chunk, finish_reason):
+    # 把流式输出拼接成与非流式一致的ChatCompletion，用于写入响应缓存
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate({
+        "id": getattr(chunk, "id", None) or "stream",
+        "object": "chat.completion",
+        "created": getattr(chunk, "created", None) or 0,
+        "model": getattr(chunk, "model", None) or model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason,
+        }],
+    })
+
+
+def _chunk_delta(chunk):
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def _chunk_finish_reason(chunk, finish_reason):
+    # 结束原因在最后一个带choices的chunk上，之后可能还有只带usage的chunk
+    if chunk.choices and chunk.choices[0].finish_reason:
+        return chunk.choices[0].finish_reason
+    return finish_reason
+
+
+def _retry_after(response):
+    # OpenAI兼容服务的429响应可能带retry-after-ms或retry-after（秒）
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def _trace_quota(span, ticket):
+    span.set(priority=ticket.priority, scheduler_wait=ticket.wait)
+    span.add("queue_wait", ticket.wait)
+
+
+def _acquire_llm_quota(query, prompt_type, span):
+    """
+    调度器启用时按prompt类型的优先级排队等待RPM/TPM配额，未启用时返回None
+    """
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return None
+    ticket = scheduler.acquire(prompt_type, estimate_tokens(query))
+    _trace_quota(span, ticket)
+    return ticket
+
+
+async def _aacquire_llm_quota(query, prompt_type, span):
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return None
+    ticket = await scheduler.aacquire(prompt_type, estimate_tokens(query))
+    _trace_quota(span, ticket)
+    return ticket
+
+
+def _settle_llm_quota(ticket, resp=None, content=None):
+    # 按实际用量修正TPM预留：优先用响应的usage，流式输出按输出文本估算，请求失败时保留预留值
+    if ticket is None:
+        return
+    if resp is not None and resp.usage is not None:
+        ticket.settle(resp.usage.total_tokens)
+    elif content is not None:
+        ticket.settle(ticket.prompt_tokens + estimate_tokens(content))
+    else:
+        ticket.settle()
+
+
+def _llm_span_attributes(pool, query, cached, stream):
+    return {"kind": "llm", "model": pool.model, "stream": stream, "cache_hit": cached is not None,
+            "prompt_bytes": len(query.encode("utf-8")), "queue_wait": tracing.consume_queue_wait()}
+
+
+def _trace_usage(span, query, content, usage=None, cached=False):
+    # 命中缓存时没有消耗token，只记录输出字节数；响应中没有usage（如流式输出）时按estimate_tokens估算
+    if not span.recording:
+        return
+    span.set(completion_bytes=len(content.encode("utf-8")))
+    if cached:
+        return
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    else:
+        span.set(prompt_tokens=estimate_tokens(query), completion_tokens=estimate_tokens(content),
+                 tokens_estimated=True)
+
+
+def _stream_chat_completions4(pool, key, query, cached, prompt_type=None, validate=None):
+    span = tracing.start_span("llm.chat_completions4",
+                              **_llm_span_attributes(pool, query, cached, True))
+    parts, error = [], None
+    try:
+        if cached is not None:
+            parts.append(cached.choices[0].message.content or "")
+            yield parts[0]
+            return
+        last_chunk, finish_reason = None, None
+        ticket = _acquire_llm_quota(query, prompt_type, span)
+        pool.begin()
+        try:
+            with tracing.use_span(span):
+                stream = pool.client().chat.completions.create(
+                    model=pool.model,
+                    messages=[
+                        {"role": "user", "content": query}
+                    ],
+                    stream=True
+                )
+            with stream:
+                for chunk in stream:
+                    last_chunk = chunk
+                    finish_reason = _chunk_finish_reason(chunk, finish_reason)
+                    delta = _chunk_delta(chunk)
+                    if delta:
+                        if not parts:
+                            span.set(ttft=span.duration)
+                        parts.append(delta)
+                        yield delta
+        finally:
+            pool.end()
+            _settle_llm_quota(ticket, content="".join(parts))
+        # 没有结束原因说明输出不完整，不写入缓存
+        if finish_reason is not None:
+            _llm_cache_set(key, _stream_completion(pool.model, "".join(parts), last_chunk,
+                                                   finish_reason), validate)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _trace_usage(span, query, "".join(parts), cached=cached is not None)
+        span.end(error)
+
+
+async def _astream_chat_completions4(pool, key, query, cached, prompt_type=None, validate=None):
+    span = tracing.start_span("llm.chat_completions4",
+                              **_llm_span_attributes(pool, query, cached, True))
+    parts, error = [], None
     try:
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e), "status_code": response.status_code, "text": response.text}
+        if cached is not None:
+            parts.append(cached.choices[0].message.content or "")
+            yield parts[0]
+            return
+        last_chunk, finish_reason = None, None
+        ticket = await _aacquire_llm_quota(query, prompt_type, span)
+        pool.begin()
+        try:
+            with tracing.use_span(span):
+                stream = await pool.async_client().chat.completions.create(
+                    model=pool.model,
+                    messages=[
+                        {"role": "user", "content": query}
+                    ],
+                    stream=True
+                )
+            async with stream:
+                async for chunk in stream:
+                    last_chunk = chunk
+                    finish_reason = _chunk_finish_reason(chunk, finish_reason)
+                    delta = _chunk_delta(chunk)
+                    if delta:
+                        if not parts:
+                            span.set(ttft=span.duration)
+                        parts.append(delta)
+                        yield delta
+        finally:
+            pool.end()
+            _settle_llm_quota(ticket, content="".join(parts))
+        # 没有结束原因说明输出不完整，不写入缓存
+        if finish_reason is not None:
+            _llm_cache_set(key, _stream_completion(pool.model, "".join(parts), last_chunk,
+                                                   finish_reason), validate)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _trace_usage(span, query, "".join(parts), cached=cached is not None)
+        span.end(error)
 
 
-def chat_completions4(query):
+def chat_completions4(query, use_cache=True, stream=False, prompt_type=None, validate=None):
+    """
+    调用大模型，use_cache=False时绕过LLM响应缓存（既不读也不写）。
+    stream=True时返回逐段产出文本增量的生成器，生成完整后写入响应缓存，
+    命中缓存时一次性产出缓存的完整内容。
+    prompt_type（如"final"、"check"）决定调度器启用时的排队优先级，见scheduler.PROMPT_PRIORITIES。
+    validate为以输出文本为参数的函数，返回False时响应不写入缓存（如输出无法解析）。
+    """
     # 智增增
-    client = OpenAI(api_key=API_SECRET_KEY, base_url=BASE_URL)
-    resp = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "user", "content": query}
-        ]
-    )
+    pool = get_llm_pool()
+    key, cached = _llm_cache_get(pool.model, query, use_cache)
+    if stream:
+        return _stream_chat_completions4(pool, key, query, cached, prompt_type, validate)
+    with tracing.span("llm.chat_completions4",
+                      **_llm_span_attributes(pool, query, cached, False)) as span:
+        if cached is not None:
+            _trace_usage(span, query, cached.choices[0].message.content or "", cached=True)
+            return cached
+
+        ticket = _acquire_llm_quota(query, prompt_type, span)
+        resp = None
+        pool.begin()
+        try:
+            resp = pool.client().chat.completions.create(
+                model=pool.model,
+                messages=[
+                    {"role": "user", "content": query}
+                ]
+            )
+        finally:
+            pool.end()
+            _settle_llm_quota(ticket, resp)
+        _trace_usage(span, query, resp.choices[0].message.content or "", resp.usage)
+    _llm_cache_set(key, resp, validate)
+    return resp
+
+
+async def aquery_faults(query_text, scene_tag, province_tag="hq", top_k=5, score_threshold=0.5):
+    """
+    query_faults的异步版本，阻塞的HTTP请求放到线程池中执行，不阻塞事件循环；
+    并发的相同检索只发出一次（见configure_single_flight）
+    """
+    single_flight = _retrieval_single_flight
+    if single_flight is None:
+        return await _run_in_thread(query_faults, query_text, scene_tag, province_tag,
+                                    top_k, score_threshold)
+    key = retrieval_cache_key(query_text, scene_tag, province_tag, top_k, score_threshold)
+    return await single_flight.run(key, lambda: _run_in_thread(
+        query_faults, query_text, scene_tag, province_tag, top_k, score_threshold))
+
+
+async def _run_in_thread(func, *args):
+    # 在默认线程池中执行，并复制当前上下文（tracing的当前span、排队等待时间）；
+    # 与asyncio.to_thread相同，但后者需要Python 3.9+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(contextvars.copy_context().run, func, *args))
+
+
+async def achat_completions4(query, use_cache=True, stream=False, prompt_type=None,
+                             validate=None):
+    """
+    chat_completions4的异步版本，stream=True时返回异步生成器。
+    未命中缓存时，并发的相同prompt只发出一次请求（见configure_single_flight）
+    """
+    pool = get_llm_pool()
+    key, cached = _llm_cache_get(pool.model, query, use_cache)
+    if stream:
+        return _astream_chat_completions4(pool, key, query, cached, prompt_type, validate)
+    single_flight = _llm_single_flight
+    if cached is None and use_cache and single_flight is not None:
+        return await single_flight.run(
+            key or llm_cache_key(pool.model, query),
+            lambda: _achat_completions4(pool, key, query, cached, prompt_type, validate))
+    return await _achat_completions4(pool, key, query, cached, prompt_type, validate)
+
+
+async def _achat_completions4(pool, key, query, cached, prompt_type, validate=None):
+    with tracing.span("llm.chat_completions4",
+                      **_llm_span_attributes(pool, query, cached, False)) as span:
+        if cached is not None:
+            _trace_usage(span, query, cached.choices[0].message.content or "", cached=True)
+            return cached
+
+        ticket = await _aacquire_llm_quota(query, prompt_type, span)
+        resp = None
+        pool.begin()
+        try:
+            resp = await pool.async_client().chat.completions.create(
+                model=pool.model,
+                messages=[
+                    {"role": "user", "content": query}
+                ]
+            )
+        finally:
+            pool.end()
+            _settle_llm_quota(ticket, resp)
+        _trace_usage(span, query, resp.choices[0].message.content or "", resp.usage)
+    _llm_cache_set(key, resp, validate)
     return resp
 
 
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数：中日韩字符按1个token计，其余字符按每4个1个token计
+    """
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af"
+              or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
 def doc_2_doclist(docs):
     if docs and len(docs) > 0:
         # 提取所有文档的text内容
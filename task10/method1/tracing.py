@@ -0,0 +1,517 @@
+# 链路追踪：每次LLM调用和检索调用记录一个span（token数、字节数、重试、缓存命中、排队等待、解析结果），
+# 按单个问题的trace id嵌套，可导出为JSONL和OpenTelemetry（OTLP/JSON）格式，并汇总时间和token的去向
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# 内存中最多保留的已结束span数，用于tracing_summary和导出
+TRACE_BUFFER_SIZE = 100_000
+# OTLP导出的service.name
+SERVICE_NAME = "rag-method1"
+# 发送到OTLP/HTTP collector的超时时间（秒）
+OTLP_TIMEOUT = 5.0
+# 等待发送的trace数上限，collector跟不上时丢弃新的trace
+OTLP_QUEUE_SIZE = 1000
+# flush/close时等待发送队列清空的最长时间（秒）
+OTLP_FLUSH_TIMEOUT = 10.0
+
+# OTLP的span kind：INTERNAL=1，CLIENT=3；status code：UNSET=0，ERROR=2
+_OTLP_KIND_INTERNAL = 1
+_OTLP_KIND_CLIENT = 3
+_OTLP_STATUS_ERROR = 2
+_CLIENT_KINDS = ("llm", "retrieval")
+
+_current = contextvars.ContextVar("tracing_current_span", default=None)
+_queue_wait = contextvars.ContextVar("tracing_queue_wait", default=0.0)
+
+logger = logging.getLogger("MyLogger")
+
+
+class Span:
+    """
+    一段被追踪的调用。attributes中的常用字段：
+    - kind: "llm" / "retrieval"，其余为内部阶段
+    - prompt_tokens / completion_tokens / prompt_bytes / completion_bytes
+    - cache_hit, retries, http_requests, queue_wait（秒）
+    - prompt_type, parse_status, reasked
+    """
+
+    recording = True
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, key, value=1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def get(self, key, default=None):
+        return self.attributes.get(key, default)
+
+    @property
+    def duration(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) \
+                else str(error)
+        self._tracer.record(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.end(exc)
+        return False
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    # 未启用追踪时使用，所有操作都是空操作
+    recording = False
+    attributes = {}
+    duration = 0.0
+
+    def set(self, **attributes):
+        return self
+
+    def add(self, key, value=1):
+        pass
+
+    def get(self, key, default=None):
+        return default
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    收集已结束的span：保存在内存中，并按配置逐条追加到JSONL文件；
+    OTLP导出按trace分组，根span结束时把整个trace写入OTLP文件（每行一个ExportTraceServiceRequest）
+    或发送到OTLP/HTTP collector（如 http://localhost:4318/v1/traces）。
+    发送由后台线程完成，span结束（可能在事件循环中）时只把trace放入队列，不等待collector
+    """
+
+    def __init__(self, jsonl_path=None, otlp_path=None, otlp_endpoint=None,
+                 buffer_size=TRACE_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self.spans = deque(maxlen=buffer_size)
+        self.jsonl_path = jsonl_path
+        self.otlp_path = otlp_path
+        self.otlp_endpoint = otlp_endpoint
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        self._otlp = open(otlp_path, "a", encoding="utf-8") if otlp_path else None
+        self._pending = {}  # trace_id -> 未导出的span（只在需要OTLP导出时使用）
+        self._send_queue = None
+        self._sender = None
+        self.otlp_dropped = 0
+        if otlp_endpoint:
+            self._send_queue = queue.Queue(maxsize=OTLP_QUEUE_SIZE)
+            self._sender = threading.Thread(target=self._send_loop, name="otlp-exporter", daemon=True)
+            self._sender.start()
+
+    def start(self, name, attributes, parent=None, new_trace=False):
+        parent = None if new_trace else (parent or _current.get())
+        if parent is not None and parent.recording:
+            return Span(self, name, parent.trace_id, parent.span_id, attributes)
+        return Span(self, name, os.urandom(16).hex(), None, attributes)
+
+    def record(self, span):
+        batch = None
+        with self._lock:
+            self.spans.append(span)
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                self._jsonl.flush()
+            if self._otlp is not None or self.otlp_endpoint:
+                self._pending.setdefault(span.trace_id, []).append(span)
+                if span.parent_id is None:
+                    batch = self._pending.pop(span.trace_id)
+        if batch:
+            self._export_otlp(batch)
+
+    def _export_otlp(self, spans):
+        payload = to_otlp(spans)
+        if self._otlp is not None:
+            with self._lock:
+                self._otlp.write(json.dumps(payload, ensure_ascii=False) + "\n")
+                self._otlp.flush()
+        if self._send_queue is not None:
+            try:
+                self._send_queue.put_nowait(payload)
+            except queue.Full:
+                with self._lock:
+                    self.otlp_dropped += 1
+                logger.warning("OTLP发送队列已满，丢弃trace")
+
+    def _send_loop(self):
+        import requests
+        session = requests.Session()
+        while True:
+            payload = self._send_queue.get()
+            try:
+                if payload is None:
+                    return
+                session.post(self.otlp_endpoint, json=payload, timeout=OTLP_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"发送OTLP trace失败: {e}")
+            finally:
+                self._send_queue.task_done()
+
+    def flush(self, timeout=OTLP_FLUSH_TIMEOUT):
+        # 导出根span尚未结束（或已先于子span结束）的trace，并等待发送队列清空（最多timeout秒）
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for spans in pending:
+            self._export_otlp(spans)
+        if self._send_queue is not None:
+            with self._send_queue.all_tasks_done:
+                if not self._send_queue.all_tasks_done.wait_for(
+                        lambda: self._send_queue.unfinished_tasks == 0, timeout):
+                    logger.warning(f"{timeout}秒后仍有{self._send_queue.unfinished_tasks}个trace未发送")
+
+    def close(self):
+        self.flush()
+        if self._sender is not None:
+            try:
+                self._send_queue.put(None, timeout=OTLP_TIMEOUT)
+            except queue.Full:
+                pass
+            self._sender.join(OTLP_TIMEOUT)
+            self._sender = None
+        with self._lock:
+            for f in (self._jsonl, self._otlp):
+                if f is not None:
+                    f.close()
+            self._jsonl = self._otlp = None
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def configure_tracing(enabled=True, jsonl_path=None, otlp_path=None, otlp_endpoint=None,
+                      buffer_size=TRACE_BUFFER_SIZE):
+    """
+    启用/关闭链路追踪，默认不启用（此时span为空操作）
+
+    参数:
+    - jsonl_path: 逐条追加已结束span的JSONL文件
+    - otlp_path: 按trace追加OTLP/JSON的文件（每行一个ExportTraceServiceRequest）
+    - otlp_endpoint: OTLP/HTTP collector地址，如 http://localhost:4318/v1/traces
+    - buffer_size: 内存中保留的span数
+    """
+    global _tracer
+    tracer = Tracer(jsonl_path, otlp_path, otlp_endpoint, buffer_size) if enabled else None
+    with _tracer_lock:
+        old_tracer, _tracer = _tracer, tracer
+    if old_tracer is not None:
+        old_tracer.close()
+    return tracer
+
+
+def tracing_enabled():
+    return _tracer is not None
+
+
+def span(name, new_trace=False, **attributes):
+    """
+    作为上下文管理器使用的span，嵌套在当前span下；没有当前span（或new_trace=True）时开始新的trace
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return tracer.start(name, attributes, new_trace=new_trace)
+
+
+def start_span(name, parent=None, **attributes):
+    """
+    不设为当前span的span，需手动调用end()。用于跨越多次yield的流式调用
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return tracer.start(name, attributes, parent=parent)
+
+
+class use_span:
+    """
+    临时把span设为当前span（不结束它），使其间发起的调用嵌套在该span下
+    """
+
+    def __init__(self, span):
+        self._span = span
+        self._token = None
+
+    def __enter__(self):
+        if self._span.recording:
+            self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current.reset(self._token)
+        return False
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def add_queue_wait(seconds):
+    """
+    记录在信号量等处排队等待的时间，计入当前上下文中下一次LLM或检索调用的queue_wait
+    """
+    if _tracer is not None:
+        _queue_wait.set(_queue_wait.get() + seconds)
+
+
+def consume_queue_wait():
+    seconds = _queue_wait.get()
+    if seconds:
+        _queue_wait.set(0.0)
+    return seconds
+
+
+def traced(name=None):
+    """
+    把函数（同步或异步）的每次调用记录为一个span
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await func(*args, **kwargs)
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finished_spans():
+    tracer = _tracer
+    if tracer is None:
+        return []
+    with tracer._lock:
+        return list(tracer.spans)
+
+
+def reset_tracing():
+    tracer = _tracer
+    if tracer is not None:
+        with tracer._lock:
+            tracer.spans.clear()
+
+
+def flush_tracing():
+    if _tracer is not None:
+        _tracer.flush()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    return {"stringValue": json.dumps(value, ensure_ascii=False, default=str)}
+
+
+def to_otlp(spans):
+    """
+    转换为OTLP/JSON的ExportTraceServiceRequest
+    """
+    otlp_spans = []
+    for s in spans:
+        item = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": _OTLP_KIND_CLIENT if s.attributes.get("kind") in _CLIENT_KINDS
+            else _OTLP_KIND_INTERNAL,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in s.attributes.items() if value is not None],
+            "status": {"code": _OTLP_STATUS_ERROR, "message": s.error} if s.error else {},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        otlp_spans.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name",
+                                     "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "method1.tracing"}, "spans": otlp_spans}],
+    }]}
+
+
+def export_jsonl(path, spans=None):
+    spans = finished_spans() if spans is None else spans
+    with open(path, "w", encoding="utf-8") as f:
+        for s in spans:
+            f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+def export_otlp_json(path, spans=None):
+    spans = finished_spans() if spans is None else spans
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_otlp(spans), f, ensure_ascii=False)
+
+
+_SUMMED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "prompt_bytes", "completion_bytes",
+                      "retries", "queue_wait")
+
+
+def _aggregate(spans, total_seconds):
+    import numpy as np
+    durations = [s.duration for s in spans]
+    entry = {
+        "count": len(spans),
+        "errors": sum(1 for s in spans if s.error),
+        "seconds": float(sum(durations)),
+        "share": float(sum(durations)) / total_seconds if total_seconds else 0.0,
+        "mean_ms": float(np.mean(durations)) * 1000,
+        "p50_ms": float(np.percentile(durations, 50)) * 1000,
+        "p95_ms": float(np.percentile(durations, 95)) * 1000,
+        "cache_hits": sum(1 for s in spans if s.attributes.get("cache_hit")),
+    }
+    for key in _SUMMED_ATTRIBUTES:
+        values = [s.attributes[key] for s in spans if s.attributes.get(key) is not None]
+        if values:
+            entry[key] = sum(values)
+    return entry
+
+
+def tracing_summary(spans=None):
+    """
+    时间和token的去向：按span名和prompt类型汇总次数、耗时（share为占所有trace总耗时的比例，
+    嵌套的span会重复计入各自的上层）、token数、字节数、缓存命中、重试和排队等待
+    """
+    spans = finished_spans() if spans is None else list(spans)
+    by_id = {s.span_id: s for s in spans}
+    roots = [s for s in spans if s.parent_id is None]
+    total_seconds = sum(s.duration for s in roots)
+
+    by_name, by_prompt_type = {}, {}
+    for s in spans:
+        by_name.setdefault(s.name, []).append(s)
+        if s.attributes.get("kind") == "llm":
+            # prompt类型记录在上层的llm.<prompt_type> span上
+            parent = by_id.get(s.parent_id)
+            prompt_type = s.attributes.get("prompt_type") or (
+                parent.attributes.get("prompt_type") if parent is not None else None)
+            by_prompt_type.setdefault(prompt_type or "other", []).append(s)
+
+    parse = {}
+    for s in spans:
+        status = s.attributes.get("parse_status")
+        if status:
+            counts = parse.setdefault(s.attributes.get("prompt_type") or "other", {})
+            counts[status] = counts.get(status, 0) + 1
+
+    llm_spans = [s for s in spans if s.attributes.get("kind") == "llm"]
+    return {
+        "traces": len(roots),
+        "trace_seconds": total_seconds,
+        "spans": {name: _aggregate(group, total_seconds)
+                  for name, group in sorted(by_name.items())},
+        "llm_by_prompt_type": {prompt_type: _aggregate(group, total_seconds)
+                               for prompt_type, group in sorted(by_prompt_type.items())},
+        "parse_status": parse,
+        "tokens": {
+            "prompt": sum(s.attributes.get("prompt_tokens") or 0 for s in llm_spans),
+            "completion": sum(s.attributes.get("completion_tokens") or 0 for s in llm_spans),
+        },
+    }
+
+
+def load_jsonl(path):
+    """
+    读取export_jsonl或configure_tracing(jsonl_path=...)写出的span，可直接传给tracing_summary
+    """
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            s = Span.__new__(Span)
+            s._tracer = None
+            s.name = item["name"]
+            s.trace_id = item["trace_id"]
+            s.span_id = item["span_id"]
+            s.parent_id = item["parent_id"]
+            s.attributes = item["attributes"]
+            s.start_ns = item["start_ns"]
+            s.end_ns = item["end_ns"]
+            s.error = item["error"]
+            s._token = None
+            spans.append(s)
+    return spans
+
+
+if __name__ == "__main__":
+    # python -m method1.tracing spans.jsonl：汇总已导出的span
+    import sys
+    print(json.dumps(tracing_summary(load_jsonl(sys.argv[1])), ensure_ascii=False, indent=2))
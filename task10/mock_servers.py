@@ -0,0 +1,395 @@
+# 本地替身服务：OpenAI兼容的LLM mock和检索服务（/bm/query/kg/trag）mock，
+# 回放outputs/*.json中记录的拆解、子问题回答、检查、最终答案和检索文档，用于可复现的性能基准
+import argparse
+import glob
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from method1.precheck import char_ngrams
+from method1.tools import estimate_tokens
+
+# LLM mock默认的延迟模型：首token延迟 + 输入token / 预填充速度 + 输出token / 生成速度
+DEFAULT_TTFT = 0.5                  # 秒
+DEFAULT_TOKENS_PER_SECOND = 50.0    # 输出token速度
+DEFAULT_PREFILL_TOKENS_PER_SECOND = None  # 输入token处理速度，None表示不计输入长度
+DEFAULT_RETRIEVAL_LATENCY = 0.3     # 检索mock的固定延迟（秒）
+
+RAG_PATH = "/bm/query/kg/trag"
+
+# prompt类型的识别标记，与prompt.py中的模板对应
+PROMPT_MARKERS = (
+    ("reask", "下面是一段模型输出"),
+    ("batch_check", "下面给出多组"),
+    ("check", "学术评审专家"),
+    ("decompose", "知识工程师"),
+    ("subanswer", "研究助理"),
+    ("final", "结构化证据回答复杂问题"),
+)
+
+
+def prompt_type(prompt):
+    for name, marker in PROMPT_MARKERS:
+        if marker in prompt:
+            return name
+    return "other"
+
+
+def _between(text, start, end):
+    i = text.find(start)
+    if i < 0:
+        return ""
+    i += len(start)
+    j = text.find(end, i)
+    return (text[i:j] if j >= 0 else text[i:]).strip()
+
+
+def _closest(table, key):
+    # 先精确匹配，否则取字符bigram Jaccard相似度最高的记录
+    if key in table:
+        return table[key]
+    if not table:
+        return None
+    grams = char_ngrams(key)
+    def similarity(other):
+        other_grams = char_ngrams(other)
+        union = grams | other_grams
+        return len(grams & other_grams) / len(union) if union else 0.0
+    return table[max(table, key=similarity)]
+
+
+def _prompt_hash(prompt):
+    return hashlib.sha1(prompt.strip().encode("utf-8")).hexdigest()
+
+
+class Recordings:
+    """
+    outputs/*.json中记录的响应，按prompt类型和其中的问题文本检索。
+    找不到完全一致的问题时，回放最相近问题的记录
+    """
+
+    def __init__(self):
+        self.queries = []         # [{"complex_query", "reference_answer", "source"}]
+        self.decompositions = {}  # 复杂问题 -> 子问题列表
+        self.subanswers = {}      # 子问题 -> {"reference", "answer"}
+        self.checks = {}          # 子问题 -> {"relevance", "faithfulness", "evidence_from_document"}
+        self.finals = {}          # 复杂问题 -> {"answer"}
+        self.final_prompts = {}   # 最终prompt的hash -> {"answer"}，prompt完全一致时优先使用
+        self.documents = {}       # 检索词 -> 文档列表
+
+    @classmethod
+    def from_outputs(cls, pattern="outputs/*.json"):
+        recordings = cls()
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding="utf-8") as f:
+                recordings.add(json.load(f), path)
+        if not recordings.queries:
+            raise ValueError(f"{pattern}中没有可回放的记录")
+        return recordings
+
+    def add(self, data, source=None):
+        complex_query = data["complex_query"]
+        if complex_query not in {item["complex_query"] for item in self.queries}:
+            self.queries.append({"complex_query": complex_query,
+                                 "reference_answer": data.get("reference_answer"),
+                                 "source": source})
+        self.decompositions.setdefault(complex_query, data.get("subquestions") or [])
+        final_answer = data.get("final_answer")
+        if not isinstance(final_answer, dict):
+            final_answer = {"answer": str(final_answer or "")}
+        self.finals.setdefault(complex_query, final_answer)
+        if data.get("final_prompt"):
+            self.final_prompts[_prompt_hash(data["final_prompt"])] = final_answer
+        for item in data.get("checked_subquestions_docs_subanswer", []):
+            subq = item["subquestion"]
+            self.subanswers.setdefault(subq, {"reference": item.get("evidence", ""),
+                                              "answer": item.get("answer", "")})
+            self.checks.setdefault(subq, {key: item.get(key, True) for key in (
+                "relevance", "faithfulness", "evidence_from_document")})
+            self.documents.setdefault(subq, item.get("docs_per_subq", []))
+        for subq, docs in data.get("subquestions_docs", []):
+            self.documents.setdefault(subq, docs)
+
+    def respond(self, prompt):
+        """
+        返回(prompt类型, 回放的模型输出文本)
+        """
+        kind = prompt_type(prompt)
+        if kind == "decompose":
+            value = _closest(self.decompositions, _between(prompt, "复杂问题：\n", "\n\n"))
+        elif kind == "final":
+            value = self.final_prompts.get(_prompt_hash(prompt)) or _closest(
+                self.finals, _between(prompt, "复杂问题：\n", "\n\n[子问题-答案]"))
+        elif kind == "subanswer":
+            value = _closest(self.subanswers, _between(prompt, "\n问题：\n", "\n\n参考文档："))
+        elif kind == "check":
+            value = _closest(self.checks, _between(prompt, "子问题：\n", "\n\n回答："))
+        elif kind == "batch_check":
+            value = [{"index": int(index), **_closest(self.checks, subq.strip())}
+                     for index, subq in re.findall(r"### 第(\d+)组\n子问题：\n(.*?)\n\n回答：",
+                                                   prompt, re.S)]
+        elif kind == "reask":
+            # 回放的输出都是合法JSON，不会触发重问；保险起见原样返回附带的输出
+            return kind, prompt.split("\n\n", 1)[-1]
+        else:
+            value = {"answer": ""}
+        return kind, json.dumps(value, ensure_ascii=False)
+
+    def retrieve(self, query, top_k):
+        return list(_closest(self.documents, query) or [])[:top_k]
+
+
+class LatencyModel:
+    """
+    LLM mock的延迟模型：ttft + 输入token / prefill_tokens_per_second + 输出token / tokens_per_second
+    """
+
+    def __init__(self, ttft=DEFAULT_TTFT, tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 prefill_tokens_per_second=DEFAULT_PREFILL_TOKENS_PER_SECOND):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+
+    def first_token_delay(self, prompt_tokens):
+        delay = self.ttft
+        if self.prefill_tokens_per_second:
+            delay += prompt_tokens / self.prefill_tokens_per_second
+        return delay
+
+    def token_interval(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+
+class RateLimit:
+    """
+    模拟服务端的RPM限流：最近60秒内的请求数达到rpm时返回429，Retry-After为最早一个请求移出窗口的时间
+    """
+
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self._lock = threading.Lock()
+        self._times = deque()
+
+    def retry_after(self):
+        # 允许请求时返回None，否则返回需要等待的秒数
+        now = time.monotonic()
+        with self._lock:
+            while self._times and now - self._times[0] >= 60.0:
+                self._times.popleft()
+            if len(self._times) >= self.rpm:
+                return 60.0 - (now - self._times[0])
+            self._times.append(now)
+            return None
+
+
+class MockStats:
+    """
+    mock服务收到的请求统计，reset()后重新计数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.rate_limited = 0
+            self.by_type = {}
+            self.prompt_bytes = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+
+    def record(self, kind, prompt_bytes=0, prompt_tokens=0, completion_tokens=0):
+        with self._lock:
+            self.requests += 1
+            self.by_type[kind] = self.by_type.get(kind, 0) + 1
+            self.prompt_bytes += prompt_bytes
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def record_rate_limited(self):
+        with self._lock:
+            self.rate_limited += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited,
+                    "by_type": dict(self.by_type),
+                    "prompt_bytes": self.prompt_bytes, "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, value, status=200):
+        body = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _LLMHandler(_Handler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json({"error": {"message": "not found"}}, 404)
+        body = self._read_json()
+        server = self.server
+        retry_after = server.rate_limit.retry_after() if server.rate_limit is not None else None
+        if retry_after is not None:
+            server.stats.record_rate_limited()
+            body = json.dumps({"error": {"message": "rate limit exceeded",
+                                         "type": "rate_limit_exceeded"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", f"{retry_after:.3f}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        messages = body.get("messages") or []
+        prompt = "".join(message.get("content") or "" for message in messages
+                         if isinstance(message.get("content"), str))
+        kind, content = server.recordings.respond(prompt)
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        server.stats.record(kind, len(prompt.encode("utf-8")), prompt_tokens, completion_tokens)
+
+        latency = server.latency
+        time.sleep(latency.first_token_delay(prompt_tokens))
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            return self._stream(model, content, completion_tokens, latency.token_interval())
+        time.sleep(completion_tokens * latency.token_interval())
+        self._send_json({
+            "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _stream(self, model, content, completion_tokens, interval):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # 按估算的token数均分文本，每个token之间间隔1/tokens_per_second
+        pieces = max(completion_tokens, 1)
+        size = max(-(-len(content) // pieces), 1)
+        for i in range(0, len(content), size):
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": {"content": content[i:i + size]},
+                                                  "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            time.sleep(interval)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class _RetrievalHandler(_Handler):
+    def do_POST(self):
+        if self.path.rstrip("/") != RAG_PATH:
+            return self._send_json({"error": "not found"}, 404)
+        body = self._read_json()
+        server = self.server
+        query = body.get("query") or ""
+        server.stats.record("retrieval", len(query.encode("utf-8")))
+        time.sleep(server.latency)
+        docs = server.recordings.retrieve(query, int(body.get("top_k") or 5))
+        self._send_json({"data": {"context": docs}})
+
+
+class MockServer:
+    """
+    在后台线程中运行的mock服务，port为0时自动分配端口
+    """
+
+    def __init__(self, handler, recordings, latency, host="127.0.0.1", port=0, rpm_limit=None):
+        self.stats = MockStats()
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._server.recordings = recordings
+        self._server.latency = latency
+        self._server.stats = self.stats
+        self._server.rate_limit = RateLimit(rpm_limit) if rpm_limit else None
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def start_llm_server(recordings, latency=None, host="127.0.0.1", port=0, rpm_limit=None):
+    """
+    启动OpenAI兼容的LLM mock，base_url为server.address + "/v1"；rpm_limit不为None时模拟服务端RPM限流
+    """
+    return MockServer(_LLMHandler, recordings, latency or LatencyModel(), host, port,
+                      rpm_limit).start()
+
+
+def start_retrieval_server(recordings, latency=DEFAULT_RETRIEVAL_LATENCY, host="127.0.0.1", port=0):
+    """
+    启动检索服务mock，url为server.address + RAG_PATH
+    """
+    return MockServer(_RetrievalHandler, recordings, latency, host, port).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="启动回放outputs/*.json的LLM和检索服务mock")
+    parser.add_argument("--outputs", default="../outputs/*.json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=18099)
+    parser.add_argument("--rag-port", type=int, default=18098)
+    parser.add_argument("--ttft", type=float, default=DEFAULT_TTFT)
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_TOKENS_PER_SECOND)
+    parser.add_argument("--prefill-tokens-per-second", type=float,
+                        default=DEFAULT_PREFILL_TOKENS_PER_SECOND)
+    parser.add_argument("--retrieval-latency", type=float, default=DEFAULT_RETRIEVAL_LATENCY)
+    parser.add_argument("--rpm-limit", type=int, help="模拟服务端RPM限流，超出时返回429")
+    args = parser.parse_args(argv)
+
+    recordings = Recordings.from_outputs(args.outputs)
+    llm = start_llm_server(recordings, LatencyModel(
+        args.ttft, args.tokens_per_second, args.prefill_tokens_per_second), args.host, args.llm_port,
+        args.rpm_limit)
+    rag = start_retrieval_server(recordings, args.retrieval_latency, args.host, args.rag_port)
+    print(f"LLM mock: {llm.address}/v1")
+    print(f"检索mock: {rag.address}{RAG_PATH}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        llm.stop()
+        rag.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+# 常驻HTTP服务：ASGI应用，提供/baseline、/method1（JSON或SSE流式响应）和/health。
+# 进程生命周期内LLM/检索客户端、prompt模板和各级缓存保持预热，
+# 并发请求中相同的检索和LLM调用合并为一次（见tools.configure_single_flight）。
+# 安装了uvicorn时用uvicorn运行，否则使用内置的基于h11的asyncio服务器
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import sys
+import time
+from urllib.parse import unquote
+
+from method1 import async_main, main as pipeline, scheduler, tools, tracing
+from method1.semantic_cache import semantic_cache_stats
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_SCENE_TAG = "wlyh"
+SHUTDOWN_TIMEOUT = 30.0          # 优雅退出时等待在途请求完成的最长时间（秒）
+MAX_BODY_BYTES = 1024 * 1024     # 请求体大小上限
+MAX_K = 50
+# /method1请求体中可传给async_main.run_method1的参数
+METHOD1_OPTIONS = ("pipeline", "check_mode", "precheck", "route", "dedup_documents",
+                   "speculative_retrieval", "speculative_keywords", "max_concurrency",
+                   "use_semantic_cache")
+
+logger = tools.setup_logger("Server", logging.INFO)
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _parse_request(body, method):
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise BadRequest("请求体不是合法的JSON")
+    if not isinstance(request, dict):
+        raise BadRequest("请求体必须是JSON对象")
+    complex_query = request.get("complex_query")
+    if not isinstance(complex_query, str) or not complex_query.strip():
+        raise BadRequest("缺少complex_query")
+    k = request.get("k", 5)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_K:
+        raise BadRequest(f"k必须是1到{MAX_K}之间的整数")
+    scene_tag = request.get("scene_tag", DEFAULT_SCENE_TAG)
+    if not isinstance(scene_tag, (str, list)):
+        raise BadRequest("scene_tag必须是字符串或字符串列表")
+    options = {}
+    if method == "method1":
+        unknown = set(request) - {"complex_query", "scene_tag", "k", "stream"} - set(METHOD1_OPTIONS)
+        if unknown:
+            raise BadRequest(f"未知的参数: {sorted(unknown)}")
+        options = {key: request[key] for key in METHOD1_OPTIONS if key in request}
+    return complex_query, scene_tag, k, bool(request.get("stream")), options
+
+
+def _result_record(method, result, elapsed):
+    # 字段与batch_runner的结果记录一致
+    if method == "baseline":
+        subquestions, subquestions_docs, _, final_answer, final_prompt, time_stats = result
+        record = {"subquestions": subquestions, "subquestions_docs": subquestions_docs}
+    else:
+        subquestions, _, _, checked_subquestions_docs_subanswer, _, final_answer, final_prompt, \
+            time_stats = result
+        record = {"subquestions": subquestions,
+                  "checked_subquestions_docs_subanswer": checked_subquestions_docs_subanswer}
+    record.update(method=method, final_answer=final_answer, final_prompt=final_prompt,
+                  timestatus=time_stats, elapsed=elapsed)
+    return record
+
+
+def _run(method, complex_query, scene_tag, k, options, on_answer_token=None):
+    if method == "baseline":
+        return async_main.run_baseline(complex_query, scene_tag, k,
+                                       on_answer_token=on_answer_token)
+    return async_main.run_method1(complex_query, scene_tag, k, on_answer_token=on_answer_token,
+                                  **options)
+
+
+def _json_bytes(value):
+    return json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _sse(event, value):
+    return f"event: {event}\ndata: {json.dumps(value, ensure_ascii=False, default=str)}\n\n" \
+        .encode("utf-8")
+
+
+async def _send_json(send, status, value):
+    body = _json_bytes(value)
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise BadRequest("请求体过大")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _cancel_on_disconnect(receive, task):
+    # 客户端断开时取消仍在运行的链路，不再继续消耗LLM配额
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            task.cancel()
+            return
+
+
+async def _stop_watcher(watcher):
+    # 等待监听任务真正结束，避免与同一连接上后续请求的读取并发
+    watcher.cancel()
+    await asyncio.gather(watcher, return_exceptions=True)
+
+
+class RAGService:
+    """
+    ASGI应用。
+
+    - POST /baseline、POST /method1：请求体为 {"complex_query", "scene_tag", "k", "stream", ...}，
+      /method1还接受METHOD1_OPTIONS中的参数。stream为false时返回JSON结果（字段与批量评测的结果记录一致）；
+      为true时返回text/event-stream，逐段发送token事件（最终答案的增量文本），最后发送result事件
+    - GET /health：状态、在途请求数、连接池、请求合并、调度器和缓存统计
+
+    lifespan启动时预热客户端和缓存；退出时不再接受新请求（返回503），
+    等待在途请求完成（最多shutdown_timeout秒）后关闭连接池并导出未写出的trace
+    """
+
+    def __init__(self, warmup=True, shutdown_timeout=SHUTDOWN_TIMEOUT):
+        self.warmup = warmup
+        self.shutdown_timeout = shutdown_timeout
+        self.started_at = time.time()
+        self.draining = False
+        self.in_flight = 0
+        self.served = {"baseline": 0, "method1": 0}
+        self.failed = 0
+        self._idle = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        path, method = scope["path"].rstrip("/") or "/", scope["method"]
+        if path == "/health":
+            if method != "GET":
+                return await _send_json(send, 405, {"error": "只支持GET"})
+            return await _send_json(send, 200, self.health())
+        if path not in ("/baseline", "/method1"):
+            return await _send_json(send, 404, {"error": f"未知的路径: {scope['path']}"})
+        if method != "POST":
+            return await _send_json(send, 405, {"error": "只支持POST"})
+        if self.draining:
+            return await _send_json(send, 503, {"error": "服务正在退出"})
+
+        self._enter()
+        try:
+            await self._handle(path.lstrip("/"), receive, send)
+        finally:
+            self._exit()
+
+    def _enter(self):
+        self.in_flight += 1
+        if self._idle is not None:
+            self._idle.clear()
+
+    def _exit(self):
+        self.in_flight -= 1
+        if self.in_flight == 0 and self._idle is not None:
+            self._idle.set()
+
+    async def _handle(self, method, receive, send):
+        try:
+            body = await _read_body(receive)
+            if body is None:
+                return
+            complex_query, scene_tag, k, stream, options = _parse_request(body, method)
+        except BadRequest as e:
+            return await _send_json(send, 400, {"error": str(e)})
+
+        if stream:
+            return await self._stream(method, complex_query, scene_tag, k, options, receive, send)
+
+        start_time = time.time()
+        task = asyncio.ensure_future(_run(method, complex_query, scene_tag, k, options))
+        watcher = asyncio.ensure_future(_cancel_on_disconnect(receive, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            logger.info(f"客户端已断开，取消{method}请求")
+            return
+        except Exception as e:
+            self.failed += 1
+            logger.exception(f"{method}请求失败")
+            return await _send_json(send, 500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            await _stop_watcher(watcher)
+        self.served[method] += 1
+        await _send_json(send, 200, _result_record(method, result, time.time() - start_time))
+
+    async def _stream(self, method, complex_query, scene_tag, k, options, receive, send):
+        start_time = time.time()
+        tokens = asyncio.Queue()
+        task = asyncio.ensure_future(_run(method, complex_query, scene_tag, k, options,
+                                          on_answer_token=tokens.put_nowait))
+        watcher = asyncio.ensure_future(_cancel_on_disconnect(receive, task))
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache")]})
+        try:
+            while True:
+                getter = asyncio.ensure_future(tokens.get())
+                done, _ = await asyncio.wait((getter, task), return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    await send({"type": "http.response.body", "body": _sse("token", {
+                        "text": getter.result()}), "more_body": True})
+                    continue
+                getter.cancel()
+                break
+            while not tokens.empty():
+                await send({"type": "http.response.body", "body": _sse("token", {
+                    "text": tokens.get_nowait()}), "more_body": True})
+            if task.cancelled():
+                logger.info(f"客户端已断开，取消{method}请求")
+                return
+            error = task.exception()
+            if error is not None:
+                self.failed += 1
+                logger.error(f"{method}请求失败: {type(error).__name__}: {error}")
+                event = _sse("error", {"error": f"{type(error).__name__}: {error}"})
+            else:
+                self.served[method] += 1
+                event = _sse("result", _result_record(method, task.result(),
+                                                      time.time() - start_time))
+            await send({"type": "http.response.body", "body": event})
+        finally:
+            await _stop_watcher(watcher)
+            if not task.done():
+                task.cancel()
+
+    def health(self):
+        return {
+            "status": "draining" if self.draining else "ok",
+            "uptime": time.time() - self.started_at,
+            "in_flight": self.in_flight,
+            "served": dict(self.served),
+            "failed": self.failed,
+            "llm_pool": tools.llm_pool_stats(),
+            "single_flight": tools.single_flight_stats(),
+            "scheduler": scheduler.scheduler_stats(),
+            "llm_cache": tools.llm_cache_stats(),
+            "retrieval_cache": tools.retrieval_cache_stats(),
+            "semantic_cache": semantic_cache_stats(),
+        }
+
+    async def startup(self):
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.started_at = time.time()
+        if not self.warmup:
+            return
+        start_time = time.time()
+        # 构造prompt注册表，创建LLM/检索客户端的连接池
+        await asyncio.get_running_loop().run_in_executor(None, pipeline.warmup)
+        tools.get_llm_pool().async_client()
+        logger.info(f"预热完成，耗时{time.time() - start_time:.2f}秒")
+
+    async def shutdown(self):
+        self.draining = True
+        if self.in_flight:
+            logger.info(f"等待{self.in_flight}个在途请求完成")
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self.shutdown_timeout}秒后仍有{self.in_flight}个请求未完成")
+        await tools.get_llm_pool().aclose()
+        tools.get_llm_pool().close()
+        tools.get_retrieval_client().close()
+        # 等待OTLP发送队列清空，不阻塞事件循环
+        await asyncio.get_running_loop().run_in_executor(None, tracing.flush_tracing)
+        logger.info("服务已退出")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+class H11Server:
+    """
+    未安装uvicorn时使用的最小ASGI服务器（HTTP/1.1，keep-alive，流式响应使用chunked编码），
+    收到SIGINT/SIGTERM时停止接受连接，执行应用的lifespan shutdown后退出
+    """
+
+    def __init__(self, app, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self._connections = set()
+        self._stopping = False
+
+    async def serve(self, stop=None):
+        stop = stop or asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        lifespan = _Lifespan(self.app)
+        await lifespan.startup()
+        server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"服务已启动: http://{self.host}:{self.port}")
+        try:
+            await stop.wait()
+        finally:
+            self._stopping = True
+            server.close()
+            await lifespan.shutdown()
+            for task in list(self._connections):
+                task.cancel()
+            await server.wait_closed()
+
+    async def _connection(self, reader, writer):
+        import h11
+        task = asyncio.current_task()
+        self._connections.add(task)
+        conn = h11.Connection(h11.SERVER)
+        try:
+            while not self._stopping:
+                event = await self._next_event(conn, reader)
+                if not isinstance(event, h11.Request):
+                    break
+                await self._request(conn, event, reader, writer)
+                if conn.our_state is h11.DONE and conn.their_state is h11.SEND_BODY:
+                    await self._drain_body(conn, reader)
+                if conn.our_state is not h11.DONE or conn.their_state is not h11.DONE:
+                    break
+                conn.start_next_cycle()
+        except (ConnectionError, h11.RemoteProtocolError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _next_event(conn, reader):
+        import h11
+        while True:
+            event = conn.next_event()
+            if event is not h11.NEED_DATA:
+                return event
+            conn.receive_data(await reader.read(65536))
+
+    async def _drain_body(self, conn, reader):
+        # 应用没有读取请求体（/health、404、405、503等）时读完剩余部分，连接才能继续保活；
+        # 请求体超过MAX_BODY_BYTES时放弃，由调用方关闭连接
+        import h11
+        size = 0
+        while conn.their_state is h11.SEND_BODY and size <= MAX_BODY_BYTES:
+            event = await self._next_event(conn, reader)
+            if isinstance(event, h11.Data):
+                size += len(event.data)
+            elif not isinstance(event, h11.EndOfMessage):
+                return
+
+    async def _request(self, conn, request, reader, writer):
+        import h11
+        path, _, query = request.target.decode("latin-1").partition("?")
+        peer = writer.get_extra_info("peername")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": request.method.decode("ascii"), "scheme": "http",
+            "path": unquote(path), "raw_path": path.encode("latin-1"),
+            "query_string": query.encode("latin-1"), "root_path": "",
+            "headers": [(name.lower(), value) for name, value in request.headers],
+            "server": (self.host, self.port), "client": peer[:2] if peer else None,
+        }
+        state = {"body_done": False, "started": False, "finished": False}
+
+        async def receive():
+            if not state["body_done"]:
+                event = await self._next_event(conn, reader)
+                if isinstance(event, h11.Data):
+                    return {"type": "http.request", "body": bytes(event.data), "more_body": True}
+                state["body_done"] = True
+                if isinstance(event, h11.EndOfMessage):
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                return {"type": "http.disconnect"}
+            # 请求体读完后，只在连接断开时返回
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return {"type": "http.disconnect"}
+                conn.receive_data(data)
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                writer.write(conn.send(h11.Response(status_code=message["status"],
+                                                    headers=message.get("headers", []))))
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not state["finished"]:
+                body = message.get("body", b"")
+                if body:
+                    writer.write(conn.send(h11.Data(data=body)))
+                if not message.get("more_body"):
+                    writer.write(conn.send(h11.EndOfMessage()))
+                    state["finished"] = True
+                await writer.drain()
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            logger.exception("请求处理异常")
+            if not state["started"]:
+                await _send_json(send, 500, {"error": "internal error"})
+            else:
+                raise ConnectionError("响应中断")
+        if not state["finished"]:
+            raise ConnectionError("应用未完成响应")
+
+
+class _Lifespan:
+    # 在内置服务器中驱动ASGI lifespan协议
+    def __init__(self, app):
+        self.app = app
+        self._receive = asyncio.Queue()
+        self._sent = asyncio.Queue()
+        self._task = None
+
+    async def _send(self, message):
+        await self._sent.put(message)
+
+    async def startup(self):
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self._task = asyncio.ensure_future(self.app(scope, self._receive.get, self._send))
+        await self._receive.put({"type": "lifespan.startup"})
+        message = await self._sent.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"启动失败: {message.get('message')}")
+
+    async def shutdown(self):
+        await self._receive.put({"type": "lifespan.shutdown"})
+        await self._sent.get()
+        await self._task
+
+
+def serve(app=None, host=DEFAULT_HOST, port=DEFAULT_PORT, shutdown_timeout=SHUTDOWN_TIMEOUT):
+    """
+    运行服务直到收到SIGINT/SIGTERM，优先使用uvicorn
+    """
+    app = app or RAGService(shutdown_timeout=shutdown_timeout)
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+    if uvicorn is not None:
+        uvicorn.run(app, host=host, port=port, lifespan="on",
+                    timeout_graceful_shutdown=shutdown_timeout)
+    else:
+        asyncio.run(H11Server(app, host, port).serve())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以常驻HTTP服务运行baseline和method1")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--llm-base-url", help="LLM服务地址，默认使用config.py中的BASE_URL")
+    parser.add_argument("--rag-url", help="检索服务地址，默认使用tools.RAG_URL")
+    parser.add_argument("--rpm", type=int, help="启用LLM调度器，每分钟请求数上限")
+    parser.add_argument("--tpm", type=int, help="启用LLM调度器，每分钟token数上限")
+    parser.add_argument("--no-single-flight", action="store_true", help="不合并并发的相同请求")
+    parser.add_argument("--trace", help="启用链路追踪，span写入<TRACE>.jsonl和<TRACE>.otlp.jsonl")
+    parser.add_argument("--shutdown-timeout", type=float, default=SHUTDOWN_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    if args.llm_base_url:
+        tools.configure_llm_pool(base_url=args.llm_base_url)
+    if args.rag_url:
+        tools.configure_retrieval_client(url=args.rag_url, proxies=None)
+    if args.rpm or args.tpm:
+        scheduler.configure_scheduler(rpm=args.rpm, tpm=args.tpm)
+    if args.no_single_flight:
+        tools.configure_single_flight(enabled=False)
+    if args.trace:
+        tracing.configure_tracing(jsonl_path=f"{args.trace}.jsonl",
+                                  otlp_path=f"{args.trace}.otlp.jsonl")
+    serve(host=args.host, port=args.port, shutdown_timeout=args.shutdown_timeout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
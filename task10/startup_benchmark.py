@@ -0,0 +1,207 @@
+# 启动性能基准：在全新的子进程中测量各入口模块的导入耗时和导入后已加载的重依赖，
+# 以及连接本地mock服务时第一个问题与第二个问题的耗时（两者之差即首次使用时的初始化开销）
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import mock_servers
+from benchmark import _git_commit
+from method1.tools import setup_logger
+
+DEFAULT_MODULES = ("method1.main", "method1.async_main", "test_function", "batch_runner", "server")
+DEFAULT_METHODS = ("baseline", "method1")
+DEFAULT_REPEATS = 5
+DEFAULT_REPORT = "outputs/startup_report.json"
+# 导入后检查是否已加载的重依赖
+HEAVY_MODULES = ("langchain_core", "pydantic", "openai", "httpx", "requests", "numpy")
+
+# 子进程中执行：导入入口模块，可选地连接mock服务运行两次同一个问题，最后一行输出JSON结果
+_CHILD = r"""
+import json, sys, time
+process_start = start = time.perf_counter()
+import importlib
+args = json.loads(sys.argv[1])
+importlib.import_module(args["module"])
+result = {"import_seconds": time.perf_counter() - start,
+          "loaded": sorted(name for name in args["heavy"] if name in sys.modules)}
+if args.get("method"):
+    import logging
+    import batch_runner
+    from method1 import main, tools
+    from method1.semantic_cache import configure_semantic_cache
+    logging.getLogger("MyLogger").disabled = True
+    tools.configure_llm_pool(api_key="mock", base_url=args["llm_url"], model="mock")
+    tools.configure_retrieval_client(url=args["rag_url"], proxies=None)
+    tools.configure_llm_cache(enabled=False)
+    tools.configure_retrieval_cache(enabled=False)
+    configure_semantic_cache(enabled=False)
+    if args["warmup"]:
+        start = time.perf_counter()
+        main.warmup()
+        result["warmup_seconds"] = time.perf_counter() - start
+    for name in ("first_query_seconds", "second_query_seconds"):
+        start = time.perf_counter()
+        record = batch_runner.run_task(args["item"], args["method"], args["k"])
+        result[name] = time.perf_counter() - start
+        result.setdefault("first_answer_seconds", time.perf_counter() - process_start)
+        if "error" in record:
+            result["error"] = record["error"]
+print(json.dumps(result))
+"""
+
+
+def _run_child(args):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", _CHILD, json.dumps(args, ensure_ascii=False)],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"子进程失败：{proc.stderr.strip()[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = wall_seconds
+    return result
+
+
+def _median(results, key):
+    values = [result[key] for result in results if key in result]
+    return float(np.median(values)) if values else None
+
+
+def measure_import(module, repeats=DEFAULT_REPEATS):
+    """
+    在repeats个全新子进程中导入module，返回导入耗时与进程总耗时（含解释器启动）的中位数
+    """
+    results = [_run_child({"module": module, "heavy": HEAVY_MODULES}) for _ in range(repeats)]
+    return {
+        "module": module,
+        "import_seconds": _median(results, "import_seconds"),
+        "process_seconds": _median(results, "process_seconds"),
+        "loaded": results[-1]["loaded"],
+    }
+
+
+def measure_first_query(method, item, llm_server, rag_server, k=5, repeats=DEFAULT_REPEATS,
+                        warmup=False):
+    """
+    在全新子进程中导入batch_runner，连接mock服务后连续运行两次同一个问题（关闭各级缓存），
+    返回首个问题、第二个问题的耗时中位数及其差值，以及从开始导入到得到首个答案的总耗时
+    （first_answer_seconds，含导入、客户端配置和预热）。warmup为True时先调用main.warmup()并单独计时
+    """
+    args = {"module": "batch_runner", "heavy": HEAVY_MODULES, "method": method, "item": item,
+            "k": k, "warmup": warmup, "llm_url": f"{llm_server.address}/v1",
+            "rag_url": f"{rag_server.address}{mock_servers.RAG_PATH}"}
+    results = [_run_child(args) for _ in range(repeats)]
+    first, second = _median(results, "first_query_seconds"), _median(results, "second_query_seconds")
+    return {
+        "method": method,
+        "warmup": warmup,
+        "import_seconds": _median(results, "import_seconds"),
+        "warmup_seconds": _median(results, "warmup_seconds"),
+        "first_query_seconds": first,
+        "second_query_seconds": second,
+        "first_query_overhead": first - second,
+        "first_answer_seconds": _median(results, "first_answer_seconds"),
+        "errors": sorted({result["error"] for result in results if "error" in result})[:5],
+    }
+
+
+def run_startup_benchmark(modules=DEFAULT_MODULES, methods=DEFAULT_METHODS, repeats=DEFAULT_REPEATS,
+                          outputs="../outputs/*.json", k=5, scene_tag="wlyh", latency=None,
+                          retrieval_latency=0.0):
+    """
+    运行完整的启动基准。
+
+    Args:
+        modules (tuple): 测量导入耗时的入口模块
+        methods (tuple): 测量首个问题耗时的方法，见batch_runner.METHODS
+        repeats (int): 每项测量的子进程数，结果取中位数
+        outputs (str): 回放记录的glob
+        latency (mock_servers.LatencyModel): LLM mock的延迟模型，默认无延迟，只保留客户端侧的开销
+        retrieval_latency (float): 检索mock的固定延迟（秒）
+
+    Returns:
+        dict: {"meta": 运行环境与配置, "interpreter_seconds": 空进程耗时, "imports": [...], "queries": [...]}
+    """
+    latency = latency or mock_servers.LatencyModel(ttft=0.0, tokens_per_second=None)
+    logger = logging.getLogger("StartupBenchmark")
+    interpreter = [_run_child({"module": "sys", "heavy": ()}) for _ in range(repeats)]
+    imports = []
+    for module in modules:
+        imports.append(measure_import(module, repeats))
+        logger.info(f"导入{module}: {imports[-1]['import_seconds']:.3f}秒")
+
+    queries = []
+    if methods:
+        recordings = mock_servers.Recordings.from_outputs(outputs)
+        llm_server = mock_servers.start_llm_server(recordings, latency)
+        rag_server = mock_servers.start_retrieval_server(recordings, retrieval_latency)
+        query = recordings.queries[0]
+        item = {"id": "startup", "complex_query": query["complex_query"], "scene_tag": scene_tag}
+        try:
+            for method in methods:
+                for warmup in (False, True):
+                    queries.append(measure_first_query(method, item, llm_server, rag_server, k,
+                                                       repeats, warmup))
+                    logger.info(f"{method}{'（预热）' if warmup else ''}: 首个问题"
+                                f"{queries[-1]['first_query_seconds']:.3f}秒，第二个问题"
+                                f"{queries[-1]['second_query_seconds']:.3f}秒")
+        finally:
+            llm_server.stop()
+            rag_server.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "repeats": repeats,
+            "k": k,
+            "llm_latency": {"ttft": latency.ttft, "tokens_per_second": latency.tokens_per_second},
+            "retrieval_latency": retrieval_latency,
+        },
+        "interpreter_seconds": _median(interpreter, "process_seconds"),
+        "imports": imports,
+        "queries": queries,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量入口模块的导入耗时和首个问题的延迟")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES))
+    parser.add_argument("-m", "--methods", default=",".join(DEFAULT_METHODS),
+                        help="测量首个问题耗时的方法，为空时只测量导入")
+    parser.add_argument("-r", "--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--outputs", default="../outputs/*.json", help="回放记录的glob")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, help="LLM mock的输出速度，默认无延迟")
+    parser.add_argument("--retrieval-latency", type=float, default=0.0)
+    parser.add_argument("-o", "--output", default=DEFAULT_REPORT, help="报告JSON路径")
+    args = parser.parse_args(argv)
+
+    setup_logger("StartupBenchmark", logging.INFO)
+    report = run_startup_benchmark(
+        modules=tuple(m.strip() for m in args.modules.split(",") if m.strip()),
+        methods=tuple(m.strip() for m in args.methods.split(",") if m.strip()),
+        repeats=args.repeats, outputs=args.outputs, k=args.k,
+        latency=mock_servers.LatencyModel(args.ttft, args.tokens_per_second),
+        retrieval_latency=args.retrieval_latency)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps({"interpreter_seconds": report["interpreter_seconds"]}))
+    for entry in report["imports"] + report["queries"]:
+        print(json.dumps(entry, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,52 @@
-from method1.tools import chat_completions4, doc_2_doclist, setup_logger
+from method1 import tracing
+from method1.tools import chat_completions4, doc_2_doclist, get_llm_pool, setup_logger
 import method1.main as main
+import method1.async_main as async_main
+import asyncio
+import atexit
 import logging
+import threading
 import time
 
+# 每个线程复用一个事件循环：LLM异步客户端（及其keep-alive连接）按事件循环创建，
+# 每次asyncio.run都会新建循环，客户端无法复用且不会被关闭
+_thread_loops = threading.local()
+_loops = []
+_loops_lock = threading.Lock()
 
+
+def _run_async(coro):
+    loop = getattr(_thread_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _thread_loops.loop = asyncio.new_event_loop()
+        with _loops_lock:
+            _loops.append(loop)
+    return loop.run_until_complete(coro)
+
+
+def close_async_loops():
+    """
+    关闭各线程复用的事件循环及其LLM异步客户端，进程退出时自动调用
+    """
+    with _loops_lock:
+        loops, _loops[:] = list(_loops), []
+    for loop in loops:
+        if loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(get_llm_pool().aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+
+
+atexit.register(close_async_loops)
+
+
+@tracing.traced()
 def baseline_test(complex_query, scene_tag, k):
     logger = setup_logger("MyLogger", logging.DEBUG)
+    tracing.current_span().set(complex_query=complex_query, scene_tag=str(scene_tag), k=k)
     
     # 用于存储时间统计的列表
     time_stats = []
@@ -49,8 +90,10 @@ def baseline_test(complex_query, scene_tag, k):
         final_answer, final_prompt, time_stats
 
 
+@tracing.traced()
 def method1_test(complex_query, scene_tag, k):
     logger = setup_logger("MyLogger", logging.DEBUG)
+    tracing.current_span().set(complex_query=complex_query, scene_tag=str(scene_tag), k=k)
     
     # 用于存储时间统计的列表
     time_stats = []
@@ -109,6 +152,30 @@ def method1_test(complex_query, scene_tag, k):
         structured_evidence, final_answer, final_prompt, time_stats
 
 
+@tracing.traced()
+def method1_async_test(complex_query, scene_tag, k, pipeline="dataflow",
+                       max_concurrency=async_main.DEFAULT_MAX_CONCURRENCY, check_mode="single",
+                       precheck=False, route=False):
+    """
+    异步执行Method1，pipeline="dataflow"时每个子问题独立走完检索→回答→检查，
+    返回结构与method1_test一致
+    """
+    logger = setup_logger("MyLogger", logging.DEBUG)
+    tracing.current_span().set(complex_query=complex_query, scene_tag=str(scene_tag), k=k)
+
+    result = _run_async(async_main.run_method1(
+        complex_query, scene_tag, k, max_concurrency=max_concurrency, pipeline=pipeline,
+        check_mode=check_mode, precheck=precheck, route=route))
+    time_stats = result[-1]
+
+    # 打印时间统计
+    logger.info("时间统计:")
+    for func_name, duration in time_stats:
+        logger.info(f"  {func_name}: {duration:.4f}秒")
+
+    return result
+
+
 if __name__ == "__main__":
     baseline_test(
         "武汉5G高回落小区的主要原因是什么，它们的数量下降了多少，是否有可能通过调整某些技术手段来进一步减少回落现象？", 'wlyh', 5)
@@ -0,0 +1,5 @@
+# 测试从task10目录导入method1及各脚本模块
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
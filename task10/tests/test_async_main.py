@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+from method1 import async_main
+
+SUBQUESTIONS = ["武汉5G高回落小区的主要原因", "高回落与弱覆盖的关系", "高回落的优化措施"]
+
+
+async def _fake_chat(prompt, prompt_type=None, **kwargs):
+    # 与LLM响应缓存命中一样，不让出事件循环
+    if prompt_type == "check":
+        return json.dumps({"relevance": True, "faithfulness": True, "evidence_from_document": True})
+    return json.dumps({"answer": "答案"}, ensure_ascii=False)
+
+
+async def _fake_query_faults(query_text, scene_tag, **kwargs):
+    await asyncio.sleep(0.01)
+    return {"data": {"context": [{"doc_name": "规范", "text": f"{query_text}的排查方法。",
+                                  "url": "", "img_url": ""}]}}
+
+
+def test_speculative_retrieval_with_more_subquestions_than_concurrency(monkeypatch):
+    monkeypatch.setattr(async_main, "_lookup_decomposition", lambda query: list(SUBQUESTIONS))
+    monkeypatch.setattr(async_main, "achat_completions4", _fake_chat)
+    monkeypatch.setattr(async_main, "aquery_faults", _fake_query_faults)
+
+    async def _run():
+        return await asyncio.wait_for(async_main.run_method1(
+            "武汉5G高回落小区的主要原因是什么？", "wlyh", max_concurrency=2,
+            speculative_retrieval=True), timeout=5)
+
+    subquestions, subquestions_docs, *_ = asyncio.run(_run())
+    assert subquestions == SUBQUESTIONS
+    assert [subq for subq, _ in subquestions_docs] == SUBQUESTIONS
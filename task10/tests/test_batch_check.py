@@ -0,0 +1,38 @@
+import json
+
+from method1 import main
+
+
+def _answers():
+    docs = [{"doc_name": "规范", "text": "MOS质差通常由上行干扰引起。", "url": "", "img_url": ""}]
+    return [(f"子问题{i}", docs, {"answer": f"答案{i}", "reference": ""}) for i in range(3)]
+
+
+def test_string_verdicts():
+    response = json.dumps([
+        {"index": 1, "relevance": "false", "faithfulness": "true", "evidence_from_document": True},
+        {"index": 2, "relevance": "True", "faithfulness": "FALSE", "evidence_from_document": False},
+        {"index": 3, "relevance": "yes", "faithfulness": True, "evidence_from_document": True},
+    ])
+    assert main._parse_batch_check(None, response, [0, 1, 2]) == {
+        0: {"relevance": False, "faithfulness": True, "evidence_from_document": True},
+        1: {"relevance": True, "faithfulness": False, "evidence_from_document": False},
+    }
+
+
+def test_unrecognized_verdict_falls_back_to_single_check(monkeypatch):
+    batch = json.dumps([
+        {"index": i, "relevance": "true", "faithfulness": "true", "evidence_from_document": "true"}
+        for i in (1, 2)] + [
+        {"index": 3, "relevance": "maybe", "faithfulness": "true", "evidence_from_document": "true"}])
+    single = json.dumps({"relevance": "false", "faithfulness": True, "evidence_from_document": True})
+    prompts = []
+
+    def _fake_complete_json(prompt, prompt_type):
+        prompts.append(prompt_type)
+        return batch if prompt_type == "batch_check" else single
+
+    monkeypatch.setattr(main, "_complete_json", _fake_complete_json)
+    checked = main.check_faithfulness_and_relevance_batch(_answers())
+    assert prompts == ["batch_check", "check"]
+    assert [item["relevance"] for item in checked] == [True, True, False]
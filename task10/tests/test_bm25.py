@@ -0,0 +1,69 @@
+import pytest
+
+from method1 import bm25
+from method1.bm25 import BM25Index, HybridRetriever, reciprocal_rank_fusion
+
+
+@pytest.fixture(autouse=True)
+def bigram_tokenizer():
+    # 不依赖本地是否安装jieba
+    bm25.configure_tokenizer(use_jieba=False)
+    yield
+    bm25.configure_tokenizer(use_jieba=True)
+
+
+DOCS = [
+    {"doc_name": "干扰", "text": "MOS质差通常由上行干扰引起，需排查干扰源。"},
+    {"doc_name": "回落", "text": "5G高回落小区需检查邻区配置和time-to-trigger参数。"},
+    {"doc_name": "覆盖", "text": "弱覆盖区域可调整天线下倾角。"},
+]
+
+
+def _index():
+    index = BM25Index()
+    index.add_documents(DOCS[:2], "wlyh")
+    index.add_documents(DOCS[2:], "wxwy")
+    return index
+
+
+def test_tokenize_terms_and_bigrams():
+    tokens = bm25.tokenize("5G高回落 Time-To-Trigger")
+    assert {"5g", "time-to-trigger", "time", "trigger", "高回", "回落"} <= set(tokens)
+
+
+def test_search_ranks_and_filters_by_tag():
+    index = _index()
+    rows = index.search("高回落 time-to-trigger", "wlyh")
+    assert [index.doc(row)["doc_name"] for row, _ in rows] == ["回落"]
+    assert index.search("天线下倾角", "wlyh") == []
+    assert [doc["doc_name"] for doc in
+            index.query_faults("天线下倾角", ["wlyh", "wxwy"])["data"]["context"]] == ["覆盖"]
+
+
+def test_incremental_add_and_dedup():
+    index = _index()
+    assert index.add_documents([dict(DOCS[0])], "wlyh") == 0
+    assert len(index) == 3
+    assert index.add_documents([{"doc_name": "新", "text": "PDCP丢包需检查传输。"}], "wlyh") == 1
+    assert index.doc(index.search("pdcp丢包", "wlyh")[0][0])["doc_name"] == "新"
+
+
+def test_reciprocal_rank_fusion():
+    a, b, c = ({"text": text} for text in ("甲", "乙", "丙"))
+    fused = reciprocal_rank_fusion([[a, b], [b, c], [b, a]], k=60)
+    assert fused == [b, a, c]
+    assert reciprocal_rank_fusion([[a, b], [b, c]], top_k=1) == [b]
+
+
+def test_hybrid_retriever_merges_dense_and_sparse():
+    class _Dense(bm25.Retriever):
+        def query_faults(self, query_text, scene_tag, province_tag="hq", top_k=5,
+                         score_threshold=0.5):
+            return {"data": {"context": [dict(DOCS[0]), dict(DOCS[1])]}}
+
+    hybrid = HybridRetriever(dense=_Dense(), sparse=_index())
+    assert not hybrid.rewrites
+    docs = hybrid.query_faults("高回落 time-to-trigger", "wlyh", top_k=2)["data"]["context"]
+    assert [doc["doc_name"] for doc in docs] == ["回落", "干扰"]
+    with pytest.raises(ValueError):
+        HybridRetriever()
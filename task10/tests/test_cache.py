@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import pytest
+import requests
+
+from method1 import cache as cache_module
+from method1.cache import LRUCache, SQLiteCache, SingleFlight, TieredCache, retrieval_cache_key
+from method1.tools import RetrievalClient
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def _fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "结果"
+
+    async def _run():
+        return await asyncio.gather(*[flight.run("key", _fetch) for _ in range(3)])
+
+    assert asyncio.run(_run()) == ["结果"] * 3
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 2}
+
+
+def test_single_flight_cancelled_waiter_leaves_leader_running():
+    flight = SingleFlight()
+
+    async def _fetch():
+        await asyncio.sleep(0.02)
+        return "结果"
+
+    async def _run():
+        leader = asyncio.ensure_future(flight.run("key", _fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.run("key", _fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(_run()) == "结果"
+
+
+def test_single_flight_waiter_retries_when_leader_cancelled():
+    flight = SingleFlight()
+
+    async def _fetch():
+        await asyncio.sleep(0.02)
+        return "结果"
+
+    async def _run():
+        leader = asyncio.ensure_future(flight.run("key", _fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.run("key", _fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(_run()) == "结果"
+    assert flight.stats()["leaders"] == 2
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_max_bytes_and_ttl(monkeypatch):
+    cache = LRUCache(maxsize=10, max_bytes=10)
+    cache.set("a", "x", size=6)
+    cache.set("b", "y", size=6)
+    assert cache.get("a") is None and cache.get("b") == "y"
+
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = LRUCache(ttl=60)
+    cache.set("a", 1)
+    now[0] += 61
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_sqlite_tier_survives_restart_and_backfills_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = TieredCache(LRUCache(), SQLiteCache(path))
+    cache.set("key", {"data": {"context": ["文档"]}})
+    cache.close()
+
+    cache = TieredCache(LRUCache(), SQLiteCache(path))
+    assert cache.get("key") == {"data": {"context": ["文档"]}}
+    assert cache.get("key") == {"data": {"context": ["文档"]}}
+    stats = cache.stats()
+    assert (stats["disk"]["hits"], stats["memory"]["hits"]) == (1, 1)
+    cache.close()
+
+
+def test_sqlite_evicts_by_access_time(tmp_path, monkeypatch):
+    now = [1000.0]
+
+    def _tick():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(cache_module.time, "time", _tick)
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=10)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    assert cache.get("a") == "12345"
+    cache.set("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+    assert cache.stats()["evictions"] == 1
+    cache.close()
+
+
+def test_retrieval_cache_key_normalizes_query():
+    assert retrieval_cache_key("ＭＯＳ质差  原因？", ["wlyh", "pm"]) == \
+        retrieval_cache_key("mos质差 原因", ["pm", "wlyh"])
+    assert retrieval_cache_key("MOS质差", "wlyh", top_k=5) != \
+        retrieval_cache_key("MOS质差", "wlyh", top_k=10)
+
+
+class _Response:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+        self.content = json.dumps(payload).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+        self.raw = None
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+
+    def json(self):
+        return self._payload
+
+
+def test_retrieval_client_caches_only_successful_results():
+    responses = [_Response(500, {}), _Response(200, {"data": {"context": []}})]
+    client = RetrievalClient(cache=TieredCache(LRUCache()))
+    posts = []
+
+    def _post(url, data=None, timeout=None):
+        posts.append(data)
+        return responses[len(posts) - 1]
+
+    client.session.post = _post
+    assert "error" in client.query_faults("MOS质差", "wlyh")
+    assert client.query_faults("MOS质差", "wlyh") == {"data": {"context": []}}
+    assert client.query_faults("MOS质差？", "wlyh") == {"data": {"context": []}}
+    assert len(posts) == 2
+    client.close()
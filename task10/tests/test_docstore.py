@@ -0,0 +1,29 @@
+from method1.docstore import DocumentStore
+
+URL = "https://kb.example.com/doc/1"
+
+
+def _doc(text, url=URL, name="基站远程验收规范"):
+    return {"doc_name": name, "text": text, "url": url, "img_url": ""}
+
+
+def test_same_url_distinct_chunks_are_kept():
+    chunks = [
+        "基站远程验收需要先确认传输链路正常，再检查小区状态和告警。",
+        "MOS质差的常见原因包括上行干扰、弱覆盖以及切换失败。",
+        "4G与5G锚点站的配置核查项包括X2链路和邻区关系。",
+    ]
+    store = DocumentStore()
+    doc_ids = store.add_many([_doc(text) for text in chunks])
+    assert doc_ids == ["D1", "D2", "D3"]
+    assert [store.get(doc_id)["text"] for doc_id in doc_ids] == chunks
+    assert store.stats()["exact_duplicates"] == 0
+
+
+def test_same_text_is_deduplicated_across_urls():
+    text = "基站远程验收需要先确认传输链路正常，再检查小区状态和告警。"
+    store = DocumentStore()
+    assert store.add(_doc(text)) == "D1"
+    assert store.add(_doc(text.replace("，", "， "), url="https://kb.example.com/doc/2")) == "D1"
+    assert store.stats()["exact_duplicates"] == 1
+    assert len(store) == 1
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+TASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("numpy", "langchain_core", "pydantic", "openai", "requests")
+
+
+@pytest.mark.parametrize("module", ["method1.main", "method1.async_main", "batch_runner", "server"])
+def test_entry_modules_import_no_heavy_dependencies(module):
+    code = (f"import sys, {module}; "
+            f"print(','.join(name for name in {HEAVY!r} if name in sys.modules))")
+    loaded = subprocess.run([sys.executable, "-c", code], cwd=TASK_DIR, capture_output=True,
+                            text=True, check=True).stdout.strip()
+    assert loaded == ""
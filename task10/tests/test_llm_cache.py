@@ -0,0 +1,101 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from method1 import tools
+
+
+def _completion(content, finish_reason="stop"):
+    return ChatCompletion.model_validate({
+        "id": "resp", "object": "chat.completion", "created": 0, "model": "mock",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                     "finish_reason": finish_reason}],
+    })
+
+
+def _chunk(content, finish_reason=None):
+    return ChatCompletionChunk.model_validate({
+        "id": "resp", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+    })
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+class _Pool:
+    model = "mock"
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def _create(self, model, messages, stream=False):
+        self.requests += 1
+        return self.responses.pop(0)
+
+    def client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._create)))
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+
+@pytest.fixture
+def llm_cache():
+    cache = tools.configure_llm_cache()
+    yield cache
+    tools.configure_llm_cache()
+
+
+def _is_json(content):
+    try:
+        json.loads(content)
+    except ValueError:
+        return False
+    return True
+
+
+def test_unparseable_response_not_cached(monkeypatch, llm_cache):
+    pool = _Pool([_completion('{"answer": "截断'), _completion('{"answer": "完整"}')])
+    monkeypatch.setattr(tools, "get_llm_pool", lambda: pool)
+    assert tools.chat_completions4("prompt", validate=_is_json).choices[0].message.content \
+        == '{"answer": "截断'
+    assert tools.chat_completions4("prompt", validate=_is_json).choices[0].message.content \
+        == '{"answer": "完整"}'
+    assert tools.chat_completions4("prompt", validate=_is_json).choices[0].message.content \
+        == '{"answer": "完整"}'
+    assert pool.requests == 2
+
+
+def test_stream_keeps_real_finish_reason(monkeypatch, llm_cache):
+    pool = _Pool([_Stream([_chunk('{"answer": '), _chunk('"部分"}', "length")])])
+    monkeypatch.setattr(tools, "get_llm_pool", lambda: pool)
+    assert "".join(tools.chat_completions4("prompt", stream=True)) == '{"answer": "部分"}'
+    _, cached = tools._llm_cache_get("mock", "prompt", True)
+    assert cached.choices[0].finish_reason == "length"
+
+
+def test_incomplete_stream_not_cached(monkeypatch, llm_cache):
+    pool = _Pool([_Stream([_chunk('{"answer": "部')]), _Stream([_chunk('{"answer": "完整"}', "stop")])])
+    monkeypatch.setattr(tools, "get_llm_pool", lambda: pool)
+    assert "".join(tools.chat_completions4("prompt", stream=True)) == '{"answer": "部'
+    assert "".join(tools.chat_completions4("prompt", stream=True)) == '{"answer": "完整"}'
+    assert "".join(tools.chat_completions4("prompt", stream=True)) == '{"answer": "完整"}'
+    assert pool.requests == 2
@@ -0,0 +1,49 @@
+import pytest
+
+from method1 import packing
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # 不依赖本地是否安装tiktoken，按estimate_tokens计数（中文1字1个token）
+    monkeypatch.setattr(packing, "_tokenizer", False)
+    packing.reset_packing_stats()
+    yield
+    packing.reset_packing_stats()
+
+
+def _doc(text, name="规范"):
+    return {"doc_name": name, "text": text, "url": "", "img_url": ""}
+
+
+def test_under_budget_returned_unchanged():
+    docs = [_doc("上行干扰导致MOS质差。")]
+    assert packing.pack_documents("MOS质差", docs, 100) is docs
+
+
+def test_most_relevant_sentences_kept_in_original_order():
+    docs = [_doc("天气晴朗适合出行。上行干扰会导致MOS质差。"),
+            _doc("弱覆盖也会导致MOS质差。今天的午饭很好吃。")]
+    packed = packing.pack_documents("MOS质差的原因", docs, 25)
+    assert [doc["text"] for doc in packed] == ["上行干扰会导致MOS质差。", "弱覆盖也会导致MOS质差。"]
+    stats = packing.packing_stats()["answer"]
+    assert stats["calls"] == 1 and stats["tokens_after"] <= 25
+
+
+def test_sentence_over_budget_is_truncated():
+    text = "高回落小区需要排查邻区配置和切换参数" * 10
+    packed = packing.pack_documents("高回落小区排查", [_doc(text)], 30)
+    assert len(packed) == 1
+    assert text.startswith(packed[0]["text"])
+    assert packing.count_tokens(packed[0]["text"]) == 30
+
+
+def test_truncate_to_tokens():
+    assert packing.truncate_to_tokens("上行干扰abcdefgh", 5) == "上行干扰abcd"
+    assert packing.truncate_to_tokens("上行干扰", 0) == ""
+
+
+def test_irrelevant_sentence_not_truncated_into_leftover_budget():
+    docs = [_doc("上行干扰会导致MOS质差。天气晴朗适合出行，今天的午饭很好吃。")]
+    packed = packing.pack_documents("MOS质差", docs, 20)
+    assert [doc["text"] for doc in packed] == ["上行干扰会导致MOS质差。"]
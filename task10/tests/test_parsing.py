@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+
+from method1.parsing import JsonStringFieldExtractor, extract_json_string_field
+
+EMOJI = "\U0001F600"
+
+
+def _stream(text, size):
+    extractor = JsonStringFieldExtractor()
+    out = "".join(extractor.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return out + extractor.finish()
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 100])
+def test_surrogate_pairs_across_chunks(size):
+    text = json.dumps({"answer": f"质差{EMOJI}原因"})
+    assert _stream(text, size) == f"质差{EMOJI}原因"
+
+
+@pytest.mark.parametrize("size", [1, 3, 100])
+def test_lone_high_surrogate_at_end_of_input(size):
+    assert _stream('{"answer": "质差\\ud83d', size) == "质差�"
+    assert extract_json_string_field('{"answer": "质差\\ud83d') == "质差�"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"answer": "a\\ud83d"}', "a�"),
+    ('{"answer": "a\\ud83db"}', "a�b"),
+    ('{"answer": "a\\ud83d\\n"}', "a�\n"),
+    ('{"answer": "a\\ud83d\\u0041"}', "a�A"),
+    ('{"answer": "a\\ud83d\\ud83d\\ude00"}', f"a�{EMOJI}"),
+    ('{"answer": "a\\ude00"}', "a�"),
+])
+def test_unpaired_surrogates_become_replacement_char(text, expected):
+    assert _stream(text, 1) == expected
+    assert extract_json_string_field(text) == expected
+
+
+def test_final_answer_stream_async_iteration():
+    from method1.main import FinalAnswerStream
+
+    content = json.dumps({"answer": f"检查上行干扰{EMOJI}"}, ensure_ascii=True)
+
+    async def _chunks():
+        for i in range(0, len(content), 5):
+            yield content[i:i + 5]
+
+    async def _collect(stream):
+        return "".join([text async for text in stream])
+
+    stream = FinalAnswerStream(None, "prompt", _chunks())
+    assert asyncio.run(_collect(stream)) == f"检查上行干扰{EMOJI}"
+    assert stream.final_answer == {"answer": f"检查上行干扰{EMOJI}"}
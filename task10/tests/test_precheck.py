@@ -0,0 +1,43 @@
+from method1 import precheck
+
+DOCS = [{"doc_name": "规范", "text": "MOS质差通常由上行干扰引起，需要排查干扰源并调整功控参数。",
+         "url": "", "img_url": ""}]
+
+
+def test_supported_answer_settled_positive():
+    check = precheck.precheck_answer("MOS质差的原因", DOCS, {
+        "answer": "MOS质差通常由上行干扰引起",
+        "reference": "MOS质差通常由上行干扰引起，需要排查干扰源"})
+    assert check == {"relevance": True, "faithfulness": True, "evidence_from_document": True,
+                     "reason": "supported"}
+
+
+def test_clear_failures_settled_negative():
+    assert precheck.precheck_answer("MOS质差的原因", DOCS, {"answer": " ", "reference": ""})[
+        "reason"] == "empty_answer"
+    assert precheck.precheck_answer("MOS质差的原因", DOCS, {
+        "answer": "天线倾角过大", "reference": "天线倾角过大导致越区覆盖"})[
+        "reason"] == "reference_not_in_documents"
+
+
+def test_ambiguous_cases_go_to_llm():
+    # 没有文档，或引用部分来自文档
+    assert precheck.precheck_answer("MOS质差的原因", [], {"answer": "上行干扰"}) is None
+    assert precheck.precheck_answer("MOS质差的原因", DOCS, {
+        "answer": "需要调整功控参数", "reference": "需要调整功控参数，并检查天线倾角和方位角设置"}) is None
+
+
+def test_split_prechecked_counts():
+    precheck.reset_precheck_stats()
+    answers = [
+        ("MOS质差的原因", DOCS, {"answer": "MOS质差通常由上行干扰引起",
+                            "reference": "MOS质差通常由上行干扰引起"}),
+        ("MOS质差的原因", [], {"answer": "上行干扰", "reference": ""}),
+        ("MOS质差的原因", DOCS, {"answer": "", "reference": ""}),
+    ]
+    settled, pending = precheck.split_prechecked(answers)
+    assert sorted(settled) == [0, 2] and pending == [1]
+    assert settled[0]["precheck"] == "supported" and settled[2]["relevance"] is False
+    stats = precheck.precheck_stats()
+    assert (stats["checked"], stats["llm_calls_avoided"], stats["sent_to_llm"]) == (3, 2, 1)
+    precheck.reset_precheck_stats()
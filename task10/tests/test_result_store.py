@@ -0,0 +1,89 @@
+import glob
+import json
+import os
+
+import pytest
+
+from method1.result_store import ResultStore, import_outputs
+
+OUTPUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "outputs", "*.json")
+
+
+@pytest.fixture(params=["jsonl", "parquet"])
+def backend(request):
+    if request.param == "parquet":
+        pytest.importorskip("pyarrow")
+    return request.param
+
+
+def _dumps(record):
+    # 不排序字段，字段名和顺序也要一致
+    return json.dumps(record, ensure_ascii=False)
+
+
+def test_outputs_round_trip(tmp_path, backend):
+    paths = sorted(glob.glob(OUTPUTS))
+    if not paths:
+        pytest.skip("没有outputs/*.json")
+    with ResultStore(str(tmp_path), backend=backend) as store:
+        assert import_outputs(store, OUTPUTS) == len(paths)
+        assert import_outputs(store, OUTPUTS) == 0
+
+    store = ResultStore(str(tmp_path), readonly=True)
+    assert store.backend == backend
+    rows = list(store.iter_runs(("run_id", "source", "method")))
+    assert sorted(row["source"] for row in rows) == [os.path.basename(path) for path in paths]
+    for row in rows:
+        with open(os.path.join(os.path.dirname(OUTPUTS), row["source"]), encoding="utf-8") as f:
+            original = json.load(f)
+        assert _dumps(store.load_record(row["run_id"])) == _dumps(original)
+        assert row["method"] == row["source"][:-len(".json")].rsplit("_", 1)[-1]
+
+    texts = {doc["text"] for path in paths for doc in _docs(json.load(open(path, encoding="utf-8")))}
+    assert store.stats()["docs"]["rows"] == len(texts)
+
+
+def _docs(record):
+    for _, docs in record.get("subquestions_docs") or []:
+        yield from docs
+    for item in record.get("checked_subquestions_docs_subanswer") or []:
+        yield from item["docs_per_subq"]
+
+
+def test_batch_runner_records_round_trip(tmp_path, backend):
+    doc = {"text": "MOS质差通常由上行干扰引起。", "doc_name": "规范", "url": "", "score": 0.8}
+    records = [
+        {"id": "q1", "method": "baseline", "complex_query": "q", "final_answer": {"answer": "a"},
+         "final_prompt": "prompt", "subquestions": ["s"], "subquestions_docs": [["s", [doc]]],
+         "timestatus": [["generate_subquestions", 1.5]], "elapsed": 2.0, "scene_tag": "wlyh"},
+        {"id": "q2", "method": "method1", "complex_query": "q", "error": "Timeout", "elapsed": 1.0,
+         "timestatus": []},
+        {"id": "q3", "method": "method1", "complex_query": "q",
+         "final_answer": {"answer": "a", "reference": ["D1"]}, "timestatus": []},
+    ]
+    with ResultStore(str(tmp_path), backend=backend) as store:
+        run_ids = [store.append(record) for record in records]
+        assert store.append(records[0]) is None
+    store = ResultStore(str(tmp_path), readonly=True)
+    for run_id, record in zip(run_ids, records):
+        assert _dumps(store.load_record(run_id)) == _dumps(record)
+    latencies = store.stage_latencies()
+    assert latencies == {"baseline": {"generate_subquestions": [1.5]}, "method1": {}}
+    answers = [row["final_answer"] for row in store.iter_runs(("final_answer",))]
+    assert answers == ["a", None, "a"]
+
+
+def test_jsonl_repairs_partial_rows(tmp_path):
+    with ResultStore(str(tmp_path), backend="jsonl") as store:
+        store.append({"id": "q1", "method": "baseline", "complex_query": "q", "timestatus": []})
+    # 模拟写到一半崩溃：一列多出不完整的一行，另一列缺少最后一行的换行
+    with open(tmp_path / "runs" / "timestatus.jsonl", "a", encoding="utf-8") as f:
+        f.write('[{"stage"')
+    with open(tmp_path / "runs" / "id.jsonl", "rb+") as f:
+        f.truncate(os.path.getsize(tmp_path / "runs" / "id.jsonl") - 1)
+
+    assert ResultStore(str(tmp_path), readonly=True).stats()["runs"]["rows"] == 0
+    with ResultStore(str(tmp_path)) as store:
+        assert store.append({"id": "q1", "method": "baseline", "complex_query": "q",
+                             "timestatus": []}) is not None
+        assert [row["id"] for row in store.iter_runs(("id",))] == ["q1"]
@@ -0,0 +1,69 @@
+import pytest
+
+from method1 import tools
+from method1.retriever import LocalVectorRetriever, Retriever, TaggedIndex
+
+DOCS = [
+    {"doc_name": "干扰", "text": "MOS质差通常由上行干扰引起，需排查干扰源。"},
+    {"doc_name": "回落", "text": "5G高回落小区需检查邻区配置和切换参数。"},
+    {"doc_name": "覆盖", "text": "弱覆盖区域可调整天线下倾角。"},
+]
+
+
+def _retriever():
+    retriever = LocalVectorRetriever(score_threshold=0.0)
+    retriever.add_documents(DOCS[:2], "wlyh")
+    retriever.add_documents(DOCS[2:], "wxwy")
+    return retriever
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        Retriever()
+    with pytest.raises(TypeError):
+        TaggedIndex()
+
+
+def test_query_filters_by_tag():
+    retriever = _retriever()
+    docs = retriever.query_faults("5G高回落小区的邻区配置", "wlyh", top_k=1)["data"]["context"]
+    assert [doc["doc_name"] for doc in docs] == ["回落"]
+    docs = retriever.query_faults("天线下倾角", ["wlyh", "wxwy"], top_k=1)["data"]["context"]
+    assert [doc["doc_name"] for doc in docs] == ["覆盖"]
+    assert retriever.query_faults("天线下倾角", "other")["data"]["context"] == []
+
+
+def test_same_text_stored_once_with_both_tags():
+    retriever = _retriever()
+    assert retriever.add_documents([dict(DOCS[2])], "wlyh") == 0
+    assert len(retriever) == 3
+    assert retriever.tags() == {"wlyh|hq": 3, "wxwy|hq": 1}
+
+
+def test_query_faults_many_keeps_order():
+    retriever = _retriever()
+    results = retriever.query_faults_many(["天线下倾角", "MOS质差 上行干扰"], ["wlyh", "wxwy"],
+                                          top_k=1)
+    assert [result["data"]["context"][0]["doc_name"] for result in results] == ["覆盖", "干扰"]
+
+
+def test_save_and_load(tmp_path):
+    retriever = _retriever()
+    retriever.save(str(tmp_path))
+    loaded = LocalVectorRetriever.load(str(tmp_path), score_threshold=0.0)
+    assert len(loaded) == 3 and loaded.tags() == retriever.tags()
+    query = ("5G高回落小区的邻区配置", "wlyh")
+    assert loaded.query_faults(*query) == retriever.query_faults(*query)
+    # mmap加载的只读矩阵在入库时复制到内存
+    assert loaded.add_documents([{"doc_name": "新", "text": "PDCP丢包需检查传输。"}], "wlyh") == 1
+    assert len(loaded) == 4
+
+
+def test_set_retriever_replaces_backend():
+    retriever = _retriever()
+    tools.set_retriever(retriever)
+    try:
+        result = tools.query_faults("天线下倾角", "wxwy", top_k=1)
+        assert [doc["doc_name"] for doc in result["data"]["context"]] == ["覆盖"]
+    finally:
+        tools.set_retriever(None)
@@ -0,0 +1,43 @@
+from method1 import routing
+
+
+def test_classify_query():
+    assert routing.classify_query("MOS质差的原因是什么？")["route"] == "simple"
+    decision = routing.classify_query("武汉5G高回落小区的主要原因是什么？应该如何优化，以及如何验证效果？")
+    assert decision["route"] == "complex"
+    assert decision["features"]["question_marks"] == 2
+
+
+def test_refine_subquestions_merges_and_caps():
+    subquestions = ["高回落的原因是什么", "高回落的原因是什么？", "如何优化高回落", "如何验证优化效果"]
+    kept, merged, capped = routing.refine_subquestions(subquestions, max_subquestions=2)
+    assert kept == ["高回落的原因是什么", "如何优化高回落"]
+    assert [item[:2] for item in merged] == [("高回落的原因是什么？", "高回落的原因是什么")]
+    assert capped == ["如何验证优化效果"]
+
+
+def test_refine_subquestions_with_embedder():
+    class _Embedder:
+        def encode(self, texts):
+            import numpy as np
+            return np.array([[1.0, 0.0] if "原因" in text else [0.0, 1.0] for text in texts])
+
+    kept, merged, _ = routing.refine_subquestions(
+        ["高回落的原因", "导致高回落的原因", "优化措施"], embedder=_Embedder())
+    assert kept == ["高回落的原因", "优化措施"]
+    assert merged == [("导致高回落的原因", "高回落的原因", 1.0)]
+
+
+def test_route_breakdown_and_stats():
+    routing.reset_routing_stats()
+    simple = routing.record_route(routing.route_breakdown(
+        "MOS质差的原因", {"route": "simple", "score": 0.0, "features": {}}))
+    # 简单问题：1次融合 + 1次检索，相对拆出5个子问题的完整链路
+    assert (simple["llm_calls"], simple["llm_calls_saved"], simple["retrievals_saved"]) == (1, 11, 4)
+    complex_ = routing.record_route(routing.route_breakdown(
+        "问题", {"route": "complex", "score": 2.0, "features": {}},
+        generated=["a", "b", "c"], kept=["a", "b"], check_mode="batch"))
+    assert (complex_["llm_calls"], complex_["llm_calls_saved"]) == (5, 1)
+    stats = routing.routing_stats()
+    assert (stats["queries"], stats["simple"], stats["llm_calls_saved"]) == (2, 1, 12)
+    routing.reset_routing_stats()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from method1.scheduler import LLMScheduler
+
+
+def test_higher_priority_admitted_first():
+    # 每0.1秒补充1个请求令牌，容量1
+    scheduler = LLMScheduler(rpm=600, burst_seconds=0.1)
+    order = []
+
+    async def _request(prompt_type):
+        ticket = await scheduler.aacquire(prompt_type)
+        order.append(prompt_type)
+        ticket.settle()
+
+    async def _run():
+        scheduler.acquire("decompose").settle()
+        tasks = [asyncio.ensure_future(_request("check"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(_request("final")))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(_run())
+    assert order == ["final", "check"]
+    stats = scheduler.stats()
+    assert stats["admitted"] == 3 and stats["queue_depth"] == 0
+    assert stats["by_prompt_type"]["check"]["wait_max"] >= 0.1
+
+
+def test_tpm_reservation_settled_with_actual_usage():
+    scheduler = LLMScheduler(tpm=60000, completion_tokens=100)
+    ticket = scheduler.acquire("subanswer", prompt_tokens=50)
+    assert ticket.tokens == 150
+    ticket.settle(80)
+    ticket.settle(80)
+    stats = scheduler.stats()
+    assert (stats["tokens_reserved"], stats["tokens_settled"]) == (150, 80)
+
+
+def test_throttle_pauses_admission():
+    scheduler = LLMScheduler(rpm=6000)
+    scheduler.throttle(0.2)
+    start_time = time.monotonic()
+    scheduler.acquire("check").settle()
+    assert time.monotonic() - start_time >= 0.19
+    assert scheduler.stats()["throttled"] == 1
+
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = LLMScheduler(rpm=60, burst_seconds=0.1)
+
+    async def _run():
+        scheduler.acquire("decompose")
+        task = asyncio.ensure_future(scheduler.aacquire("check"))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queue_depth"] == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(_run())
+    assert scheduler.stats()["queue_depth"] == 0
@@ -0,0 +1,49 @@
+import pytest
+
+from method1 import semantic_cache
+from method1.semantic_cache import SemanticCache, configure_semantic_cache
+
+QUERY = "武汉市5G小区在晚高峰时段下行速率明显下降，同时MOS质差比升高，PDCP层丢包率是否是主要原因，应如何排查和优化？"
+
+
+@pytest.fixture(autouse=True)
+def _reset_shared_caches():
+    yield
+    configure_semantic_cache(enabled=False)
+
+
+@pytest.mark.parametrize("old, new", [("武汉", "襄阳"), ("5G", "4G"), ("下降", "上升")])
+def test_key_term_swaps_do_not_hit(old, new):
+    cache = SemanticCache()
+    cache.add(QUERY, "answer")
+    swapped = QUERY.replace(old, new, 1)
+    # 哈希向量下这些问题的相似度都超过阈值
+    vectors = cache.embedder.encode([QUERY, swapped])
+    assert vectors[0] @ vectors[1] >= cache.threshold
+    assert cache.lookup(swapped) is None
+    assert cache.stats()["rejected"] == 1
+
+
+def test_key_terms_checked_for_any_embedder():
+    cache = SemanticCache(insert_only=False)
+    cache.add(QUERY, "answer")
+    assert cache.lookup(QUERY.replace("5G", "4G")) is None
+    assert cache.lookup(QUERY.replace("PDCP层", "PDCP")) is not None
+
+
+def test_insertions_still_hit():
+    cache = SemanticCache()
+    cache.add(QUERY, "answer")
+    hit = cache.lookup("请问" + QUERY.replace("明显", ""))
+    assert hit is not None and hit[0] == "answer"
+
+
+def test_answer_cache_disabled_for_hashing_embedder_by_default():
+    configure_semantic_cache()
+    assert semantic_cache.get_answer_cache() is None
+    assert semantic_cache.get_decomposition_cache() is not None
+    configure_semantic_cache(cache_answers=True)
+    cache = semantic_cache.get_answer_cache()
+    cache.add(QUERY, "answer", "wlyh")
+    for old, new in (("武汉", "襄阳"), ("5G", "4G")):
+        assert cache.lookup(QUERY.replace(old, new, 1), "wlyh") is None
@@ -0,0 +1,48 @@
+import asyncio
+import http.client
+import threading
+
+import pytest
+
+pytest.importorskip("h11")
+
+import server
+
+
+@pytest.fixture
+def h11_server():
+    app = server.RAGService()
+    srv = server.H11Server(app, "127.0.0.1", 0)
+    loop = asyncio.new_event_loop()
+    stop = asyncio.Event()
+    started = threading.Event()
+
+    async def run():
+        task = asyncio.ensure_future(srv.serve(stop))
+        while srv.port == 0 and not task.done():
+            await asyncio.sleep(0.01)
+        started.set()
+        await task
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True)
+    thread.start()
+    assert started.wait(30)
+    yield srv
+    loop.call_soon_threadsafe(stop.set)
+    thread.join(10)
+
+
+def test_keep_alive_when_body_is_not_read(h11_server):
+    # /health、404、405不读取请求体，同一连接上的后续请求仍应得到响应
+    conn = http.client.HTTPConnection("127.0.0.1", h11_server.port, timeout=10)
+    requests = [("GET", "/health", None), ("GET", "/health", None), ("GET", "/missing", None),
+                ("GET", "/missing", None), ("GET", "/baseline", None),
+                ("POST", "/missing", b'{"complex_query": "q"}'), ("GET", "/health", None)]
+    statuses = []
+    for method, path, body in requests:
+        conn.request(method, path, body=body)
+        response = conn.getresponse()
+        response.read()
+        statuses.append(response.status)
+    conn.close()
+    assert statuses == [200, 200, 404, 404, 405, 404, 200]
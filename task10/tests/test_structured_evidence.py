@@ -0,0 +1,22 @@
+from method1 import main
+from method1.packing import packing_stats, reset_packing_stats
+
+
+def _item(subquestion, checked):
+    return {
+        "subquestion": subquestion,
+        "docs_per_subq": [{"doc_name": "规范", "text": "MOS质差通常由上行干扰引起。弱覆盖也会导致质差。" * 20,
+                           "url": "", "img_url": ""}],
+        "answer": f"{subquestion}的答案",
+        "relevance": checked, "faithfulness": checked, "evidence_from_document": checked,
+    }
+
+
+def test_only_items_using_docs_are_packed():
+    reset_packing_stats()
+    items = [_item("质差原因", False), _item("干扰排查", True), _item("覆盖优化", True)]
+    evidence = main.build_structured_evidence(items, token_budget=100)
+    assert isinstance(evidence[0]["evidence"], list)
+    assert [e["evidence"] for e in evidence[1:]] == ["干扰排查的答案", "覆盖优化的答案"]
+    assert packing_stats()["final"]["calls"] == 1
+    reset_packing_stats()
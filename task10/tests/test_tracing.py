@@ -0,0 +1,60 @@
+import asyncio
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from method1 import tracing
+
+
+class _SlowCollector(http.server.BaseHTTPRequestHandler):
+    delay = 0.5
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.delay)
+        self.received.append(json.loads(body))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def collector():
+    _SlowCollector.received = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _SlowCollector)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/traces"
+    server.shutdown()
+    tracing.configure_tracing(enabled=False)
+
+
+def test_otlp_endpoint_export_does_not_block_span_end(collector):
+    tracing.configure_tracing(otlp_endpoint=collector)
+
+    async def request(i):
+        start = time.perf_counter()
+        with tracing.span("request", new_trace=True, index=i):
+            with tracing.span("llm.final", kind="llm"):
+                await asyncio.sleep(0)
+        return time.perf_counter() - start
+
+    async def run():
+        return await asyncio.gather(*(request(i) for i in range(4)))
+
+    durations = asyncio.run(run())
+    # collector每个trace耗时0.5秒，span结束时不等待发送
+    assert max(durations) < _SlowCollector.delay
+    tracing.flush_tracing()
+    assert len(_SlowCollector.received) == 4
+    spans = _SlowCollector.received[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert sorted(span["name"] for span in spans) == ["llm.final", "request"]